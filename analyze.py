@@ -34,13 +34,15 @@ import common as co
 import mptcp
 import os
 import os.path
+import resource
 import subprocess
 import sys
 import tcp
-import threading
+import time
 import traceback
 
 from multiprocessing import Process
+from multiprocessing.pool import Pool
 
 
 ##################################################
@@ -56,6 +58,18 @@ DEF_TRACE_DIR = 'traces'
 DEF_GRAPH_DIR = 'graphs'
 # The default number of threads
 DEF_NB_THREADS = 1
+# The default memory ceiling of each worker, in MB (0 means no limit)
+DEF_MAX_MEMORY = 0
+# The default maximal size of the cache of traces, in MB (0 means no limit)
+DEF_CACHE_SIZE = 0
+# The default budget of the scratch directory shared by workers, in MB (0 means no limit)
+DEF_SCRATCH_SIZE = 1024
+# Number of traces shown in the wall time summary
+NB_SLOWEST_TRACES = 10
+# Filename of the manifest of analyzed traces, in the graph directory (other output directories only contain pickled results)
+MANIFEST_FNAME = 'manifest'
+# External tools whose version is recorded in the manifest
+MANIFEST_TOOLS = ['mptcptrace', 'tstat', 'tcpcsm']
 
 ##################################################
 ##                   ARGUMENTS                  ##
@@ -70,14 +84,33 @@ parser.add_argument("-I",
 parser.add_argument("-t",
                     "--trace", help="temporary directory that will be used to store uncompressed "
                     + "pcap files", default=DEF_TRACE_DIR)
+parser.add_argument("--cache", help="directory of the content-addressed cache of traces, shared by all experiments",
+                    default=co.DEF_CACHE_DIR)
+parser.add_argument("--columns", help="directory of the cache of the TCP packet columns of traces, shared by all experiments "
+                    + "(empty to disable it)", default=co.DEF_COLUMNS_DIR)
+parser.add_argument("--cache-size", type=int, help="maximal size in MB of the traces of the cache that are not "
+                    + "linked to a trace anymore (the others use no space of their own), 0 for no limit",
+                    default=DEF_CACHE_SIZE)
+parser.add_argument("--mptcp-engine", help="how MPTCP connections are rebuilt: by mptcptrace, by the built-in engine reading the "
+                    + "packets (mptcptrace not needed), or by the built-in engine checked against mptcptrace (differences logged)",
+                    choices=mptcp.MPTCP_ENGINES, default=mptcp.MPTCP_ENGINE_MPTCPTRACE)
+parser.add_argument("--scratch", help="directory in a RAM-backed filesystem (ex. /dev/shm) where mptcptrace writes its many small "
+                    + "files, shared by all workers of the host (empty to use the working directory)", default='')
+parser.add_argument("--scratch-size", type=int, help="maximal size of the scratch directory used by all workers in MB, 0 for no limit; "
+                    + "traces that would exceed it are processed in the working directory", default=DEF_SCRATCH_SIZE)
 parser.add_argument("-g",
                     "--graph", help="directory where the graphs of the pcap files will be stored", default=DEF_GRAPH_DIR)
+parser.add_argument("--graph-archive", help="write the graph files of each MPTCP trace in one indexed archive in the graph directory "
+                    + "(see co.graph_archive) instead of thousands of files in its subdirectories", action="store_true")
+parser.add_argument("--compress-graph-archive", help="compress the archives of graph files (implies --graph-archive)", action="store_true")
 parser.add_argument("-s",
                     "--stat", help="directory where the stats of the pcap files will be stored", default=co.DEF_STAT_DIR)
 parser.add_argument("-a",
                     "--aggl", help="directory where data of agglomerated graphs will be stored", default=co.DEF_AGGL_DIR)
 parser.add_argument("-r",
                     "--rtt", help="directory where data of round-trip-time will be stored", default=co.DEF_RTT_DIR)
+parser.add_argument("--rtt-sketch", help="save the RTT samples of MPTCP connections as mergeable quantile sketches "
+                    + "(see co.QuantileSketch) instead of lists of all samples", action="store_true")
 parser.add_argument("-R",
                     "--rtt-subflow", help="directory where data of round-trip-time of subflows of MPTCP will be stored", default=co.DEF_RTT_SUBFLOW_DIR)
 parser.add_argument("-F",
@@ -88,12 +121,21 @@ parser.add_argument("-p", "--pcap",
                     help="analyze only pcap files containing the given string (default any, wlan0 and rmnet0)",
                     nargs="+", default=["_" + co.DEF_IFACE + ".", "_wlan0.", "_rmnet0."])
 parser.add_argument("-j",
-                    "--threads", type=int, help="process the analyse separated threads", default=DEF_NB_THREADS)
+                    "--threads", type=int, help="number of worker processes analyzing traces in parallel", default=DEF_NB_THREADS)
+parser.add_argument("--shards", type=int, help="number of processes processing the outputs of mptcptrace and computing the MPTCP DSS retransmissions of one trace "
+                    + "(so up to threads * shards processes); the DSS retransmissions are the same as with 1 only if the packets of traces are in "
+                    + "time order", default=1)
+parser.add_argument("-m",
+                    "--max-memory", type=int, help="address space limit of each worker process (and the tools it launches) in MB, 0 for no limit",
+                    default=DEF_MAX_MEMORY)
 parser.add_argument("-l",
                     "--stderr", help="log to stderr", action="store_true")
 parser.add_argument("-k",
                     "--keep", help="keep the original file with -k option of gunzip, if it exists",
                     action="store_true")
+parser.add_argument("-z",
+                    "--stream", help="read compressed traces directly instead of uncompressing them in the trace directory "
+                    + "(not compatible with -c, that needs to rewrite the traces)", action="store_true")
 parser.add_argument("-c",
                     "--clean", help="remove noisy traffic on lo", action="store_true")
 parser.add_argument("-C",
@@ -116,12 +158,18 @@ parser.add_argument("-L",
                     "--light", help="don't process RTT or throughput in detail to save time", action="store_true")
 parser.add_argument("-U",
                     "--tcpcsm", help="use tcpcsm to give more info about retransmissions", action="store_true")
+parser.add_argument("-f",
+                    "--force", help="analyze all traces, even those already analyzed with the same settings", action="store_true")
 
 args = parser.parse_args()
 
 in_dir_exp = os.path.abspath(os.path.expanduser(args.input))
 # ~/graphs -> /home/mptcp/graphs_lo ; ../graphs/ -> /home/mptcp/graphs_lo
 trace_dir_exp = co.get_dir_from_arg(args.trace, args.pcap[0])
+cache_dir_exp = co.get_dir_from_arg(args.cache)
+columns_dir_exp = co.get_dir_from_arg(args.columns) if args.columns else None
+scratch_dir_exp = co.get_dir_from_arg(args.scratch) if args.scratch else None
+graph_archive = args.graph_archive or args.compress_graph_archive
 graph_dir_exp = co.get_dir_from_arg(args.graph, args.pcap[0])
 stat_dir_exp = co.get_dir_from_arg(args.stat, args.pcap[0])
 aggl_dir_exp = co.get_dir_from_arg(args.aggl, args.pcap[0])
@@ -150,15 +198,98 @@ if args.stderr:
 else:
     print_out = sys.stdout
 
+##################################################
+##                   MANIFEST                   ##
+##################################################
+
+# Only analyzing traces produces results; correcting ones has to be done each time
+use_manifest = not args.dir_input and not args.not_graph and not args.force
+manifest_path = os.path.join(graph_dir_exp, MANIFEST_FNAME)
+manifest = co.load_object(manifest_path) if os.path.exists(manifest_path) else {}
+# Staged trace filepath -> (input filepath, fingerprint of the input)
+trace_inputs = {}
+
+
+def get_tool_version(tool):
+    """ Return an identifier of the version of the tool (path, size and modification time of its binary), None if not found """
+    for path_dir in os.environ.get('PATH', '').split(os.pathsep):
+        tool_path = os.path.join(path_dir, tool)
+        if os.path.isfile(tool_path) and os.access(tool_path, os.X_OK):
+            stat = os.stat(tool_path)
+            return tool_path, stat.st_size, stat.st_mtime
+    return None
+
+
+def get_analysis_settings():
+    """ Return what, except the trace itself, can change the results of its analysis """
+    return {'tools': dict([(tool, get_tool_version(tool)) for tool in MANIFEST_TOOLS]),
+            'flags': {'light': args.light, 'tcpcsm': args.tcpcsm, 'is_mptcp': args.is_mptcp, 'is_tcp': args.is_tcp,
+                      'min_bytes': str(args.min_bytes), 'clean': args.clean, 'use_db': args.use_db, 'rtt_sketch': args.rtt_sketch,
+                      'graph_archive': graph_archive, 'mptcp_engine': args.mptcp_engine}}
+
+analysis_settings = get_analysis_settings()
+
+
+def get_protocol(pcap_filepath):
+    """ Return 'mptcp' or 'tcp' depending on how the trace will be analyzed, None if it is not known """
+    # Prefix of the name determine the protocol used
+    pcap_filename = os.path.basename(pcap_filepath)
+    if args.is_mptcp or pcap_filename.startswith('mptcp'):
+        return 'mptcp'
+    elif args.is_tcp or pcap_filename.startswith('tcp'):
+        return 'tcp'
+    return None
+
+
+def get_output_files(pcap_filepath):
+    """ Return the paths of the files saved by the analysis of the trace """
+    if get_protocol(pcap_filepath) == 'mptcp':
+        output_dirs = [stat_dir_exp, rtt_dir_exp, acksize_dir_exp, acksize_tcp_dir_exp, failed_conns_dir_exp]
+    elif get_protocol(pcap_filepath) == 'tcp':
+        output_dirs = [stat_dir_exp, acksize_tcp_dir_exp]
+    else:
+        output_dirs = []
+    fname = os.path.basename(co.get_pcap_basepath(pcap_filepath))
+    output_files = [os.path.join(output_dir, fname) for output_dir in output_dirs]
+    if get_protocol(pcap_filepath) == 'mptcp' and graph_archive:
+        output_files.append(os.path.join(graph_dir_exp, fname + co.GRAPH_ARCHIVE_EXT))
+    return output_files
+
+
+def is_up_to_date(input_filepath, fingerprint):
+    """ Return True if the trace was already analyzed, is unchanged since then, with the same settings and results still there """
+    entry = manifest.get(input_filepath, None)
+    return (entry is not None and entry['fingerprint'] == fingerprint and entry['settings'] == analysis_settings
+            and all([os.path.exists(output_filepath) for output_filepath in entry['outputs']]))
+
+
+def record_in_manifest(pcap_filepath):
+    """ Save in the manifest that the trace was analyzed, if all its results are there """
+    if not use_manifest or pcap_filepath not in trace_inputs:
+        return
+    input_filepath, fingerprint = trace_inputs[pcap_filepath]
+    output_files = get_output_files(pcap_filepath)
+    if not output_files or not all([os.path.exists(output_filepath) for output_filepath in output_files]):
+        return
+
+    manifest[input_filepath] = {'fingerprint': fingerprint, 'settings': analysis_settings, 'outputs': output_files}
+    # Saved after each trace, so that a killed run can be resumed; a rename is atomic
+    co.save_object(manifest, manifest_path + '.tmp')
+    os.rename(manifest_path + '.tmp', manifest_path)
+
 ##################################################
 ##                 PREPROCESSING                ##
 ##################################################
 
 
-def uncompress_file(filename, dirpath):
+def uncompress_file(filename, dirpath, fingerprint=None):
     if any(match in filename for match in args.pcap):
         # Files from UI tests will be compressed; unzip them
-        if filename.endswith('.pcap.gz'):
+        if filename.endswith('.pcap.gz') and args.stream and not args.clean:
+            # Tools and analyses will read the compressed file through a pipe
+            print("Streaming " + filename + " from " + dirpath, file=print_out)
+            return os.path.join(dirpath, filename)
+        elif filename.endswith('.pcap.gz'):
             output_filepath = os.path.join(trace_dir_exp, filename[:-3])
             # if args.not_correct:
             #     return output_filepath
@@ -181,36 +312,64 @@ def uncompress_file(filename, dirpath):
             output_filepath = os.path.join(trace_dir_exp, filename)
             # if args.not_correct:
             #     return output_filepath
-            if os.path.exists(output_filepath):
-                print("Do no copy file: already exists " + filename, file=sys.stderr)
-                return output_filepath
-            else:
-                # Move the file to out_dir_exp
-                print("Copying " + filename + " to " + trace_dir_exp, file=print_out)
-                cmd = ['cp', os.path.join(dirpath, filename), output_filepath]
-                if subprocess.call(cmd, stdout=print_out) != 0:
-                    print("Error when moving " + filename, file=sys.stderr)
-                else:
-                    return output_filepath
+            # Hard link from the cache; cleaning modifies the trace, so a copy is needed if links are not possible
+            staged_filepath = co.stage_pcap(os.path.join(dirpath, filename), output_filepath, cache_dir_exp,
+                                            cache_size=args.cache_size * 1024 * 1024, need_copy=args.clean, fingerprint=fingerprint,
+                                            print_out=print_out)
+            if staged_filepath:
+                return staged_filepath
+            print("Error when staging " + filename, file=sys.stderr)
         else:
             print(filename + ": not in a valid format, skipped", file=sys.stderr)
     return False
 
 
+def prepare_trace(filename, dirpath):
+    """ Return the filepath of the trace to analyze, or False if it is not valid or up to date according to the manifest
+        The fingerprint of the input is kept in trace_inputs, as the key of the cached columns of its staged trace
+    """
+    input_filepath = os.path.join(dirpath, filename)
+    fingerprint = None
+    if any(match in filename for match in args.pcap) and filename.endswith(('.pcap', '.pcap.gz')):
+        fingerprint = co.get_pcap_fingerprint(input_filepath)
+        stale_filepath = os.path.join(trace_dir_exp, filename[:-3])
+        if use_manifest:
+            if is_up_to_date(input_filepath, fingerprint):
+                print("Skip " + input_filepath + ": already analyzed with the same settings", file=print_out)
+                return False
+            if input_filepath in manifest and manifest[input_filepath]['fingerprint'] != fingerprint and filename.endswith('.pcap.gz') \
+                    and os.path.exists(stale_filepath):
+                # The trace changed since its last analysis: don't reuse its old uncompressed version
+                os.remove(stale_filepath)
+        elif filename.endswith('.pcap.gz') and os.path.exists(stale_filepath):
+            # Without manifest, nothing tells that this old uncompressed version comes from the current input
+            fingerprint = None
+
+    pcap_filepath = uncompress_file(filename, dirpath, fingerprint=fingerprint)
+    if pcap_filepath and fingerprint:
+        trace_inputs[pcap_filepath] = (input_filepath, fingerprint)
+    return pcap_filepath
+
+
 def add_if_valid(list, item):
     if item:
         list.append(item)
 
 pcap_list = []
 co.check_directory_exists(trace_dir_exp)
+co.check_directory_exists(cache_dir_exp)
+if columns_dir_exp:
+    co.check_directory_exists(columns_dir_exp)
+if scratch_dir_exp:
+    co.check_directory_exists(scratch_dir_exp)
 if not args.dir_input:
     if os.path.isdir(in_dir_exp):
         for dirpath, dirnames, filenames in os.walk(in_dir_exp):
             for filename in filenames:
-                add_if_valid(pcap_list, uncompress_file(filename, dirpath))
+                add_if_valid(pcap_list, prepare_trace(filename, dirpath))
     else:
-        add_if_valid(pcap_list, uncompress_file(os.path.basename(in_dir_exp),
-                                                os.path.dirname(in_dir_exp)))
+        add_if_valid(pcap_list, prepare_trace(os.path.basename(in_dir_exp),
+                                              os.path.dirname(in_dir_exp)))
 
 pcap_list_len = len(pcap_list)
 
@@ -232,55 +391,99 @@ if args.use_db:
 
 
 ##################################################
-##                   THREADS                    ##
+##                   WORKERS                    ##
 ##################################################
 
 def launch_analyze_pcap(pcap_filepath, clean, correct, graph, purge, cwin):
-    pcap_filename = os.path.basename(pcap_filepath)
     # Cleaning, if needed (in future pcap, tcpdump should do the job)
     if clean:
         co.clean_loopback_pcap(pcap_filepath, print_out=print_out)
-    # Prefix of the name determine the protocol used
-    if args.is_mptcp or pcap_filename.startswith('mptcp'):
+    # The columns of a staged trace are cached by fingerprint of its input, unless cleaning changed it
+    fingerprint = None if clean else trace_inputs.get(pcap_filepath, (None, None))[1]
+    # We are in a worker process, so changing dir is safe here
+    protocol = get_protocol(pcap_filepath)
+    if protocol == 'mptcp':
         # if correct:
         #    tcp.correct_trace(pcap_filepath, print_out=print_out)
-        # we need to change dir, do that in a new process
         if graph:
-            p = Process(target=mptcp.process_trace, args=(
-                pcap_filepath, graph_dir_exp, stat_dir_exp, aggl_dir_exp, rtt_dir_exp, rtt_subflow_dir_exp, failed_conns_dir_exp, acksize_dir_exp, acksize_tcp_dir_exp, cwin, args.tcpcsm,), kwargs={'min_bytes': args.min_bytes, 'light': args.light})
-            p.start()
-            p.join()
-    elif args.is_tcp or pcap_filename.startswith('tcp'):
+            mptcp.process_trace(pcap_filepath, graph_dir_exp, stat_dir_exp, aggl_dir_exp, rtt_dir_exp, rtt_subflow_dir_exp, failed_conns_dir_exp,
+                                acksize_dir_exp, acksize_tcp_dir_exp, cwin, args.tcpcsm, min_bytes=args.min_bytes, light=args.light,
+                                columns_dir=columns_dir_exp, shards=args.shards, rtt_sketch=args.rtt_sketch, scratch_dir=scratch_dir_exp,
+                                scratch_size=args.scratch_size * 1024 * 1024, graph_archive=graph_archive,
+                                compress_graph_archive=args.compress_graph_archive, mptcp_engine=args.mptcp_engine,
+                                fingerprint=fingerprint)
+    elif protocol == 'tcp':
         #if correct:
         #    tcp.correct_trace(pcap_filepath, print_out=print_out)
         if graph:
-            p = Process(target=tcp.process_trace, args=(pcap_filepath, graph_dir_exp, stat_dir_exp, failed_conns_dir_exp, acksize_tcp_dir_exp, args.tcpcsm,), kwargs={'print_out': print_out, 'light': args.light})
-            p.start()
-            p.join()
+            tcp.process_trace(pcap_filepath, graph_dir_exp, stat_dir_exp, failed_conns_dir_exp, acksize_tcp_dir_exp, args.tcpcsm, print_out=print_out,
+                              light=args.light, columns_dir=columns_dir_exp, fingerprint=fingerprint)
     else:
         print(pcap_filepath + ": don't know the protocol used; skipped", file=sys.stderr)
         print("Note: if your traces contains MPTCP, please specify the -M option", file=sys.stderr)
 
     print('End for file ' + pcap_filepath, file=print_out)
-    if purge and graph:  # if we just want to correct traces, do not remove them
+    # if we just want to correct traces, do not remove them; never remove streamed input files
+    if purge and graph and os.path.dirname(pcap_filepath) == trace_dir_exp:
         os.remove(pcap_filepath)
 
 
-def thread_launch(thread_id, clean, correct, graph, purge, cwin):
-    global pcap_list
-    while True:
-        try:
-            pcap_filepath = pcap_list.pop()
-        except IndexError:  # no more thread
-            break
-        analyze_no = str(pcap_list_len - len(pcap_list)) + "/" + str(pcap_list_len)
-        print("Thread " + str(thread_id) + ": Analyze: " + pcap_filepath + " (" + analyze_no + ")", file=print_out)
-        try:
-            launch_analyze_pcap(pcap_filepath, clean, correct, graph, purge, cwin)
-        except:
-            print(traceback.format_exc(), file=sys.stderr)
-            print('Error when analyzing ' + pcap_filepath + ': skip', file=sys.stderr)
-    print("Thread " + str(thread_id) + ": End", file=print_out)
+def init_worker(max_memory):
+    """ Initialize a worker process of the pool, limiting its address space to max_memory MB if not 0 """
+    if max_memory > 0:
+        limit = max_memory * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+class NonDaemonicProcess(Process):
+
+    """ Worker process that is never daemonic, so that it can have its own workers (the shards of its trace) """
+
+    def _get_daemon(self):
+        return False
+
+    def _set_daemon(self, value):
+        pass
+
+    daemon = property(_get_daemon, _set_daemon)
+
+
+class NonDaemonicPool(Pool):
+
+    """ Pool of NonDaemonicProcess workers """
+    Process = NonDaemonicProcess
+
+
+def worker_launch(task):
+    """ Analyze one trace in a worker process and return its filepath, its wall time and if it succeeded """
+    analyze_no, pcap_filepath = task
+    print("Worker " + str(os.getpid()) + ": Analyze: " + pcap_filepath + " (" + analyze_no + ")", file=print_out)
+    start_time = time.time()
+    success = True
+    try:
+        launch_analyze_pcap(pcap_filepath, args.clean, not args.not_correct, not args.not_graph, not args.not_purge, args.cwin)
+    except MemoryError:
+        print('Memory ceiling of ' + str(args.max_memory) + ' MB reached when analyzing ' + pcap_filepath + ': skip', file=sys.stderr)
+        success = False
+    except:
+        print(traceback.format_exc(), file=sys.stderr)
+        print('Error when analyzing ' + pcap_filepath + ': skip', file=sys.stderr)
+        success = False
+    return pcap_filepath, time.time() - start_time, success
+
+
+def print_wall_time_summary(results, total_time):
+    """ Print the wall time of the slowest traces and some totals """
+    print("Wall time summary (" + str(len(results)) + " traces in " + "%.1f" % total_time + " s with " + str(args.threads) + " workers)",
+          file=print_out)
+    failed = [pcap_filepath for pcap_filepath, wall_time, success in results if not success]
+    if failed:
+        print(str(len(failed)) + " traces failed: " + ", ".join(failed), file=print_out)
+    sum_time = sum([wall_time for pcap_filepath, wall_time, success in results])
+    if results:
+        print("Sum of traces wall time: " + "%.1f" % sum_time + " s, mean: " + "%.1f" % (sum_time / len(results)) + " s", file=print_out)
+    for pcap_filepath, wall_time, success in sorted(results, key=lambda elem: elem[1], reverse=True)[:NB_SLOWEST_TRACES]:
+        print("%10.1f s " % wall_time + pcap_filepath + ("" if success else " (failed)"), file=print_out)
 
 ##################################################
 ##                     MAIN                     ##
@@ -299,32 +502,40 @@ co.check_directory_exists(rtt_subflow_dir_exp)
 co.check_directory_exists(failed_conns_dir_exp)
 co.check_directory_exists(acksize_dir_exp)
 co.check_directory_exists(acksize_tcp_dir_exp)
-# If file is a .pcap, use it for (mp)tcptrace
-pcap_list.reverse()  # we will use pop: use the natural order
 
 if not args.dir_input:
-    threads = []
-    args.threads = min(args.threads, pcap_list_len)
-    if args.threads > 1:
-        # Launch new thread
-        for thread_id in range(args.threads):
-            thread = threading.Thread(target=thread_launch,
-                                      args=(thread_id, args.clean,
-                                            not args.not_correct, not args.not_graph, not args.not_purge, args.cwin))
-            thread.start()
-            threads.append(thread)
-        # Wait
-        for thread in threads:
-            thread.join()
-    else:
-        thread_launch(0, args.clean, not args.not_correct, not args.not_graph, not args.not_purge, args.cwin)
+    # Largest traces first, so that a huge trace does not start last and delays the end of the analysis
+    pcap_list.sort(key=lambda pcap_filepath: os.path.getsize(pcap_filepath), reverse=True)
+    tasks = [(str(index + 1) + "/" + str(pcap_list_len), pcap_filepath) for index, pcap_filepath in enumerate(pcap_list)]
+    args.threads = max(1, min(args.threads, pcap_list_len))
+    results = []
+    start_time = time.time()
+    # Workers are persistent processes: no new interpreter for each trace
+    # With shards, each worker has its own workers for the trace it analyzes: daemonic processes cannot have children
+    pool_class = NonDaemonicPool if args.shards > 1 else Pool
+    pool = pool_class(processes=args.threads, initializer=init_worker, initargs=(args.max_memory,))
+    task_results = pool.imap_unordered(worker_launch, tasks)
+    try:
+        for result in task_results:
+            results.append(result)
+            if result[2]:
+                record_in_manifest(result[0])
+            print("Done: " + result[0] + " in " + "%.1f" % result[1] + " s (" + str(len(results)) + "/" + str(pcap_list_len) + ")", file=print_out)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    print_wall_time_summary(results, time.time() - start_time)
 
 else:
     # p = Process(target=mptcp.process_trace, args=(
     #             in_dir_exp, graph_dir_exp, stat_dir_exp, aggl_dir_exp, rtt_dir_exp, rtt_subflow_dir_exp, failed_conns_dir_exp, acksize_dir_exp, acksize_tcp_dir_exp, cwin,), kwargs={'min_bytes': args.min_bytes, 'light': args.light})
     # p.start()
     # p.join()
-    mptcp.process_trace_directory(in_dir_exp, graph_dir_exp, stat_dir_exp, aggl_dir_exp, rtt_dir_exp, rtt_subflow_dir_exp, failed_conns_dir_exp, acksize_dir_exp, acksize_tcp_dir_exp, args.tcpcsm, False, min_bytes=args.min_bytes, light=args.light)
+    mptcp.process_trace_directory(in_dir_exp, graph_dir_exp, stat_dir_exp, aggl_dir_exp, rtt_dir_exp, rtt_subflow_dir_exp, failed_conns_dir_exp, acksize_dir_exp, acksize_tcp_dir_exp, args.cwin, args.tcpcsm, min_bytes=args.min_bytes, light=args.light, columns_dir=columns_dir_exp, shards=args.shards, rtt_sketch=args.rtt_sketch, scratch_dir=scratch_dir_exp, scratch_size=args.scratch_size * 1024 * 1024, graph_archive=graph_archive, compress_graph_archive=args.compress_graph_archive, mptcp_engine=args.mptcp_engine)
 
 
 print('End of analyze', file=print_out)
@@ -23,6 +23,12 @@ from __future__ import print_function
 #                    IMPORTS                     #
 ##################################################
 
+import errno
+import fcntl
+import fnmatch
+import hashlib
+import heapq
+import mmap
 import os
 import matplotlib
 # Do not use any X11 backend
@@ -34,12 +40,16 @@ import numpy as np
 import pickle
 from scipy.stats import gaussian_kde
 import shutil
+import struct
 import subprocess
 import sys
 import tempfile
 import threading
+import time
 import traceback
+import zipfile
 
+from datetime import timedelta
 from multiprocessing import Process
 
 ##################################################
@@ -66,7 +76,7 @@ class cd:
 ##################################################
 
 
-class TSharkError(Exception):
+class PcapError(Exception):
     pass
 
 ##################################################
@@ -96,6 +106,10 @@ DEF_IFACE = 'any'
 
 # The time sequence and throughput graphs directory
 TSG_THGPT_DIR = 'tsg_thgpt'
+# Extension of the archive of the graph files of a trace (see write_graph_archive)
+GRAPH_ARCHIVE_EXT = '.zip'
+# Name of the member of a graph archive with its index
+GRAPH_ARCHIVE_INDEX = 'index'
 # The congestion window graphs directory
 CWIN_DIR = 'cwin'
 # The agglomerated graphs directory
@@ -127,6 +141,8 @@ WSCALESRC = 'wscalesrc'
 WSCALEDST = 'wscaledst'
 # Start of a connection (first packet)
 START = 'start_time'
+# Number of nanoseconds in a second; timestamps (START, TIMESTAMP_RETRANS, TIME_*_TCP,...) are integers in nanoseconds
+NS_PER_SEC = 1000000000
 # Duration of a connection
 DURATION = 'duration'
 # Number of packets
@@ -193,6 +209,8 @@ RTT_90P = 'rtt_90p'
 RTT_75P = 'rtt_75p'
 RTT_MED = 'rtt_median'
 RTT_25P = 'rtt_25p'
+# Relative accuracy of the quantiles given by a QuantileSketch
+DEF_SKETCH_ACCURACY = 0.01
 
 # For aggregation
 C2S = 'client2server'
@@ -286,6 +304,33 @@ RM_ADDRS = 'rm_addrs'
 # Backup bit of a subflow
 BACKUP = 'backup'
 
+# Extension of pcap files
+PCAP_EXT = '.pcap'
+# Extension of compressed pcap files
+PCAP_GZ_EXT = '.pcap.gz'
+# The default directory of the content-addressed cache of traces
+DEF_CACHE_DIR = 'traces_cache'
+# The default directory of the cache of the TCP packet columns of traces (see tcp.get_tcp_columns)
+DEF_COLUMNS_DIR = 'columns_cache'
+# Filename of the index of the last uses of the files in the cache of traces
+CACHE_INDEX_FNAME = 'index'
+# Filename of the ledger of the space reserved in a scratch directory by the processes using it (see scratch_dir)
+SCRATCH_LEDGER_FNAME = '.scratch_ledger'
+# Space reserved in a scratch directory for the output of a tool, as a multiple of the size of the trace it reads
+SCRATCH_SIZE_FACTOR = 2
+# Size of the blocks read to compute the fingerprint of a pcap file
+FINGERPRINT_BLOCK_SIZE = 65536
+# Number of blocks (evenly spread from the beginning to the end) read to compute the fingerprint of a pcap file
+FINGERPRINT_NB_BLOCKS = 4
+# Magic numbers of pcap files and the resolution of their timestamps (number of ticks per second)
+PCAP_MAGICS = {0xa1b2c3d4: 1000000, 0xa1b23c4d: 1000000000}
+# Global header of a pcap file: magic, version major, version minor, thiszone, sigfigs, snaplen, linktype
+PCAP_HEADER_FORMAT = 'IHHiIII'
+# Header of a packet record in a pcap file: seconds, fraction of second, captured length, original length
+PCAP_RECORD_FORMAT = 'IIII'
+# Size of the windows of a pcap file mapped in memory when reading it (the memory used does not depend on the size of the file)
+PCAP_MMAP_WINDOW_SIZE = 64 * 1024 * 1024
+
 # Retransmission of DSS
 RETRANS_DSS = 'retrans_dss'
 
@@ -353,6 +398,71 @@ class BasicConnection(object):
         self.attr = {C2S: {}, S2C: {}}
 
 
+##################################################
+#               QUANTILE SKETCHES                #
+##################################################
+
+
+class QuantileSketch(object):
+
+    """ Mergeable summary of samples giving their quantiles with a relative error of at most relative_accuracy
+        Positive samples are counted in buckets of exponentially growing widths (as done by DDSketch), so that
+        its size only grows with the logarithm of the ratio between the largest and the smallest samples
+        Other samples are counted as 0
+    """
+
+    def __init__(self, relative_accuracy=DEF_SKETCH_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1.0 + relative_accuracy) / (1.0 - relative_accuracy)
+        self.count = 0
+        self.zero_count = 0
+        # counts[i] is the number of samples in ]gamma ** (offset + i - 1), gamma ** (offset + i)]
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def _add_counts(self, offset, counts):
+        """ Add counts of buckets starting at the bucket offset """
+        if not len(counts):
+            return
+        if not len(self.counts):
+            self.offset, self.counts = offset, counts.astype(np.int64)
+            return
+        new_offset = min(self.offset, offset)
+        new_counts = np.zeros(max(self.offset + len(self.counts), offset + len(counts)) - new_offset, dtype=np.int64)
+        new_counts[self.offset - new_offset:self.offset - new_offset + len(self.counts)] += self.counts
+        new_counts[offset - new_offset:offset - new_offset + len(counts)] += counts
+        self.offset, self.counts = new_offset, new_counts
+
+    def add(self, samples):
+        """ Add the samples (a sequence of numbers) to the sketch """
+        samples = np.asarray(samples, dtype=np.float64)
+        positives = samples[samples > 0]
+        self.count += len(samples)
+        self.zero_count += len(samples) - len(positives)
+        if len(positives):
+            keys = np.ceil(np.log(positives) / np.log(self.gamma)).astype(np.int64)
+            self._add_counts(keys.min(), np.bincount(keys - keys.min()))
+
+    def merge(self, other):
+        """ Add the samples summarized by the sketch other, having the same relative accuracy """
+        if not other.gamma == self.gamma:
+            raise ValueError("Cannot merge sketches of different accuracies")
+        self.count += other.count
+        self.zero_count += other.zero_count
+        self._add_counts(other.offset, other.counts)
+
+    def percentiles(self, percentiles):
+        """ Return an array with the (approximate) percentiles of the samples, as np.percentile with the lower interpolation
+            Raise a ValueError if the sketch is empty
+        """
+        if not self.count:
+            raise ValueError("No sample in the sketch")
+        ranks = np.floor(np.asarray(percentiles, dtype=np.float64) / 100.0 * (self.count - 1)) - self.zero_count
+        buckets = np.searchsorted(np.cumsum(self.counts), ranks, side='right')
+        values = 2.0 * self.gamma ** (self.offset + buckets) / (self.gamma + 1.0)
+        return np.where(ranks < 0, 0.0, values)
+
+
 ##################################################
 #          (DE)SERIALIZATION OF OBJECTS          #
 ##################################################
@@ -401,6 +511,22 @@ def get_dir_from_arg(directory, end=''):
     return os.path.abspath(os.path.expanduser(directory)) + end
 
 
+def ts_to_ns(ts):
+    """ Return the timestamp ts in nanoseconds
+        Pickles made by older versions contain timedelta objects: they are converted
+    """
+    if isinstance(ts, timedelta):
+        return (ts.days * 86400 + ts.seconds) * NS_PER_SEC + ts.microseconds * 1000
+    return ts
+
+
+def ts_to_seconds(ts):
+    """ Return the timestamp ts (in nanoseconds, or a timedelta for older pickles) in seconds, as a float """
+    if isinstance(ts, timedelta):
+        return ts.total_seconds()
+    return ts / float(NS_PER_SEC)
+
+
 def is_number(s):
     """ Check if the str s is a number """
     try:
@@ -420,17 +546,62 @@ def move_file(from_path, to_path, print_out=sys.stderr):
         shutil.move(from_path, to_path)
 
 
-def tshark_stats(filtering, src_path, print_out=sys.stderr):
-    """ Filter src_path using the condition and write the result to print_out (open stream)
-        Raise a TSharkError in case of failure
+def iter_cmd_lines(cmd, error):
+    """ Launch the command cmd and yield the lines of its standard output while it runs, read from a pipe (no temporary file)
+        Raise error (an exception) once all lines are read if the command failed; if the lines are not all read, it is killed
     """
-    table = 'conv,tcp'
-    if filtering:
-        table += ',' + filtering
-
-    cmd = ['tshark', '-n', '-r', src_path, '-z', table, '-q']
-    if subprocess.call(cmd, stdout=print_out) != 0:
-        raise TSharkError("Error with filtering " + filtering + " for source " + src_path)
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    finished = False
+    try:
+        for line in iter(process.stdout.readline, b''):
+            yield line
+        finished = True
+    finally:
+        if not finished and process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise error
+
+
+def load_csv_columns(csv_fname, nb_columns):
+    """ Return the lines of the csv csv_fname having at least nb_columns fields and a 2D array of floats with their
+        nb_columns first fields (one row per line), parsed in one pass by NumPy (other fields are never parsed)
+        Raise an IOError if the file cannot be read
+    """
+    with open(csv_fname) as csv_file:
+        text = csv_file.read()
+    if text.endswith('\n'):
+        text = text[:-1]
+    lines = text.split('\n')
+
+    # Locate the lines and their fields on the characters of the file
+    chars = np.frombuffer(text.encode('ascii'), dtype=np.uint8)
+    line_ends = np.append(np.flatnonzero(chars == ord('\n')), len(chars))
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+    commas = np.flatnonzero(chars == ord(','))
+    first_commas = np.searchsorted(commas, line_starts)
+    nb_commas = np.searchsorted(commas, line_ends) - first_commas
+    kept = np.flatnonzero(nb_commas >= nb_columns - 1)
+    if not len(kept):
+        return [], np.zeros((0, nb_columns))
+    if len(kept) < len(lines):
+        lines = [lines[i] for i in kept.tolist()]
+
+    # Only keep the characters of the nb_columns first fields of kept lines, each followed by a separator
+    if len(kept) == len(line_ends) and not np.any(nb_commas >= nb_columns):
+        selected = chars.copy()
+    else:
+        field_ends = line_ends[kept]
+        longer = nb_commas[kept] >= nb_columns
+        field_ends[longer] = commas[first_commas[kept][longer] + nb_columns - 1]
+        marks = np.zeros(len(chars) + 2, dtype=np.int8)
+        marks[line_starts[kept]] += 1
+        marks[field_ends + 1] -= 1
+        selected = np.append(chars, np.uint8(ord('\n')))[np.cumsum(marks[:-1], dtype=np.int8) > 0]
+    selected[selected == ord('\n')] = ord(',')
+    return lines, np.fromstring(selected.tobytes(), sep=',').reshape(len(lines), nb_columns)
 
 
 def long_ipv6_address(ip):
@@ -470,10 +641,578 @@ def long_ipv6_address(ip):
 ##################################################
 
 
+def is_compressed_pcap(pcap_filepath):
+    """ Return True if pcap_filepath is a compressed pcap file (.pcap.gz) """
+    return pcap_filepath.endswith(PCAP_GZ_EXT)
+
+
+def get_pcap_basepath(pcap_filepath):
+    """ Return pcap_filepath without its extension, ex. /a/b.pcap.gz and /a/b.pcap will both be /a/b """
+    if is_compressed_pcap(pcap_filepath):
+        return pcap_filepath[:-len(PCAP_GZ_EXT)]
+    return os.path.splitext(pcap_filepath)[0]
+
+
+class open_pcap:
+
+    """ Context manager giving a binary file object to read the pcap sequentially
+        A compressed pcap is uncompressed on the fly by gunzip, nothing is written on disk
+        A directory gives the merge in time order of all its pcap files, as one pcap
+    """
+
+    def __init__(self, pcap_filepath):
+        self.pcap_filepath = pcap_filepath
+        self.process = None
+        self.merge = None
+        self.pcap_file = None
+
+    def __enter__(self):
+        if os.path.isdir(self.pcap_filepath):
+            self.merge = merged_pcap_pipe(self.pcap_filepath)
+            self.pcap_file = os.fdopen(os.dup(self.merge.__enter__()), 'rb')
+        elif is_compressed_pcap(self.pcap_filepath):
+            self.process = subprocess.Popen(['gunzip', '-c', self.pcap_filepath], stdout=subprocess.PIPE)
+            self.pcap_file = self.process.stdout
+        else:
+            self.pcap_file = open(self.pcap_filepath, 'rb')
+        return self.pcap_file
+
+    def __exit__(self, etype, value, traceback):
+        self.pcap_file.close()
+        if self.process:
+            # If we stopped reading before the end, gunzip is killed by SIGPIPE: not an error
+            self.process.wait()
+        if self.merge:
+            self.merge.__exit__(etype, value, traceback)
+
+
+class pcap_tool_path:
+
+    """ Context manager giving a path from which an external tool (tstat, mptcptrace,...) can read the pcap
+        For a compressed pcap, this is /dev/fd/N, the read end of a pipe fed by gunzip: the tool inherits
+        it, so the trace is never uncompressed on disk. Notice that the tool can only read it once and
+        sequentially, and that a new pipe is needed for each tool launched.
+        For a directory, the pipe is fed with the merge in time order of all its pcap files.
+    """
+
+    def __init__(self, pcap_filepath):
+        self.pcap_filepath = pcap_filepath
+        self.process = None
+        self.merge = None
+
+    def __enter__(self):
+        if os.path.isdir(self.pcap_filepath):
+            self.merge = merged_pcap_pipe(self.pcap_filepath)
+            fd = self.merge.__enter__()
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) & ~fcntl.FD_CLOEXEC)
+            return '/dev/fd/' + str(fd)
+        if not is_compressed_pcap(self.pcap_filepath):
+            return self.pcap_filepath
+
+        self.process = subprocess.Popen(['gunzip', '-c', self.pcap_filepath], stdout=subprocess.PIPE)
+        fd = self.process.stdout.fileno()
+        # Pipes of subprocess are close-on-exec, but the tool has to inherit this one
+        fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) & ~fcntl.FD_CLOEXEC)
+        return '/dev/fd/' + str(fd)
+
+    def __exit__(self, etype, value, traceback):
+        if self.process:
+            # The tool has its own copy of the fd; close ours to let gunzip end if the tool did not read all
+            self.process.stdout.close()
+            self.process.wait()
+        if self.merge:
+            self.merge.__exit__(etype, value, traceback)
+
+
+def get_pcap_files(pcap_dirpath):
+    """ Return the sorted list of the (possibly compressed) pcap files in the directory """
+    return sorted([os.path.join(pcap_dirpath, filename) for filename in os.listdir(pcap_dirpath)
+                   if filename.endswith((PCAP_EXT, PCAP_GZ_EXT)) and os.path.isfile(os.path.join(pcap_dirpath, filename))])
+
+
+def read_pcap_header(pcap_file):
+    """ Read the global header of the pcap file and return its byte order, the resolution of its timestamps,
+        its snaplen and its linktype
+        Raise a PcapError if it is not a pcap file
+    """
+    header = pcap_file.read(struct.calcsize('<' + PCAP_HEADER_FORMAT))
+    if len(header) < struct.calcsize('<' + PCAP_HEADER_FORMAT):
+        raise PcapError("Truncated pcap header")
+    for byte_order in ['<', '>']:
+        magic, _, _, _, _, snaplen, linktype = struct.unpack(byte_order + PCAP_HEADER_FORMAT, header)
+        if magic in PCAP_MAGICS:
+            return byte_order, PCAP_MAGICS[magic], snaplen, linktype
+    raise PcapError("Unknown pcap magic number")
+
+
+def iter_pcap_records(pcap_file, byte_order, resolution, index):
+    """ Yield the packet records of the pcap file (after its header) as (timestamp in ns, index, original length, data)
+        index (of the file in the merge) is there to keep the order of the files for packets with the same timestamp
+        A truncated last record (if the capture was killed) is ignored
+    """
+    record_format = byte_order + PCAP_RECORD_FORMAT
+    record_size = struct.calcsize(record_format)
+    ns_per_tick = NS_PER_SEC // resolution
+    while True:
+        record = pcap_file.read(record_size)
+        if len(record) < record_size:
+            return
+        sec, frac, caplen, length = struct.unpack(record_format, record)
+        data = pcap_file.read(caplen)
+        if len(data) < caplen:
+            return
+        yield sec * NS_PER_SEC + frac * ns_per_tick, index, length, data
+
+
+def write_merged_pcap(pcap_files, out_file):
+    """ Write in out_file one pcap with all the packets of the (open) pcap files, merged in time order
+        This is a k-way merge: only one packet per file is kept in memory
+        The timestamps resolution of the first file is used; files must have the same linktype
+        Stop silently if the reader of out_file closed it
+    """
+    headers = [read_pcap_header(pcap_file) for pcap_file in pcap_files]
+    if len(set([header[3] for header in headers])) > 1:
+        raise PcapError("Pcap files with different linktypes cannot be merged")
+    records = [iter_pcap_records(pcap_file, header[0], header[1], index) for index, (pcap_file, header) in enumerate(zip(pcap_files, headers))]
+
+    resolution = headers[0][1]
+    magic = [pcap_magic for pcap_magic, pcap_resolution in PCAP_MAGICS.iteritems() if pcap_resolution == resolution][0]
+    ns_per_tick = NS_PER_SEC // resolution
+    try:
+        out_file.write(struct.pack('<' + PCAP_HEADER_FORMAT, magic, 2, 4, 0, 0, max([header[2] for header in headers]), headers[0][3]))
+        for ts_ns, index, length, data in heapq.merge(*records):
+            out_file.write(struct.pack('<' + PCAP_RECORD_FORMAT, ts_ns // NS_PER_SEC, (ts_ns % NS_PER_SEC) // ns_per_tick, len(data), length))
+            out_file.write(data)
+        out_file.flush()
+    except IOError as e:
+        if e.errno != errno.EPIPE:
+            raise
+
+
+class merged_pcap_pipe:
+
+    """ Context manager giving the read end of a pipe fed with the merge of the pcap files of a directory
+        The merge is written by a thread; if the reader stops before the end, the thread ends too
+        All files are opened (and gunzip launched for compressed ones) before creating the pipe, so that
+        no other process than the reader has its read end
+    """
+
+    def __init__(self, pcap_dirpath):
+        self.pcap_filepaths = get_pcap_files(pcap_dirpath)
+        self.pcap_openers = []
+        self.thread = None
+        self.read_fd = None
+        self.error = None
+
+    def write_merge(self, pcap_files, write_fd):
+        out_file = os.fdopen(write_fd, 'wb')
+        try:
+            write_merged_pcap(pcap_files, out_file)
+        except Exception as e:
+            self.error = e
+        finally:
+            try:
+                out_file.close()
+            except IOError:
+                pass
+
+    def __enter__(self):
+        if not self.pcap_filepaths:
+            raise PcapError("No pcap file to merge")
+        pcap_files = []
+        for pcap_filepath in self.pcap_filepaths:
+            self.pcap_openers.append(open_pcap(pcap_filepath))
+            pcap_files.append(self.pcap_openers[-1].__enter__())
+        self.read_fd, write_fd = os.pipe()
+        for fd in [self.read_fd, write_fd]:
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        self.thread = threading.Thread(target=self.write_merge, args=(pcap_files, write_fd))
+        self.thread.daemon = True
+        self.thread.start()
+        return self.read_fd
+
+    def __exit__(self, etype, value, traceback):
+        os.close(self.read_fd)
+        self.thread.join()
+        for pcap_opener in self.pcap_openers:
+            pcap_opener.__exit__(None, None, None)
+        if self.error and etype is None:
+            raise self.error
+
+
+class pcap_reader:
+
+    """ Context manager giving a reader of the packets of the pcap, iterating over (timestamp, data) like dpkt.pcap.Reader,
+        but with the timestamp as an integer in nanoseconds
+        A pcap file is mapped in memory by windows and records are parsed in place: data is a view (memoryview, or
+        buffer with Python 2) on the record, without copy, and is only valid until the next packet
+        Compressed pcaps and directories (see open_pcap) are read sequentially
+        The original length of the last packet given (before any truncation by the snaplen) is in length
+    """
+
+    def __init__(self, pcap_filepath):
+        self.pcap_filepath = pcap_filepath
+        self.pcap_opener = None
+        self.pcap_file = None
+        self.file_size = 0
+        self.window = None
+        self.window_view = None
+        self.byte_order, self.resolution, self.snaplen, self.linktype = None, None, None, None
+        self.length = 0
+
+    def __enter__(self):
+        if os.path.isfile(self.pcap_filepath) and not is_compressed_pcap(self.pcap_filepath):
+            self.pcap_file = open(self.pcap_filepath, 'rb')
+            self.file_size = os.fstat(self.pcap_file.fileno()).st_size
+        else:
+            self.pcap_opener = open_pcap(self.pcap_filepath)
+            self.pcap_file = self.pcap_opener.__enter__()
+        self.byte_order, self.resolution, self.snaplen, self.linktype = read_pcap_header(self.pcap_file)
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        self.window_view = None
+        if self.window:
+            try:
+                self.window.close()
+            except BufferError:
+                # Views on it are still used; it will be unmapped when they are freed
+                pass
+            self.window = None
+        if self.pcap_opener:
+            self.pcap_opener.__exit__(etype, value, traceback)
+        else:
+            self.pcap_file.close()
+
+    def datalink(self):
+        return self.linktype
+
+    def __iter__(self):
+        if self.pcap_opener:
+            return self.iter_stream()
+        return self.iter_mmap()
+
+    def map_window(self, offset, length):
+        """ Map a window of the file containing at least length bytes from offset and return the offset of its start """
+        # Previous views keep the previous window alive if they are still used
+        self.window_view = None
+        self.window = None
+        window_start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        window_length = min(max(PCAP_MMAP_WINDOW_SIZE, offset - window_start + length), self.file_size - window_start)
+        self.window = mmap.mmap(self.pcap_file.fileno(), window_length, access=mmap.ACCESS_READ, offset=window_start)
+        try:
+            self.window_view = memoryview(self.window)
+        except TypeError:
+            # Python 2: mmap only supports the old buffer interface
+            self.window_view = None
+        return window_start
+
+    def iter_mmap(self):
+        record_struct = struct.Struct(self.byte_order + PCAP_RECORD_FORMAT)
+        unpack_from = record_struct.unpack_from
+        record_size = record_struct.size
+        ns_per_tick = NS_PER_SEC // self.resolution
+        offset = struct.calcsize('<' + PCAP_HEADER_FORMAT)
+        window_start, window_end = 0, 0
+        while offset + record_size <= self.file_size:
+            if offset + record_size > window_end:
+                window_start = self.map_window(offset, record_size)
+                window_end = window_start + len(self.window)
+            sec, frac, caplen, length = unpack_from(self.window, offset - window_start)
+            data_offset = offset + record_size
+            if data_offset + caplen > self.file_size:
+                # Truncated last record (if the capture was killed)
+                return
+            if data_offset + caplen > window_end:
+                window_start = self.map_window(offset, record_size + caplen)
+                window_end = window_start + len(self.window)
+            self.length = length
+            if self.window_view is not None:
+                yield sec * NS_PER_SEC + frac * ns_per_tick, self.window_view[data_offset - window_start:data_offset - window_start + caplen]
+            else:
+                yield sec * NS_PER_SEC + frac * ns_per_tick, buffer(self.window, data_offset - window_start, caplen)
+            offset = data_offset + caplen
+
+    def iter_stream(self):
+        record_struct = struct.Struct(self.byte_order + PCAP_RECORD_FORMAT)
+        record_size = record_struct.size
+        ns_per_tick = NS_PER_SEC // self.resolution
+        while True:
+            record = self.pcap_file.read(record_size)
+            if len(record) < record_size:
+                return
+            sec, frac, caplen, length = record_struct.unpack(record)
+            data = self.pcap_file.read(caplen)
+            if len(data) < caplen:
+                return
+            self.length = length
+            yield sec * NS_PER_SEC + frac * ns_per_tick, data
+
+
+def get_pcap_fingerprint(pcap_filepath, use_mtime=True, use_inode=False):
+    """ Return a fingerprint of the file, without reading it entirely
+        It is a hash of its size, its modification time (if use_mtime), its inode (if use_inode) and some blocks sampled in it
+        The fingerprint of a directory is the one of the names and fingerprints of its pcap files
+    """
+    if os.path.isdir(pcap_filepath):
+        fingerprint = hashlib.sha1()
+        for filepath in get_pcap_files(pcap_filepath):
+            fingerprint.update(os.path.basename(filepath) + ':' + get_pcap_fingerprint(filepath, use_mtime=use_mtime, use_inode=use_inode)
+                               + '\n')
+        return fingerprint.hexdigest()
+
+    stat = os.stat(pcap_filepath)
+    fingerprint = hashlib.sha1(str(stat.st_size) + (':' + repr(stat.st_mtime) if use_mtime else '')
+                               + (':' + str(stat.st_dev) + ':' + str(stat.st_ino) if use_inode else ''))
+    last_offset = max(0, stat.st_size - FINGERPRINT_BLOCK_SIZE)
+    with open(pcap_filepath, 'rb') as pcap_file:
+        for i in range(FINGERPRINT_NB_BLOCKS):
+            pcap_file.seek(last_offset * i // (FINGERPRINT_NB_BLOCKS - 1))
+            fingerprint.update(pcap_file.read(FINGERPRINT_BLOCK_SIZE))
+    return fingerprint.hexdigest()
+
+
+def link_or_reflink(src_path, dst_path):
+    """ Make dst_path share the data of src_path with a hard link, or a reflink if the filesystem allows it
+        Return True if it succeeded, False if a copy would be needed
+    """
+    try:
+        os.link(src_path, dst_path)
+        return True
+    except OSError:
+        pass
+
+    devnull = open(os.devnull, 'w')
+    try:
+        return subprocess.call(['cp', '--reflink=always', src_path, dst_path], stdout=devnull, stderr=devnull) == 0
+    finally:
+        devnull.close()
+
+
+def evict_pcap_cache(cache_dir, cache_size, used_path=None):
+    """ Record that used_path was just used, then remove the least recently used files of cache_dir until they use at most
+        cache_size bytes (0 means no limit). The time of last use is kept in an index file, since changing the times of the
+        files would also change the ones of the original traces (they are hard links).
+        Only the files that are not hard links of another file anymore (their trace and staged files were removed) count in
+        cache_size and can be removed: removing the others would free no space
+        The index is locked during the update, so that processes sharing cache_dir do not lose the uses of each other
+    """
+    index_fd = os.open(os.path.join(cache_dir, CACHE_INDEX_FNAME), os.O_RDWR | os.O_CREAT, 0o666)
+    with os.fdopen(index_fd, 'r+b') as index_file:
+        fcntl.flock(index_file.fileno(), fcntl.LOCK_EX)
+        content = index_file.read()
+        last_uses = pickle.loads(content) if content else {}
+        if used_path:
+            last_uses[os.path.basename(used_path)] = time.time()
+
+        kept_uses = {}
+        entries = []
+        total_size = 0
+        for fname in os.listdir(cache_dir):
+            if fname == CACHE_INDEX_FNAME:
+                continue
+            stat = os.stat(os.path.join(cache_dir, fname))
+            if stat.st_nlink > 1:
+                kept_uses[fname] = last_uses.get(fname, 0.0)
+                continue
+            entries.append((last_uses.get(fname, 0.0), stat.st_size, fname))
+            total_size += stat.st_size
+
+        for last_use, size, fname in sorted(entries):
+            if cache_size > 0 and total_size > cache_size and not (used_path and fname == os.path.basename(used_path)):
+                os.remove(os.path.join(cache_dir, fname))
+                total_size -= size
+            else:
+                kept_uses[fname] = last_use
+
+        index_file.seek(0)
+        index_file.truncate()
+        pickle.dump(kept_uses, index_file)
+        # Closing the file releases the lock
+
+
+def stage_pcap(pcap_filepath, staged_filepath, cache_dir, cache_size=0, need_copy=False, fingerprint=None, print_out=sys.stdout):
+    """ Make pcap_filepath available at staged_filepath for the analysis, without copying it
+        The content-addressed cache in cache_dir keeps a hard link (or reflink) named by the fingerprint of the file, so that
+        a trace shared by several experiments is stored once, and staged_filepath is a hard link to this entry.
+        If the filesystem does not allow it, the file is read in place, or copied if need_copy (it will be modified)
+        fingerprint can be given if already computed
+        Return the path to analyze, or None in case of error
+    """
+    if not fingerprint:
+        fingerprint = get_pcap_fingerprint(pcap_filepath)
+    cache_path = os.path.join(cache_dir, fingerprint + PCAP_EXT)
+    if not os.path.exists(cache_path) and not link_or_reflink(pcap_filepath, cache_path):
+        cache_path = None
+
+    if cache_path:
+        evict_pcap_cache(cache_dir, cache_size, used_path=cache_path)
+        if os.path.exists(staged_filepath) and os.path.samefile(cache_path, staged_filepath):
+            print("Do no stage file: already in " + os.path.dirname(staged_filepath) + " " + pcap_filepath, file=sys.stderr)
+            return staged_filepath
+
+        if os.path.exists(staged_filepath):
+            # Same name, but not the same content
+            os.remove(staged_filepath)
+
+        try:
+            os.link(cache_path, staged_filepath)
+            print("Staging " + pcap_filepath + " to " + os.path.dirname(staged_filepath), file=print_out)
+            return staged_filepath
+        except OSError as e:
+            print(str(e) + ": cannot link " + cache_path + " to " + staged_filepath, file=sys.stderr)
+
+    if not need_copy:
+        print("Reading " + pcap_filepath + " in place", file=print_out)
+        return pcap_filepath
+
+    print("Copying " + pcap_filepath + " to " + os.path.dirname(staged_filepath), file=print_out)
+    try:
+        shutil.copyfile(pcap_filepath, staged_filepath)
+        return staged_filepath
+    except IOError as e:
+        print(str(e) + ": error when copying " + pcap_filepath, file=sys.stderr)
+        return None
+
+
+def get_trace_size(pcap_filepath):
+    """ Return the size in bytes of the (possibly compressed) pcap file, or of all the pcap files of a directory """
+    if os.path.isdir(pcap_filepath):
+        return sum([os.path.getsize(filepath) for filepath in get_pcap_files(pcap_filepath)])
+    return os.path.getsize(pcap_filepath)
+
+
+def update_scratch_ledger(scratch_root, update):
+    """ Call update with the dictionary of the reservations in scratch_root ({directory: (pid, size in bytes)}), that it can
+        change, while holding the lock of the ledger, so that processes on the same host share the budget of scratch_root
+        Reservations of processes that ended are dropped, and their directories removed, before the call
+        Return the result of update
+    """
+    ledger_fd = os.open(os.path.join(scratch_root, SCRATCH_LEDGER_FNAME), os.O_RDWR | os.O_CREAT, 0o666)
+    with os.fdopen(ledger_fd, 'r+b') as ledger_file:
+        fcntl.flock(ledger_file.fileno(), fcntl.LOCK_EX)
+        content = ledger_file.read()
+        reservations = pickle.loads(content) if content else {}
+        for directory, (pid, size) in list(reservations.items()):
+            try:
+                os.kill(pid, 0)
+                alive = True
+            except OSError as e:
+                alive = e.errno == errno.EPERM
+            if not alive or not os.path.isdir(directory):
+                shutil.rmtree(directory, ignore_errors=True)
+                del reservations[directory]
+
+        result = update(reservations)
+        ledger_file.seek(0)
+        ledger_file.truncate()
+        pickle.dump(reservations, ledger_file)
+        # Closing the file releases the lock
+    return result
+
+
+class scratch_dir:
+
+    """ Context manager giving a new temporary directory where a tool can write many small files, removed at exit
+        It is created in scratch_root (ex. a tmpfs as /dev/shm) if expected_size bytes can be reserved there without
+        exceeding the budget of scratch_size bytes (0 means no limit) shared by all processes using scratch_root (see
+        update_scratch_ledger), nor its free space; else, as when scratch_root is empty, it spills to fallback_dir (ex. the working directory)
+    """
+
+    def __init__(self, scratch_root, scratch_size, expected_size, fallback_dir):
+        self.scratch_root = scratch_root
+        self.scratch_size = scratch_size
+        self.expected_size = expected_size
+        self.fallback_dir = fallback_dir
+        self.path = None
+        self.reserved = False
+
+    def reserve(self, reservations):
+        """ Create the directory in scratch_root and reserve its space in reservations if it fits, return True if so """
+        stat = os.statvfs(self.scratch_root)
+        reserved_size = sum([size for pid, size in reservations.values()])
+        if (self.scratch_size > 0 and reserved_size + self.expected_size > self.scratch_size) or self.expected_size > stat.f_bavail * stat.f_frsize:
+            return False
+        self.path = tempfile.mkdtemp(dir=self.scratch_root)
+        reservations[self.path] = (os.getpid(), self.expected_size)
+        return True
+
+    def release(self, reservations):
+        """ Remove the reservation of the directory from reservations """
+        reservations.pop(self.path, None)
+
+    def __enter__(self):
+        if self.scratch_root:
+            try:
+                self.reserved = update_scratch_ledger(self.scratch_root, self.reserve)
+            except (IOError, OSError) as e:
+                print(str(e) + ": do not use scratch directory " + self.scratch_root, file=sys.stderr)
+        if not self.reserved:
+            self.path = tempfile.mkdtemp(dir=self.fallback_dir)
+        return self.path
+
+    def __exit__(self, etype, value, traceback):
+        shutil.rmtree(self.path, ignore_errors=True)
+        if self.reserved:
+            try:
+                update_scratch_ledger(self.scratch_root, self.release)
+            except (IOError, OSError) as e:
+                print(str(e) + ": cannot release space in scratch directory " + self.scratch_root, file=sys.stderr)
+
+
+def write_graph_archive(graph_dir, archive_path, index=None, compress=False):
+    """ Write all files of graph_dir in the zip archive_path (their paths in it being relative to graph_dir), compressed if compress,
+        with index (if any) pickled in the member GRAPH_ARCHIVE_INDEX
+        The archive is written next to archive_path then renamed, so that it is never seen incomplete
+    """
+    tmp_path = archive_path + '.tmp'
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for dirpath, dirnames, filenames in os.walk(graph_dir):
+            for filename in sorted(filenames):
+                filepath = os.path.join(dirpath, filename)
+                archive.write(filepath, os.path.relpath(filepath, graph_dir))
+        if index is not None:
+            archive.writestr(GRAPH_ARCHIVE_INDEX, pickle.dumps(index))
+    os.rename(tmp_path, archive_path)
+
+
+class graph_archive:
+
+    """ Context manager giving access to the graph files of a trace in its archive (see write_graph_archive)
+        Members are found with the central directory of the zip, read once: finding and reading one does not open any other file
+    """
+
+    def __init__(self, archive_path):
+        self.archive_path = archive_path
+        self.archive = None
+        self.index = {}
+
+    def __enter__(self):
+        self.archive = zipfile.ZipFile(self.archive_path)
+        if GRAPH_ARCHIVE_INDEX in self.archive.NameToInfo:
+            self.index = pickle.loads(self.archive.read(GRAPH_ARCHIVE_INDEX))
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        self.archive.close()
+
+    def glob(self, pattern):
+        """ Return the sorted names of the members matching the shell pattern (ex. tsg_thgpt/mptcp_trace_*.xpl) """
+        return sorted(fnmatch.filter(self.archive.namelist(), pattern))
+
+    def members(self, key):
+        """ Return the names of the members recorded under key in the index """
+        return self.index.get(key, [])
+
+    def readlines(self, name):
+        """ Return the lines of the member name (as readlines() of a file) """
+        return self.archive.read(name).splitlines(True)
+
+
 def save_data(filepath, dir_exp, data):
     """ Using the name pcap_fname, save data in a file with filename fname in dir dir_exp """
     path_name = os.path.join(
-        dir_exp, os.path.splitext(os.path.basename(filepath))[0])
+        dir_exp, os.path.basename(get_pcap_basepath(filepath)))
     try:
         data_file = open(path_name, 'w')
         pickle.dump(data, data_file)
@@ -22,7 +22,6 @@
 
 from __future__ import print_function
 
-from datetime import timedelta
 
 import argparse
 import matplotlib
@@ -107,6 +106,8 @@ MPTCP_SUBFLOWS_ONE2ONE_DIRECTION_FIELDS = [co.BYTES, co.BYTES_DATA, co.BYTES_RET
                                            co.REINJ_ORIG_BYTES, co.REINJ_ORIG_PACKS, co.RTT_AVG, co.RTT_MAX, co.RTT_MIN, co.RTT_SAMPLES,
                                            co.RTT_STDEV, co.SS_MIN, co.SS_MAX, co.TIME_FIRST_ACK, co.TIME_FIRST_PAYLD, co.TIME_LAST_ACK_TCP,
                                            co.TIME_LAST_PAYLD, co.TIME_LAST_PAYLD_TCP, co.TIME_LAST_PAYLD_WITH_RETRANS_TCP, co.TIME_FIN_ACK_TCP, co.TTL_MAX, co.TTL_MIN]
+# Timestamps (in nanoseconds) are written in seconds
+TIMESTAMP_FIELDS = [co.START, co.TIME_LAST_ACK_TCP, co.TIME_LAST_PAYLD_TCP, co.TIME_LAST_PAYLD_WITH_RETRANS_TCP, co.TIME_FIN_ACK_TCP]
 MPTCP_SUBFLOWS_MANY2ONE_DIRECTION_FIELDS = [co.IS_REINJ, co.REINJ_ORIG, co.REINJ_ORIG_TIMESTAMP, co.TIMESTAMP_RETRANS]
 MPTCP_SUBFLOWS_MANY2ONE_DIRECTION_SUBFIELDS = {co.IS_REINJ: {'timestamp': 'bytes'}, co.REINJ_ORIG: {'range_bytes': 'nb_reinjected'},
                                                co.REINJ_ORIG_TIMESTAMP: 'reinjection_orig_timestamp',
@@ -133,7 +134,7 @@ def make_data_lines_mptcp_connections_one2one_fields(fbasename, connections, con
         conns_o2o_file.write(fbasename + ";" + str(conn_id))
         for field_name in MPTCP_CONNECTIONS_ONE2ONE_SINGLE_FIELDS:
             if field_name == co.START:
-                conns_o2o_file.write(";" + str(conn.attr.get(field_name, timedelta()).total_seconds()))
+                conns_o2o_file.write(";" + str(co.ts_to_seconds(conn.attr.get(field_name, 0))))
             else:
                 conns_o2o_file.write(";" + str(conn.attr.get(field_name, "NULL")))
 
@@ -210,14 +211,17 @@ def make_data_lines_mptcp_subflows_one2one_fields(fbasename, connections, sfs_o2
         for flow_id in sorted_flow_ids:
             sfs_o2o_file.write(fbasename + ";" + str(conn_id) + ";" + str(flow_id))
             for field_name in MPTCP_SUBFLOWS_ONE2ONE_SINGLE_FIELDS:
-                if field_name in [co.START, co.TIME_LAST_ACK_TCP, co.TIME_LAST_PAYLD_TCP, co.TIME_LAST_PAYLD_WITH_RETRANS_TCP, co.TIME_FIN_ACK_TCP]:
-                    sfs_o2o_file.write(";" + str(conn.flows[flow_id].attr.get(field_name, timedelta()).total_seconds()))
+                if field_name in TIMESTAMP_FIELDS:
+                    sfs_o2o_file.write(";" + str(co.ts_to_seconds(conn.flows[flow_id].attr.get(field_name, 0))))
                 else:
                     sfs_o2o_file.write(";" + str(conn.flows[flow_id].attr.get(field_name, "NULL")))
 
             for direction in co.DIRECTIONS:
                 for field_name in MPTCP_SUBFLOWS_ONE2ONE_DIRECTION_FIELDS:
-                    sfs_o2o_file.write(";" + str(conn.flows[flow_id].attr[direction].get(field_name, "NULL")))
+                    if field_name in TIMESTAMP_FIELDS and field_name in conn.flows[flow_id].attr[direction]:
+                        sfs_o2o_file.write(";" + str(co.ts_to_seconds(conn.flows[flow_id].attr[direction][field_name])))
+                    else:
+                        sfs_o2o_file.write(";" + str(conn.flows[flow_id].attr[direction].get(field_name, "NULL")))
 
             sfs_o2o_file.write("\n")
 
@@ -258,7 +262,7 @@ def make_data_lines_mptcp_subflows_many2one_direction_fields(fbasename, connecti
                         if isinstance(MPTCP_SUBFLOWS_MANY2ONE_DIRECTION_SUBFIELDS[field_name], list):
                             if field_name == co.TIMESTAMP_RETRANS:
                                 for subelem in elem:
-                                    sfs_m2o_file.write(";" + str(subelem.total_seconds()))
+                                    sfs_m2o_file.write(";" + str(co.ts_to_seconds(subelem)))
                             else:
                                 for subelem in elem:
                                     sfs_m2o_file.write(";" + str(subelem))
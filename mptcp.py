@@ -26,14 +26,17 @@ from __future__ import print_function
 #                    IMPORTS                     #
 ##################################################
 
-from datetime import timedelta
 
+import bisect
 import common as co
+import dpkt
 import glob
+import hashlib
+import multiprocessing
 import numpy as np
 import os
 import shutil
-import subprocess
+import struct
 import sys
 import tcp
 import tempfile
@@ -50,6 +53,8 @@ MPTCP_SF_FNAME = '_sf_'
 MPTCP_RTT_FNAME = '_rtt_seq_'
 # mptcptrace stats files prefix in csv filename of a subflow
 MPTCP_STATS_PREFIX = 'stats_'
+# Keys of the lines of mptcptrace stats files that are used (a line being key;...;value c2s;value s2c)
+MPTCP_STATS_KEYS = set(['seqAcked', 'conTime', 'beginTime', 'bytesReinjected', 'precentReinjected'])
 # mptcptrace file identifier in csv filename for gput information
 MPTCP_GPUT_FNAME = 'gput'
 # mptcptrace file identifier in csv filename for acksize information
@@ -58,6 +63,27 @@ MPTCP_ACKSIZE_FNAME = '_acksize_'
 MPTCP_ADDADDR_FNAME = 'add_addr_'
 # mptcptrace file identifier in csv filename for rmaddr information
 MPTCP_RMADDR_FNAME = 'rm_addr_'
+# Directory, in the one of the outputs of mptcptrace, of the graph files to put in the archive of the trace
+GRAPH_FILES_DIR = 'graphs'
+# Percentiles of the RTT samples of MPTCP connections, and the keys where they are stored
+RTT_PERCENTILES = [99, 98, 97, 95, 90, 75, 50, 25]
+RTT_PERCENTILE_KEYS = [co.RTT_99P, co.RTT_98P, co.RTT_97P, co.RTT_95P, co.RTT_90P, co.RTT_75P, co.RTT_MED, co.RTT_25P]
+# Engines rebuilding the MPTCP connections of a trace: mptcptrace, the built-in one (see reconstruct_mptcp_connections), or the
+# built-in one checked against mptcptrace (see check_with_mptcptrace)
+MPTCP_ENGINE_MPTCPTRACE = 'mptcptrace'
+MPTCP_ENGINE_BUILTIN = 'builtin'
+MPTCP_ENGINE_CHECK = 'check'
+MPTCP_ENGINES = [MPTCP_ENGINE_MPTCPTRACE, MPTCP_ENGINE_BUILTIN, MPTCP_ENGINE_CHECK]
+# Attributes of the directions of MPTCP connections, and of the ones of their subflows, compared by check_with_mptcptrace; the
+# RTTs (in ms) are compared with a relative and an absolute tolerance, mptcptrace giving times with a precision of a microsecond
+CHECKED_ATTRIBUTES = [co.BYTES_MPTCPTRACE, co.REINJ_BYTES]
+CHECKED_FLOW_ATTRIBUTES = [co.REINJ_ORIG_BYTES, co.REINJ_ORIG_PACKS]
+CHECKED_RTT_ATTRIBUTES = [co.RTT_MIN, co.RTT_MAX]
+CHECK_RTT_RELATIVE_TOLERANCE = 0.01
+CHECK_RTT_ABSOLUTE_TOLERANCE = 0.002
+# MPTCP keys, and tokens (first bytes of the SHA-1 of keys)
+KEY_STRUCT = struct.Struct('!Q')
+TOKEN_STRUCT = struct.Struct('!I')
 
 
 ##################################################
@@ -104,14 +130,13 @@ def convert_MPTCPConnections_to_dict(mptcp_connections):
     return mptcp_dict
 
 
-def extract_flow_data(out_file):
-    """ Given an (open) file, return a dictionary of as many elements as there are mptcp flows """
-    # Return at the beginning of the file
-    out_file.seek(0)
-    data = out_file.readlines()
+def extract_flow_data(lines):
+    """ Given the lines of the output of mptcptrace (an iterable, consumed once), return a dictionary of as many elements as there
+        are mptcp flows
+    """
     connections = {}
     current_connection = False
-    for line in data:
+    for line in lines:
         # Case 1: line start with MPTCP connection
         if line.startswith("MPTCP connection"):
             # A typical line: MPTCP connection 0 with id 2
@@ -191,16 +216,8 @@ def process_mptcptrace_cmd(cmd, pcap_filepath):
         about connections of the pcap file analyzed
         Raise a MPTCPTraceError if mptcptrace encounters problems
     """
-    pcap_flow_data_path = pcap_filepath[:-5] + '.out'
-    flow_data_file = open(pcap_flow_data_path, 'w+')
-    if subprocess.call(cmd, stdout=flow_data_file) != 0:
-        raise MPTCPTraceError("Error of mptcptrace with " + pcap_filepath)
-
-    connections = extract_flow_data(flow_data_file)
-    # Don't forget to close and remove pcap_flow_data
-    flow_data_file.close()
-    os.remove(pcap_flow_data_path)
-    return connections
+    # The output is parsed while mptcptrace runs
+    return extract_flow_data(co.iter_cmd_lines(cmd, MPTCPTraceError("Error of mptcptrace with " + pcap_filepath)))
 
 
 ##################################################
@@ -209,131 +226,110 @@ def process_mptcptrace_cmd(cmd, pcap_filepath):
 
 
 def process_csv(csv_fname, connections, conn_id, is_reversed):
-    """ Process the csv given in argument """
+    """ Process the csv given in argument
+        Its lines are time,seq_begin,flow,type,seq_end,reinjected_flow (flows numbered from 1, -1 if not reinjected)
+    """
     if conn_id not in connections:
         # Not a real connection; skip it
         return
 
     try:
-        csv_file = open(csv_fname)
-        data = csv_file.readlines()
-        csv_file.close()
+        lines, fields = co.load_csv_columns(csv_fname, 6)
     except IOError as e:
         print(str(e), file=sys.stderr)
         print('IOError for ' + csv_fname + ': no data extracted from csv', file=sys.stderr)
         return
 
-    reinject_offsets = {}
-    reinject_nb = {}
-    reinject_ts = {}
-    reinject = {}
-    is_reinjection = {}
-    bursts = []
-    current_flow = -1
-    count_seq_burst = 0
-    count_pkt_burst = 0
-    begin_time_burst_on_flow = 0.0
-    last_time_burst_on_flow = 0.0
-    for i in range(0, len(connections[conn_id].flows)):
-        reinject[i] = {}
-        is_reinjection[i] = {}
-        reinject_offsets[i] = 0
-        reinject_nb[i] = 0
-        reinject_ts[i] = []
+    map_rows = np.flatnonzero(fields[:, 3] == 1)
+    process_maps(connections[conn_id], co.S2C if is_reversed else co.C2S, fields[map_rows, 0], fields[map_rows, 2].astype(np.int64) - 1,
+                 fields[map_rows][:, [4, 1]].astype(np.int64), fields[map_rows, 5].astype(np.int64) - 1,
+                 lambda row: lines[map_rows[row]].split(',', 1)[0])
 
-    for line in data:
-        split_line = line.split(',')
-        if len(split_line) < 6:
-            continue
 
-        if int(split_line[3]) == 1:
-            # Map
-            if not int(split_line[2]) - 1 == current_flow and current_flow >= 0:
-                # Save current burst (no way if start of connection)
-                duration = last_time_burst_on_flow - begin_time_burst_on_flow
-                bursts.append((current_flow, count_seq_burst, count_pkt_burst, duration, begin_time_burst_on_flow))
-
-            if not int(split_line[2]) - 1 == current_flow:
-                # Prepare for the next burst
-                current_flow = int(split_line[2]) - 1
-                count_seq_burst = 0
-                count_pkt_burst = 0
-                begin_time_burst_on_flow = float(split_line[0])
-
-            count_seq_burst += (int(split_line[4]) - int(split_line[1])) % 2**32
-            count_pkt_burst += 1
-            last_time_burst_on_flow = float(split_line[0])
-
-        if int(split_line[3]) == 1 and (not int(split_line[5]) == -1):
-            # Map and reinjected
-            # Security
-            if int(split_line[5]) - 1 not in reinject_offsets:
-                continue
-            reinject_offsets[int(split_line[5]) - 1] += (int(split_line[4]) - int(split_line[1])) % 2**32
-            is_reinjection[int(split_line[2]) - 1][split_line[0]] = (int(split_line[4]) - int(split_line[1])) % 2**32
-            reinject_nb[int(split_line[5]) - 1] += 1
-            reinject_ts[int(split_line[5]) - 1].append(float(split_line[0]))
-            packet_seqs = (int(split_line[4]), int(split_line[1]))
-            if packet_seqs not in reinject[int(split_line[5]) - 1]:
-                reinject[int(split_line[5]) - 1][packet_seqs] = 1
-            else:
-                reinject[int(split_line[5]) - 1][packet_seqs] += 1
-                # print("WARNING: reinjection " + str(reinject[int(split_line[5]) - 1][packet_seqs]) + " for " + csv_fname)
-
-    # Don't forget to consider the last burst
-    if current_flow >= 0:
-        duration = last_time_burst_on_flow - begin_time_burst_on_flow
-        bursts.append((current_flow, count_seq_burst, count_pkt_burst, duration, begin_time_burst_on_flow))
-
-    direction = co.S2C if is_reversed else co.C2S
-    connections[conn_id].attr[direction][co.BURSTS] = bursts
-    for i in range(0, len(connections[conn_id].flows)):
-        connections[conn_id].flows[i].attr[direction][co.REINJ_ORIG_PACKS] = reinject_nb[i]
-        connections[conn_id].flows[i].attr[direction][co.REINJ_ORIG_BYTES] = reinject_offsets[i]
-        connections[conn_id].flows[i].attr[direction][co.REINJ_ORIG_TIMESTAMP] = reinject_ts[i]
-        connections[conn_id].flows[i].attr[direction][co.REINJ_ORIG] = reinject[i]
-        connections[conn_id].flows[i].attr[direction][co.IS_REINJ] = is_reinjection[i]
-
-
-def process_rtt_csv(csv_fname, rtt_all, connections, conn_id, is_reversed):
-    """ Process the csv with rtt given in argument """
+def process_maps(connection, direction, times, flows, seqs, reinj_flows, time_key):
+    """ Put in connection the bursts and reinjections of the data-level maps of a direction, given as arrays of their time (in
+        seconds), flow (numbered from 0), (seq_end, seq_begin) and flow they reinject (-1 if none); time_key(i) is the text of the
+        time of the i-th map, that is the key of its reinjection in IS_REINJ
+    """
+    nb_flows = len(connection.flows)
+    sizes = (seqs[:, 0] - seqs[:, 1]) % 2**32
+
+    # Bursts are the runs of consecutive maps on the same flow (no way to have a burst on an unknown flow)
+    bursts = []
+    if len(flows):
+        starts = np.flatnonzero(np.concatenate(([True], flows[1:] != flows[:-1])))
+        ends = np.append(starts[1:], len(flows))
+        burst_seqs = np.add.reduceat(sizes, starts)
+        known = flows[starts] >= 0
+        starts, ends = starts[known], ends[known]
+        bursts = list(zip(flows[starts].tolist(), burst_seqs[known].tolist(), (ends - starts).tolist(),
+                          (times[ends - 1] - times[starts]).tolist(), times[starts].tolist()))
+
+    # Maps reinjecting data of a known flow, grouped by the flow they reinject (keeping their order)
+    reinj_rows = np.flatnonzero((reinj_flows >= 0) & (reinj_flows < nb_flows))
+    reinj_rows = reinj_rows[np.argsort(reinj_flows[reinj_rows], kind='mergesort')]
+    reinject_nb = np.bincount(reinj_flows[reinj_rows], minlength=nb_flows)
+    reinject_offsets = np.zeros(nb_flows, dtype=np.int64)
+    np.add.at(reinject_offsets, reinj_flows[reinj_rows], sizes[reinj_rows])
+    bounds = np.concatenate(([0], np.cumsum(reinject_nb))).tolist()
+
+    is_reinjection = {}
+    for i in range(0, nb_flows):
+        is_reinjection[i] = {}
+    for row in np.sort(reinj_rows).tolist():
+        flow = int(flows[row])
+        if flow in is_reinjection:
+            is_reinjection[flow][time_key(row)] = int(sizes[row])
+
+    connection.attr[direction][co.BURSTS] = bursts
+    for i in range(0, nb_flows):
+        rows = reinj_rows[bounds[i]:bounds[i + 1]]
+        reinject = {}
+        for packet_seqs in seqs[rows].tolist():
+            packet_seqs = tuple(packet_seqs)
+            reinject[packet_seqs] = reinject.get(packet_seqs, 0) + 1
+        connection.flows[i].attr[direction][co.REINJ_ORIG_PACKS] = int(reinject_nb[i])
+        connection.flows[i].attr[direction][co.REINJ_ORIG_BYTES] = int(reinject_offsets[i])
+        connection.flows[i].attr[direction][co.REINJ_ORIG_TIMESTAMP] = times[rows].tolist()
+        connection.flows[i].attr[direction][co.REINJ_ORIG] = reinject
+        connection.flows[i].attr[direction][co.IS_REINJ] = is_reinjection[i]
+
+
+def process_rtt_csv(csv_fname, rtt_all, connections, conn_id, is_reversed, rtt_sketch=False):
+    """ Process the csv with rtt given in argument
+        The samples are kept in rtt_all, or only a co.QuantileSketch of them if rtt_sketch
+    """
     if conn_id not in connections:
         print(conn_id, "not in connections", file=sys.stderr)
         return
     try:
-        csv_file = open(csv_fname)
-        data = csv_file.readlines()
-        csv_file.close()
+        rtt_data = co.load_csv_columns(csv_fname, 2)[1][:, 1]
     except IOError:
         print('IOError for ' + csv_fname + ': no data extracted from csv', file=sys.stderr)
         return
 
-    rtt_data = []
+    process_rtt_samples(rtt_data, rtt_all, connections, conn_id, co.S2C if is_reversed else co.C2S, rtt_sketch=rtt_sketch)
 
-    for line in data:
-        split_line = line.split(',')
-        # All data is good
-        rtt_data.append(float(split_line[1]))
 
-    direction = co.S2C if is_reversed else co.C2S
+def process_rtt_samples(rtt_data, rtt_all, connections, conn_id, direction, rtt_sketch=False):
+    """ Put the statistics of the array of RTT samples rtt_data of a direction of a connection in it, and the samples in rtt_all
+        (only a co.QuantileSketch of them if rtt_sketch)
+    """
     connections[conn_id].attr[direction][co.RTT_SAMPLES] = len(rtt_data)
-    if not rtt_data:
+    if not len(rtt_data):
         return
     connections[conn_id].attr[direction][co.RTT_MIN] = np.min(rtt_data)
     connections[conn_id].attr[direction][co.RTT_MAX] = np.max(rtt_data)
     connections[conn_id].attr[direction][co.RTT_AVG] = np.mean(rtt_data)
     connections[conn_id].attr[direction][co.RTT_STDEV] = np.std(rtt_data)
-    rtt_all[direction][conn_id] = rtt_data
-    np_rtts = np.array(rtt_data)
+    if rtt_sketch:
+        rtt_all[direction][conn_id] = co.QuantileSketch()
+        rtt_all[direction][conn_id].add(rtt_data)
+    else:
+        rtt_all[direction][conn_id] = rtt_data.tolist()
     # Those are stored in the MPTCP connection itself because app delay at MPTCP level (not at its flows)
-    connections[conn_id].attr[direction][co.RTT_99P] = np.percentile(np_rtts, 99)
-    connections[conn_id].attr[direction][co.RTT_98P] = np.percentile(np_rtts, 98)
-    connections[conn_id].attr[direction][co.RTT_97P] = np.percentile(np_rtts, 97)
-    connections[conn_id].attr[direction][co.RTT_95P] = np.percentile(np_rtts, 95)
-    connections[conn_id].attr[direction][co.RTT_90P] = np.percentile(np_rtts, 90)
-    connections[conn_id].attr[direction][co.RTT_75P] = np.percentile(np_rtts, 75)
-    connections[conn_id].attr[direction][co.RTT_MED] = np.percentile(np_rtts, 50)
-    connections[conn_id].attr[direction][co.RTT_25P] = np.percentile(np_rtts, 25)
+    for rtt_key, percentile in zip(RTT_PERCENTILE_KEYS, np.percentile(rtt_data, RTT_PERCENTILES)):
+        connections[conn_id].attr[direction][rtt_key] = percentile
 
 
 ##################################################
@@ -341,78 +337,489 @@ def process_rtt_csv(csv_fname, rtt_all, connections, conn_id, is_reversed):
 ##################################################
 
 
-def check_mptcp_joins(pcap_fullpath, print_out=sys.stdout):
-    """ Check if the pcap given in argument has mp joins in a SYN->SYN/ACK->ACK fashion (only for both scenarios) """
+def check_mptcp_joins(pcap_fullpath, print_out=sys.stdout, columns_dir=None):
+    """ Check if the pcap given in argument has mp joins in a SYN->SYN/ACK->ACK fashion (only for both scenarios)
+        Only the packets with MPTCP options of the (possibly cached) columns of the trace are looked at
+    """
     if 'rmnet' in os.path.basename(pcap_fullpath) or 'wlan' in os.path.basename(pcap_fullpath):
         return True
-    mp_joins_fname = os.path.basename(pcap_fullpath[:-5]) + "_joins"
-    mp_joins_file = open(mp_joins_fname, 'w')
-    cmd = ['tshark', '-nr', pcap_fullpath, '-Y', 'tcp.options.mptcp.subtype==1']
-    if subprocess.call(cmd, stdout=mp_joins_file) != 0:
-        raise co.TSharkError("Error with tshark mptcp join " + pcap_fullpath)
-    mp_joins_file.close()
-    mp_joins_file = open(mp_joins_fname)
-    mp_joins_data = mp_joins_file.readlines()
-    mp_joins_file.close()
-
-    os.remove(mp_joins_fname)
+    columns = tcp.get_tcp_columns(pcap_fullpath, columns_dir=columns_dir)
 
     mp_joins = {}
 
-    for line in mp_joins_data:
-        split_line = line.split(' ')
-        if len(split_line) < 12:
+    for index, opts in columns.opts.items():
+        if not tcp.has_mp_join(opts):
             continue
-        flags = line[line.rindex("[") + 1:line.rindex("]")]
-        ports = split_line[7].split('\xe2\x86\x92')
-        if len(ports) < 2:
-            print("WARNING: not enough ports...", file=sys.stderr)
-            return True
-        sport = ports[0]
-        dport = ports[1]
-        if flags == 'SYN':
+        flags = int(columns.flags[index])
+        saddr, sport, daddr, dport = columns.keys[columns.flow[index]]
+        if flags == dpkt.tcp.TH_SYN:
             mp_joins[(sport, dport)] = 1
-        elif flags == 'SYN, ACK' and mp_joins.get((dport, sport), 0) == 1:
+        elif flags == dpkt.tcp.TH_SYN | dpkt.tcp.TH_ACK and mp_joins.get((dport, sport), 0) == 1:
             mp_joins[(dport, sport)] = 2
-        elif flags == 'ACK' and mp_joins.get((sport, dport), 0) == 2:
+        elif flags == dpkt.tcp.TH_ACK and mp_joins.get((sport, dport), 0) == 2:
             return True
 
     return False
 
 
+##################################################
+#                BUILT-IN ENGINE                 #
+##################################################
+
+
+def get_token_and_idsn(key):
+    """ Return the token and the initial data sequence number derived from the MPTCP key (RFC 6824) """
+    digest = hashlib.sha1(KEY_STRUCT.pack(key)).digest()
+    return TOKEN_STRUCT.unpack_from(digest)[0], KEY_STRUCT.unpack_from(digest, len(digest) - KEY_STRUCT.size)[0]
+
+
+def get_time_text(ts_delta):
+    """ Return the timestamp ts_delta (in nanoseconds) as mptcptrace writes it (seconds with 6 decimals) """
+    return '%d.%06d' % (ts_delta // co.NS_PER_SEC, ts_delta % co.NS_PER_SEC // 1000)
+
+
+class DataSeqState(object):
+
+    """ State of a direction of a MPTCP connection at the data level, rebuilt by the built-in engine
+        DSNs are made relative to the first byte of the direction and unwrapped (see relative), so they never wrap
+    """
+
+    def __init__(self):
+        # DSN of the first byte (IDSN + 1), known from the key of the sender, or else the first DSN seen
+        self.base = None
+        # Highest relative DSN seen, around which DSNs are unwrapped
+        self.highest = 0
+        # End of the data sent, and the ranges of the first transmissions of data by their starts (with their flow and if they
+        # were reinjected)
+        self.sent_end = 0
+        self.sent_starts = []
+        self.sent_flows = []
+        self.sent_reinjected = []
+        # Starts of the maps already sent on each flow
+        self.flow_starts = {}
+        # Maps as (packet index, time, flow, start, end, reinjected flow or -1, index of their range of first transmission or -1)
+        self.maps = []
+        # Data ACKs of this direction as (packet index, time, flow, ack)
+        self.acks = []
+        # End of the data, once a DATA_FIN is seen
+        self.fin_end = None
+
+    def relative(self, dsn, modulo):
+        """ Return dsn (modulo 2**32 or 2**64) relative to the first byte, as the closest value to the highest one seen """
+        if self.base is None:
+            self.base = dsn
+        offset = (dsn - self.base - self.highest) % modulo
+        if offset >= modulo // 2:
+            offset -= modulo
+        value = self.highest + offset
+        self.highest = max(self.highest, value)
+        return value
+
+    def add_map(self, index, ts_delta, flow_id, start, end):
+        """ Add the map [start, end) sent on flow_id, unless it was already sent on this flow (same map in several segments,
+            retransmission of the subflow) or it only contains data already sent on this flow
+        """
+        flow_starts = self.flow_starts.setdefault(flow_id, set())
+        if start in flow_starts:
+            return
+        flow_starts.add(start)
+
+        reinj_flow, sent_range = -1, -1
+        if start < self.sent_end:
+            orig_range = bisect.bisect_right(self.sent_starts, start) - 1
+            if orig_range >= 0 and self.sent_flows[orig_range] != flow_id:
+                reinj_flow = self.sent_flows[orig_range]
+                self.sent_reinjected[orig_range] = True
+            elif end <= self.sent_end:
+                return
+        if end > self.sent_end:
+            if start >= self.sent_end:
+                sent_range = len(self.sent_starts)
+            self.sent_starts.append(max(start, self.sent_end))
+            self.sent_flows.append(flow_id)
+            self.sent_reinjected.append(False)
+            self.sent_end = end
+        self.maps.append((index, ts_delta, flow_id, start, end, reinj_flow, sent_range))
+
+
+class MPTCPConnectionState(object):
+
+    """ A MPTCP connection being rebuilt by the built-in engine: its MPTCPConnection, the keys of the client and the server, the
+        times of its first SYN and last packet, its DataSeqState by direction and its ADD_ADDR and REMOVE_ADDR options
+    """
+
+    def __init__(self, ts_delta):
+        self.connection = MPTCPConnection(None)
+        for direction in co.DIRECTIONS:
+            self.connection.attr[direction][co.BYTES] = {}
+            self.connection.attr[direction][co.RETRANS_DSS] = []
+        self.client_key = None
+        self.server_key = None
+        self.start = ts_delta
+        self.last = ts_delta
+        self.data = {co.C2S: DataSeqState(), co.S2C: DataSeqState()}
+        self.add_addrs = []
+        self.rm_addrs = []
+
+    def set_key(self, key, is_server, tokens):
+        """ Set the key of the server (if is_server) or of the client, registering its token in tokens """
+        if (self.server_key if is_server else self.client_key) is not None:
+            return
+        token, idsn = get_token_and_idsn(key)
+        if is_server:
+            self.server_key = key
+        else:
+            self.client_key = key
+        # The first byte of data follows the IDSN, as the SYN does at the subflow level
+        self.data[co.S2C if is_server else co.C2S].base = idsn + 1
+        tokens[token] = (self, is_server)
+
+    def add_subflow(self, key, syn_opts):
+        """ Add the subflow whose SYN has key (saddr, sport, daddr, dport) and options syn_opts; return its flow id """
+        flow_id = len(self.connection.flows)
+        saddr, sport, daddr, dport = key
+        subflow = MPTCPSubFlow(flow_id)
+        wscale = tcp.get_window_scale(syn_opts)
+        subflow.attr[co.WSCALESRC] = str(wscale or 0)
+        subflow.attr[co.WSCALEDST] = '0'
+        subflow.attr[co.TYPE] = 'IPv4' if len(saddr) == 4 else 'IPv6'
+        subflow.attr[co.SADDR] = co.long_ipv6_address(tcp.unpack_ip_address(saddr))
+        subflow.attr[co.DADDR] = co.long_ipv6_address(tcp.unpack_ip_address(daddr))
+        subflow.attr[co.SPORT] = str(sport)
+        subflow.attr[co.DPORT] = str(dport)
+        subflow.indicates_wifi_or_cell()
+        self.connection.flows[flow_id] = subflow
+        return flow_id
+
+
+class SubflowState(object):
+
+    """ A subflow being rebuilt by the built-in engine: its MPTCPConnectionState, its flow id, the flow (index in the keys of the
+        columns) of its SYN and if the SYN was sent by the client of the MPTCP connection
+    """
+
+    def __init__(self, conn, flow_id, syn_flow, syn_from_client):
+        self.conn = conn
+        self.flow_id = flow_id
+        self.syn_flow = syn_flow
+        self.syn_from_client = syn_from_client
+
+
+def process_mptcp_packet(index, ts_delta, flow, reverse_flow, flags, opts, columns, subflows, tokens, conns):
+    """ Update the states of the built-in engine with a packet having MPTCP options (see reconstruct_mptcp_connections) """
+    mptcp_options = tcp.decode_mptcp_options(opts)
+    pair = min(flow, reverse_flow) if reverse_flow >= 0 else flow
+    subflow = subflows.get(pair)
+    syn = flags & dpkt.tcp.TH_SYN
+    ack = flags & dpkt.tcp.TH_ACK
+    capable = mptcp_options.get(tcp.MP_CAPABLE)
+
+    if syn and not ack:
+        join = mptcp_options.get(tcp.MP_JOIN)
+        if capable is not None:
+            if (subflow is None or subflow.flow_id != 0 or subflow.syn_flow != flow
+                    or subflow.conn.client_key != capable[2]):
+                conn = MPTCPConnectionState(ts_delta)
+                conn.set_key(capable[2], False, tokens)
+                conns.append(conn)
+                subflows[pair] = SubflowState(conn, conn.add_subflow(columns.keys[flow], opts), flow, True)
+            # Else SYN retransmission
+        elif join is not None and join[2] is not None:
+            # The token is the one of the receiver of the SYN
+            conn, is_server_token = tokens.get(join[2], (None, None))
+            if conn is None:
+                subflows.pop(pair, None)
+            elif subflow is None or subflow.conn is not conn or subflow.syn_flow != flow:
+                subflows[pair] = SubflowState(conn, conn.add_subflow(columns.keys[flow], opts), flow, is_server_token)
+        return
+
+    if subflow is None:
+        return
+    conn = subflow.conn
+    conn.last = ts_delta
+    if syn:
+        if flow != subflow.syn_flow:
+            wscale = tcp.get_window_scale(opts)
+            conn.connection.flows[subflow.flow_id].attr[co.WSCALEDST] = str(wscale or 0)
+            if capable is not None and subflow.flow_id == 0:
+                conn.set_key(capable[2], True, tokens)
+        return
+    if capable is not None and capable[3] is not None and subflow.flow_id == 0:
+        # Third ACK, with the keys of the sender (the client) and of the receiver
+        conn.set_key(capable[2], False, tokens)
+        conn.set_key(capable[3], True, tokens)
+
+    direction = co.C2S if (flow == subflow.syn_flow) == subflow.syn_from_client else co.S2C
+    dss = mptcp_options.get(tcp.DSS)
+    if dss is not None:
+        dack, dsn, _, data_len, _, dsn_is_8_bytes, dack_is_8_bytes, data_fin = dss
+        if dack is not None:
+            state = conn.data[co.S2C if direction == co.C2S else co.C2S]
+            state.acks.append((index, ts_delta, subflow.flow_id, state.relative(dack, 2**64 if dack_is_8_bytes else 2**32)))
+        if dsn is not None and data_len is not None:
+            state = conn.data[direction]
+            start = state.relative(dsn, 2**64 if dsn_is_8_bytes else 2**32)
+            # The data-level length counts the DATA_FIN
+            end = start + data_len - (1 if data_fin else 0)
+            if data_fin:
+                state.fin_end = end
+            if end > start:
+                state.add_map(index, ts_delta, subflow.flow_id, start, end)
+
+    add_addr = mptcp_options.get(tcp.ADD_ADDR)
+    if add_addr is not None:
+        address_id, address, port = add_addr
+        conn.add_addrs.append([get_time_text(ts_delta), str(subflow.flow_id), str(address_id),
+                               co.long_ipv6_address(tcp.unpack_ip_address(address)), '' if port is None else str(port)])
+    remove_addr = mptcp_options.get(tcp.REMOVE_ADDR)
+    if remove_addr:
+        conn.rm_addrs.append([get_time_text(ts_delta), str(subflow.flow_id)] + [str(address_id) for address_id in remove_addr])
+
+
+def compute_data_seq_results(conn, conn_id, direction, rtt_all, acksize_all, light, rtt_sketch):
+    """ Put in the connection of conn (MPTCPConnectionState) what mptcptrace gives for a direction (bytes, reinjections, bursts,
+        RTTs, ack sizes and goodput) from its DataSeqState; return the rows of its seq csv file of mptcptrace as (packet index, row)
+    """
+    connection = conn.connection
+    state = conn.data[direction]
+    maps = np.array(state.maps, dtype=np.int64).reshape(-1, 7)
+    acks = np.array(state.acks, dtype=np.int64).reshape(-1, 4)
+    map_times = maps[:, 1] // 1000 / 1000000.0
+    map_keys = [get_time_text(ts_delta) for ts_delta in maps[:, 1].tolist()]
+    process_maps(connection, direction, map_times, maps[:, 2], maps[:, [4, 3]], maps[:, 5], lambda row: map_keys[row])
+
+    max_ack = int(acks[:, 3].max()) if len(acks) else 0
+    if state.fin_end is not None:
+        max_ack = min(max_ack, state.fin_end)
+    is_reinjection = maps[:, 5] >= 0
+    reinj_bytes = int((maps[is_reinjection, 4] - maps[is_reinjection, 3]).sum())
+    connection.attr[direction][co.BYTES_MPTCPTRACE] = max(max_ack, 0)
+    connection.attr[direction][co.REINJ_BYTES] = reinj_bytes
+    connection.attr[direction][co.REINJ_PC] = 100.0 * reinj_bytes / max_ack if max_ack > 0 else 0.0
+
+    # RTT of the first transmissions of data never reinjected (Karn's algorithm): until the first later data ACK covering them
+    sent_reinjected = np.array(state.sent_reinjected + [True], dtype=bool)
+    rtt_maps = maps[(maps[:, 5] < 0) & ~sent_reinjected[maps[:, 6]]]
+    rtt_data = np.zeros(0)
+    if len(acks):
+        covering = np.maximum.accumulate(acks[:, 3])
+        ack_index = np.maximum(np.searchsorted(acks[:, 0], rtt_maps[:, 0], side='right'),
+                               np.searchsorted(covering, rtt_maps[:, 4], side='left'))
+        acked = ack_index < len(acks)
+        rtt_data = (acks[ack_index[acked], 1] - rtt_maps[acked, 1]) / 1000000.0
+    process_rtt_samples(rtt_data, rtt_all, {conn_id: connection}, conn_id, direction, rtt_sketch=rtt_sketch)
+
+    # Ack sizes: progress of the data ACK since the previous one (older ones being ignored)
+    acked_bytes = acks[1:, 3] - np.maximum.accumulate(acks[:-1, 3])
+    values, counts = np.unique(acked_bytes[acked_bytes >= 0], return_counts=True)
+    acksize_all[direction][conn_id] = dict(zip(values.tolist(), counts.tolist()))
+
+    if not light and len(maps) and len(acks) and acks[-1, 1] > maps[0, 1]:
+        # Goodput in bytes per second, as the one of mptcptrace converted by process_gput_csv
+        connection.attr[direction][co.THGPT_MPTCPTRACE] = max_ack * float(co.NS_PER_SEC) / (acks[-1, 1] - maps[0, 1])
+
+    rows = [(index, '%s,%d,%d,1,%d,%d' % (map_keys[row], start, flow_id + 1, end, reinj_flow + 1 if reinj_flow >= 0 else -1))
+            for row, (index, _, flow_id, start, end, reinj_flow, _) in enumerate(maps.tolist())]
+    rows += [(index, '%s,%d,%d,0,%d,-1' % (get_time_text(ts_delta), ack, flow_id + 1, ack))
+             for index, ts_delta, flow_id, ack in acks.tolist()]
+    return rows
+
+
+def reconstruct_mptcp_connections(columns, light=False, rtt_sketch=False):
+    """ Rebuild the MPTCP connections of the TCPColumns of a trace as mptcptrace does, without writing or parsing any file
+        Connections are found with the MP_CAPABLE of their SYN and SYN/ACK, their other subflows with the token of the MP_JOIN of
+        their SYN; DSS mappings and data ACKs then give the bursts, reinjections, RTTs, ack sizes and goodput of their directions
+        Return (connections, rtt_all, acksize_all, seq_rows) as process_trace has them with mptcptrace, seq_rows being
+        {(conn_id, direction): lines of the seq csv file of mptcptrace}, for the graphs (see write_seq_graph_files)
+        Connections whose server did not answer with a MP_CAPABLE are not MPTCP ones, and are not kept
+    """
+    flow_ids = dict((key, flow) for flow, key in enumerate(columns.keys))
+    reverse_flows = [flow_ids.get((daddr, dport, saddr, sport), -1) for saddr, sport, daddr, dport in columns.keys]
+    # Subflow of each pair of flows (the lowest of both directions), connection of each token and all connections by first SYN
+    subflows = {}
+    tokens = {}
+    conns = []
+    indices = columns.opts.index
+    for begin in range(0, len(indices), tcp.ITER_CHUNK_SIZE):
+        chunk = indices[begin:begin + tcp.ITER_CHUNK_SIZE]
+        opts = columns.opts.items(int(chunk[0]), int(chunk[-1]) + 1)
+        for (index, packet_opts), ts_delta, flow, flags in zip(opts, columns.ts_delta[chunk].tolist(), columns.flow[chunk].tolist(),
+                                                               columns.flags[chunk].tolist()):
+            process_mptcp_packet(index, ts_delta, flow, reverse_flows[flow], flags, packet_opts, columns, subflows, tokens, conns)
+
+    connections = {}
+    rtt_all = {co.C2S: {}, co.S2C: {}}
+    acksize_all = {co.C2S: {}, co.S2C: {}}
+    seq_rows = {}
+    for conn in conns:
+        if conn.server_key is None:
+            continue
+        # Ids start from 1, as the ones of mptcptrace
+        conn_id = len(connections) + 1
+        connection = conn.connection
+        connection.conn_id = conn_id
+        connection.attr[co.START] = conn.start
+        connection.attr[co.DURATION] = (conn.last - conn.start) / float(co.NS_PER_SEC)
+        if conn.add_addrs:
+            connection.attr[co.ADD_ADDRS] = conn.add_addrs
+        if conn.rm_addrs:
+            connection.attr[co.RM_ADDRS] = conn.rm_addrs
+        connections[conn_id] = connection
+        for direction in co.DIRECTIONS:
+            rows = compute_data_seq_results(conn, conn_id, direction, rtt_all, acksize_all, light, rtt_sketch)
+            seq_rows[conn_id, direction] = [row for index, row in sorted(rows)]
+
+    return connections, rtt_all, acksize_all, seq_rows
+
+
+def write_seq_graph_files(seq_rows, pcap_filepath, graph_dir_exp, graph_archive=False, compress_graph_archive=False):
+    """ Write the seq csv files of seq_rows (see reconstruct_mptcp_connections) where mptcptrace ones would be moved by
+        process_csv_file, or in the graph archive of the trace if graph_archive
+    """
+    trace_name = os.path.basename(co.get_pcap_basepath(pcap_filepath))
+    graph_files_dir = tempfile.mkdtemp(dir=os.getcwd()) if graph_archive else graph_dir_exp
+    try:
+        if graph_archive:
+            for directory in [co.DEF_RTT_DIR, co.TSG_THGPT_DIR]:
+                os.makedirs(os.path.join(graph_files_dir, directory))
+        for (conn_id, direction), rows in seq_rows.items():
+            csv_fname = ('s2c' if direction == co.S2C else 'c2s') + MPTCP_SEQ_FNAME + str(conn_id) + '.csv'
+            try:
+                csv_file = open(os.path.join(graph_files_dir, co.TSG_THGPT_DIR, trace_name + '_' + csv_fname), 'w')
+                csv_file.write(''.join([row + '\n' for row in rows]))
+                csv_file.close()
+            except IOError as e:
+                print(str(e), file=sys.stderr)
+        if graph_archive:
+            co.write_graph_archive(graph_files_dir, os.path.join(graph_dir_exp, trace_name + co.GRAPH_ARCHIVE_EXT),
+                                   index=get_graph_archive_index(graph_files_dir, trace_name), compress=compress_graph_archive)
+    finally:
+        if graph_archive:
+            shutil.rmtree(graph_files_dir, ignore_errors=True)
+
+
+def check_with_mptcptrace(pcap_filepath, connections, acksize_all, shards=1, scratch_dir=None, scratch_size=0):
+    """ Compare the connections (and their acksize_all) rebuilt by the built-in engine with the ones given by mptcptrace (matched
+        by their initial subflow and start): their subflows, CHECKED_ATTRIBUTES, CHECKED_FLOW_ATTRIBUTES of their subflows, number of
+        bursts, RTTs and ack sizes by direction; their differences are reported on stderr
+        Return the number of differences, or None without mptcptrace
+    """
+    try:
+        mptcptrace_connections, _, mptcptrace_acksize_all = run_mptcptrace(pcap_filepath, None, False, True, shards, False, scratch_dir,
+                                                                           scratch_size, False, False)
+    except (MPTCPTraceError, OSError) as e:
+        # OSError if mptcptrace is not installed
+        print(str(e) + "; no check of the built-in engine", file=sys.stderr)
+        return None
+
+    def get_initial_subflow(connection):
+        flow = connection.flows.get(0)
+        return flow and (flow.attr[co.SADDR], flow.attr[co.SPORT], flow.attr[co.DADDR], flow.attr[co.DPORT])
+
+    candidates = {}
+    for connection in mptcptrace_connections.values():
+        candidates.setdefault(get_initial_subflow(connection), []).append(connection)
+
+    # Differences as (conn_id, what, built-in value, mptcptrace value)
+    differences = []
+
+    def check(conn_id, what, value, other_value):
+        if value != other_value:
+            differences.append((conn_id, what, value, other_value))
+
+    def check_rtt(conn_id, what, value, other_value):
+        if value is None or other_value is None or not np.isclose(value, other_value, rtol=CHECK_RTT_RELATIVE_TOLERANCE,
+                                                                      atol=CHECK_RTT_ABSOLUTE_TOLERANCE):
+            check(conn_id, what, value, other_value)
+
+    for conn_id, connection in sorted(connections.items()):
+        conn_candidates = candidates.get(get_initial_subflow(connection), [])
+        if not conn_candidates:
+            differences.append((conn_id, 'connection', 'found', 'not found'))
+            continue
+        other = min(conn_candidates, key=lambda candidate: abs(candidate.attr.get(co.START, 0) - connection.attr[co.START]))
+        conn_candidates.remove(other)
+        if len(connection.flows) != len(other.flows):
+            differences.append((conn_id, 'subflows', len(connection.flows), len(other.flows)))
+        for direction in co.DIRECTIONS:
+            attr, other_attr = connection.attr[direction], other.attr[direction]
+            for key in CHECKED_ATTRIBUTES:
+                check(conn_id, direction + ' ' + key, attr.get(key), other_attr.get(key))
+            for flow_id, flow in sorted(connection.flows.items()):
+                if flow_id in other.flows:
+                    for key in CHECKED_FLOW_ATTRIBUTES:
+                        check(conn_id, direction + ' subflow ' + str(flow_id) + ' ' + key, flow.attr[direction].get(key),
+                              other.flows[flow_id].attr[direction].get(key))
+            check(conn_id, direction + ' number of ' + co.BURSTS, len(attr.get(co.BURSTS, [])), len(other_attr.get(co.BURSTS, [])))
+            # Without samples, mptcptrace gives no RTT file
+            check(conn_id, direction + ' ' + co.RTT_SAMPLES, attr.get(co.RTT_SAMPLES, 0), other_attr.get(co.RTT_SAMPLES, 0))
+            for key in CHECKED_RTT_ATTRIBUTES:
+                if key in attr or key in other_attr:
+                    check_rtt(conn_id, direction + ' ' + key, attr.get(key), other_attr.get(key))
+            acksizes = acksize_all[direction].get(conn_id, {})
+            other_acksizes = mptcptrace_acksize_all[direction].get(other.conn_id, {})
+            # Only the ack sizes whose counts differ
+            sizes = sorted(size for size in set(acksizes) | set(other_acksizes) if acksizes.get(size) != other_acksizes.get(size))
+            if sizes:
+                differences.append((conn_id, direction + ' acksizes ' + str(sizes), [acksizes.get(size, 0) for size in sizes],
+                                    [other_acksizes.get(size, 0) for size in sizes]))
+    for conn_candidates in candidates.values():
+        for other in conn_candidates:
+            differences.append((None, 'connection ' + str(other.conn_id) + ' of mptcptrace', 'not found', 'found'))
+
+    for conn_id, what, value, other_value in differences:
+        print("Check of", pcap_filepath, "with mptcptrace: connection", conn_id, what, value, "instead of", other_value, file=sys.stderr)
+    print("Check of", pcap_filepath, "with mptcptrace:", len(differences), "differences", file=sys.stderr)
+    return len(differences)
+
+
 ##################################################
 #                MPTCP PROCESSING                #
 ##################################################
 
 
-def process_stats_csv(csv_fname, connections):
-    """ Add information in connections based on the stats csv file """
+def read_stats_csv(csv_fname):
+    """ Return the values of the stats csv file as {key: [value c2s, value s2c]} (strings, as in the file) for the keys of
+        MPTCP_STATS_KEYS, or None if the file cannot be read
+        Each line is split once, its key being the first of its fields that is in MPTCP_STATS_KEYS
+    """
+    try:
+        csv_file = open(csv_fname)
+        data = csv_file.readlines()
+        csv_file.close()
+    except IOError as e:
+        print(str(e), file=sys.stderr)
+        print('IOError for ' + csv_fname + ': skipped', file=sys.stderr)
+        return None
+
+    stats = {}
+    for line in data:
+        split_line = line.split(';')
+        for field in split_line[:-2]:
+            if field in MPTCP_STATS_KEYS:
+                stats[field] = split_line[-2:]
+                break
+    return stats
+
+
+def process_stats_csv(csv_fname, connections, stats=None):
+    """ Add information in connections based on the stats csv file, whose values can be given as stats (see read_stats_csv) """
     try:
         conn_id = get_connection_id(csv_fname)  # Or reuse conn_id from the stats file
         if conn_id not in connections:
             # Not a real connection; skip it
             return
 
-        csv_file = open(csv_fname)
-        data = csv_file.readlines()
-        seq_acked = None
-        con_time = None
-        begin_time = None
-        bytes_reinjected = None
-        pc_reinjected = None
-        for line in data:
-            if 'seqAcked' in line:
-                seq_acked = line.split(';')[-2:]
-            elif 'conTime' in line:
-                # Only takes one of the values, because they are the same
-                con_time = line.split(';')[-2]
-            elif 'beginTime' in line:
-                # Only takes one of the values, because they are the same
-                begin_time = line.split(';')[-2]
-            elif 'bytesReinjected' in line:
-                bytes_reinjected = line.split(';')[-2:]
-            elif 'precentReinjected' in line:
-                pc_reinjected = line.split(';')[-2:]
+        if stats is None:
+            stats = read_stats_csv(csv_fname)
+            if stats is None:
+                return
+        seq_acked = stats.get('seqAcked', None)
+        # Only takes one of the values of conTime and beginTime, because they are the same
+        con_time = stats['conTime'][0] if 'conTime' in stats else None
+        begin_time = stats['beginTime'][0] if 'beginTime' in stats else None
+        bytes_reinjected = stats.get('bytesReinjected', None)
+        pc_reinjected = stats.get('precentReinjected', None)
 
         if seq_acked:
             # Notice that these values remove the reinjected bytes
@@ -433,9 +840,9 @@ def process_stats_csv(csv_fname, connections):
             connections[conn_id].attr[co.DURATION] = 0.0
         if begin_time:
             str_begin = begin_time.split('.')
-            connections[conn_id].attr[co.START] = timedelta(seconds=int(str_begin[0]), microseconds=int(str_begin[1]))
+            connections[conn_id].attr[co.START] = int(str_begin[0]) * co.NS_PER_SEC + int(str_begin[1]) * 1000
         else:
-            connections[conn_id].attr[co.START] = timedelta(0)
+            connections[conn_id].attr[co.START] = 0
         if bytes_reinjected:
             connections[conn_id].attr[co.C2S][co.REINJ_BYTES] = int(bytes_reinjected[0])
             connections[conn_id].attr[co.S2C][co.REINJ_BYTES] = int(bytes_reinjected[1])
@@ -448,25 +855,41 @@ def process_stats_csv(csv_fname, connections):
         else:
             connections[conn_id].attr[co.C2S][co.REINJ_PC] = 0.0
             connections[conn_id].attr[co.S2C][co.REINJ_PC] = 0.0
-        csv_file.close()
-
-    except IOError as e:
-        print(str(e), file=sys.stderr)
-        print('IOError for ' + csv_fname + ': skipped', file=sys.stderr)
-        return
 
     except ValueError:
         print('ValueError for ' + csv_fname + ': skipped', file=sys.stderr)
         return
 
 
-def first_pass_on_files(connections):
+def load_stats_csvs(csv_fnames, nb_processes=1):
+    """ Return the list of the values of the stats csv files csv_fnames (see read_stats_csv), read by nb_processes worker processes
+        (forked in the directory of the files) if more than one
+    """
+    if nb_processes <= 1 or len(csv_fnames) <= 1 or multiprocessing.current_process().daemon:
+        # Daemonic processes (as workers of a pool) cannot have children
+        return [read_stats_csv(csv_fname) for csv_fname in csv_fnames]
+
+    pool = multiprocessing.Pool(processes=nb_processes)
+    try:
+        # Files are small: send them by large chunks
+        all_stats = pool.map(read_stats_csv, csv_fnames, chunksize=max(1, len(csv_fnames) // (nb_processes * 4)))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return all_stats
+
+
+def first_pass_on_files(connections, nb_processes=1):
     """ Do a first pass on files generated by mptcptrace in current directory, without modifying them
-        This modifies connections to add information contained in the files
+        This modifies connections to add information contained in the files (stats files being read by nb_processes processes)
     """
-    for csv_fname in glob.glob('*.csv'):
-        if csv_fname.startswith(MPTCP_STATS_PREFIX):
-            process_stats_csv(csv_fname, connections)
+    stats_fnames = sorted(glob.glob(MPTCP_STATS_PREFIX + '*.csv'))
+    for csv_fname, stats in zip(stats_fnames, load_stats_csvs(stats_fnames, nb_processes=nb_processes)):
+        if stats is not None:
+            process_stats_csv(csv_fname, connections, stats=stats)
 
 
 def process_gput_csv(csv_fname, connections):
@@ -552,139 +975,299 @@ def process_rm_addr_csv(csv_fname, connections, conn_id):
     csv_file.close()
 
 
-def process_trace(pcap_filepath, graph_dir_exp, stat_dir_exp, aggl_dir_exp, rtt_dir_exp, rtt_subflow_dir_exp, failed_conns_dir_exp, acksize_dir_exp, acksize_tcp_dir_exp, plot_cwin, tcpcsm, min_bytes=0, light=False, return_dict=False):
+def process_csv_file(csv_fname, connections, rtt_all, acksize_all, pcap_filepath, graph_dir_exp, light, return_dict, rtt_sketch):
+    """ Process an output file of mptcptrace, then remove it or move it in graph_dir_exp (by default, save only seq csv files) """
+    if not light:
+        if MPTCP_GPUT_FNAME in os.path.basename(csv_fname):
+            process_gput_csv(csv_fname, connections)
+    try:
+        if os.path.basename(csv_fname).startswith(MPTCP_ADDADDR_FNAME):
+            conn_id = get_connection_id(os.path.basename(csv_fname))
+            if conn_id not in connections:
+                # Not a real connection; skip it
+                return
+
+            process_add_addr_csv(csv_fname, connections, conn_id)
+            os.remove(csv_fname)
+
+        elif os.path.basename(csv_fname).startswith(MPTCP_RMADDR_FNAME):
+            conn_id = get_connection_id(os.path.basename(csv_fname))
+            if conn_id not in connections:
+                # Not a real connection; skip it
+                return
+
+            process_rm_addr_csv(csv_fname, connections, conn_id)
+            os.remove(csv_fname)
+
+        elif MPTCP_RTT_FNAME in os.path.basename(csv_fname):
+            conn_id = get_connection_id(os.path.basename(csv_fname))
+            if conn_id not in connections:
+                # Not a real connection; skip it
+                return
+
+            is_reversed = is_reverse_connection(os.path.basename(csv_fname))
+            process_rtt_csv(csv_fname, rtt_all, connections, conn_id, is_reversed, rtt_sketch=rtt_sketch)
+            os.remove(csv_fname)
+            # co.move_file(csv_fname, os.path.join(
+            #    graph_dir_exp, co.DEF_RTT_DIR, os.path.basename(co.get_pcap_basepath(pcap_filepath)) + "_" + csv_fname))
+        elif MPTCP_SEQ_FNAME in os.path.basename(csv_fname):
+            conn_id = get_connection_id(os.path.basename(csv_fname))
+            if conn_id not in connections:
+                # Not a real connection; skip it
+                return
+
+            is_reversed = is_reverse_connection(os.path.basename(csv_fname))
+            process_csv(csv_fname, connections, conn_id, is_reversed)
+            if return_dict:
+                try:
+                    os.remove(csv_fname)
+                except Exception:
+                    pass
+            else:
+                co.move_file(csv_fname, os.path.join(
+                    graph_dir_exp, co.TSG_THGPT_DIR, os.path.basename(co.get_pcap_basepath(pcap_filepath)) + "_" + os.path.basename(csv_fname)))
+        elif MPTCP_ACKSIZE_FNAME in os.path.basename(csv_fname):
+            collect_acksize_csv(csv_fname, connections, acksize_all)
+            os.remove(csv_fname)
+        else:
+            if not light and not return_dict:
+                co.move_file(csv_fname, os.path.join(
+                    graph_dir_exp, co.TSG_THGPT_DIR, os.path.basename(co.get_pcap_basepath(pcap_filepath)) + "_" + os.path.basename(csv_fname)))
+            else:
+                os.remove(csv_fname)
+    except IOError as e:
+        print(str(e), file=sys.stderr)
+
+
+# Job of the worker processes processing output files of mptcptrace:
+# (csv_fnames, nb_chunks, flow_ids, pcap_filepath, graph_dir_exp, light, return_dict, rtt_sketch) (see process_csv_files_sharded)
+csv_files_job = None
+
+
+def get_added_attributes(connection):
+    """ Return (attr, {flow_id: attr}) with the non-empty attributes of connection and its flows, or None if all are empty """
+    def non_empty(attr):
+        return dict([(key, value) for key, value in attr.items() if not (key in [co.C2S, co.S2C] and not value)])
+
+    attr = non_empty(connection.attr)
+    flows_attr = dict([(flow_id, non_empty(flow.attr)) for flow_id, flow in connection.flows.items() if non_empty(flow.attr)])
+    if not attr and not flows_attr:
+        return None
+    return attr, flows_attr
+
+
+def merge_attributes(attr, added_attr):
+    """ Add added_attr to attr, the attributes of a connection or a flow (those by direction being merged) """
+    for key, value in added_attr.items():
+        if key in [co.C2S, co.S2C]:
+            attr[key].update(value)
+        else:
+            attr[key] = value
+
+
+def process_csv_files(chunk):
+    """ Process the output files of mptcptrace of chunk (run in a worker process, in the directory of the files)
+        Return what they add to the connections as {conn_id: (attr, {flow_id: attr})} (see get_added_attributes), to rtt_all and to
+        acksize_all, so that only this is sent back to the parent process
+    """
+    csv_fnames, nb_chunks, flow_ids, pcap_filepath, graph_dir_exp, light, return_dict, rtt_sketch = csv_files_job
+    # Connections only having their flows, to collect what is added to them
+    connections = {}
+    for conn_id, conn_flow_ids in flow_ids.items():
+        connections[conn_id] = MPTCPConnection(conn_id)
+        for flow_id in conn_flow_ids:
+            connections[conn_id].flows[flow_id] = MPTCPSubFlow(flow_id)
+    rtt_all = {co.C2S: {}, co.S2C: {}}
+    acksize_all = {co.C2S: {}, co.S2C: {}}
+
+    for csv_fname in csv_fnames[chunk::nb_chunks]:
+        process_csv_file(csv_fname, connections, rtt_all, acksize_all, pcap_filepath, graph_dir_exp, light, return_dict, rtt_sketch)
+
+    added_attributes = {}
+    for conn_id, connection in connections.items():
+        added = get_added_attributes(connection)
+        if added:
+            added_attributes[conn_id] = added
+    return added_attributes, rtt_all, acksize_all
+
+
+def process_csv_files_sharded(csv_fnames, connections, rtt_all, acksize_all, nb_processes, pcap_filepath, graph_dir_exp, light, return_dict, rtt_sketch):
+    """ Process the output files of mptcptrace csv_fnames, filling connections, rtt_all and acksize_all (see process_csv_file)
+        With more than one process, they are shared by nb_processes worker processes (forked in the directory of the files)
+    """
+    global csv_files_job
+    if nb_processes <= 1 or len(csv_fnames) <= 1:
+        for csv_fname in csv_fnames:
+            process_csv_file(csv_fname, connections, rtt_all, acksize_all, pcap_filepath, graph_dir_exp, light, return_dict, rtt_sketch)
+        return
+
+    # Files have very different sizes: more chunks than processes balance the load
+    nb_chunks = min(len(csv_fnames), nb_processes * 4)
+    flow_ids = dict([(conn_id, list(connection.flows.keys())) for conn_id, connection in connections.items()])
+    csv_files_job = (sorted(csv_fnames), nb_chunks, flow_ids, pcap_filepath, graph_dir_exp, light, return_dict, rtt_sketch)
+    try:
+        if multiprocessing.current_process().daemon:
+            # Daemonic processes (as workers of a pool) cannot have children
+            print("Outputs of mptcptrace processed serially in a daemonic process", file=sys.stderr)
+            chunk_results = [process_csv_files(chunk) for chunk in range(nb_chunks)]
+        else:
+            pool = multiprocessing.Pool(processes=nb_processes)
+            try:
+                chunk_results = pool.map(process_csv_files, range(nb_chunks))
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+    finally:
+        csv_files_job = None
+
+    for added_attributes, chunk_rtt_all, chunk_acksize_all in chunk_results:
+        for conn_id, (attr, flows_attr) in added_attributes.items():
+            merge_attributes(connections[conn_id].attr, attr)
+            for flow_id, flow_attr in flows_attr.items():
+                merge_attributes(connections[conn_id].flows[flow_id].attr, flow_attr)
+        for direction in [co.C2S, co.S2C]:
+            rtt_all[direction].update(chunk_rtt_all[direction])
+            acksize_all[direction].update(chunk_acksize_all[direction])
+
+
+def get_graph_archive_index(graph_files_dir, trace_name):
+    """ Return the index of the graph files in graph_files_dir (named as trace_name + '_' + name given by mptcptrace), to be put in
+        the archive of the trace: {(conn_id, direction): [paths in the archive]} for files of a direction of a connection (ex.
+        c2s_seq_3.csv, their subflows being told by their names); other files can be found with co.graph_archive.glob
+    """
+    index = {}
+    for directory in [co.DEF_RTT_DIR, co.TSG_THGPT_DIR]:
+        for fname in sorted(os.listdir(os.path.join(graph_files_dir, directory))):
+            mptcptrace_fname = fname[len(trace_name) + 1:]
+            if not mptcptrace_fname.startswith('c2s_') and not mptcptrace_fname.startswith('s2c_'):
+                continue
+            try:
+                conn_id = get_connection_id(mptcptrace_fname)
+            except ValueError:
+                continue
+            direction = co.S2C if is_reverse_connection(mptcptrace_fname) else co.C2S
+            index.setdefault((conn_id, direction), []).append(directory + '/' + fname)
+    return index
+
+
+def run_mptcptrace(pcap_filepath, graph_dir_exp, light, return_dict, shards, rtt_sketch, scratch_dir, scratch_size, graph_archive, compress_graph_archive):
+    """ Return (connections, rtt_all, acksize_all) of the trace as given by mptcptrace and its output files (see process_trace)
+        Raise a MPTCPTraceError if mptcptrace encounters problems
+    """
+    with co.scratch_dir(scratch_dir, scratch_size, co.get_trace_size(pcap_filepath) * co.SCRATCH_SIZE_FACTOR,
+                        os.getcwd()) as csv_tmp_dir, co.cd(csv_tmp_dir):
+        # If segmentation faults, remove the -S option
+        # cmd = ['mptcptrace', '-f', pcap_filepath, '-s', '-S', '-t', '5000', '-w', '0']
+        # if not light:
+        #     cmd += ['-G', '250', '-r', '2', '-F', '3', '-a']
+        # connections = process_mptcptrace_cmd(cmd, pcap_filepath)
+        #
+        # # Useful to count the number of reinjected bytes
+        # cmd = ['mptcptrace', '-f', pcap_filepath, '-s', '-a', '-t', '5000', '-w', '2']
+        # if not light:
+        #     cmd += ['-G', '250', '-r', '2', '-F', '3']
+        # devnull = open(os.devnull, 'w')
+        # if subprocess.call(cmd, stdout=devnull) != 0:
+        #     raise MPTCPTraceError("Error of mptcptrace with " + pcap_filepath)
+        # devnull.close()
+        #
+        # cmd = ['mptcptrace', '-f', pcap_filepath, '-r', '2', '-t', '5000', '-w', '2']
+        # if not light:
+        #     cmd += ['-G', '250', '-r', '2', '-F', '3']
+        # devnull = open(os.devnull, 'w')
+        # if subprocess.call(cmd, stdout=devnull) != 0:
+        #     raise MPTCPTraceError("Error of mptcptrace with " + pcap_filepath)
+        # devnull.close()
+
+        with co.pcap_tool_path(pcap_filepath) as tool_pcap_path:
+            cmd = ['mptcptrace', '-f', tool_pcap_path, '-s', '-S', '-a', '-A', '-R', '-r', '2', '-t', '5000', '-w', '2']
+            connections = process_mptcptrace_cmd(cmd, pcap_filepath)
+
+        # The mptcptrace call will generate .xpl files to cope with
+        # First see all xpl files, to detect the relative 0 of all connections
+        # Also, compute the duration and number of bytes of the MPTCP connection
+        first_pass_on_files(connections, nb_processes=shards)
+        rtt_all = {co.C2S: {}, co.S2C: {}}
+        acksize_all = {co.C2S: {}, co.S2C: {}}
+
+        # Graph files are moved in graph_files_dir, with the same layout as graph_dir_exp
+        graph_files_dir = graph_dir_exp
+        if graph_archive and not return_dict:
+            graph_files_dir = os.path.join(csv_tmp_dir, GRAPH_FILES_DIR)
+            for directory in [co.DEF_RTT_DIR, co.TSG_THGPT_DIR]:
+                os.makedirs(os.path.join(graph_files_dir, directory))
+
+        # Then really process xpl files
+        if return_dict:
+            for xpl_fname in glob.glob(os.path.join('*.xpl')):
+                try:
+                    os.remove(xpl_fname)
+                except IOError as e:
+                    print(str(e), file=sys.stderr)
+        else:
+            for xpl_fname in glob.glob(os.path.join('*.xpl')):
+                try:
+                    directory = co.DEF_RTT_DIR if MPTCP_RTT_FNAME in xpl_fname else co.TSG_THGPT_DIR
+                    shutil.move(xpl_fname, os.path.join(
+                        graph_files_dir, directory, os.path.basename(co.get_pcap_basepath(pcap_filepath)) + "_" + os.path.basename(xpl_fname)))
+                except IOError as e:
+                    print(str(e), file=sys.stderr)
+
+        # Then process csv files, with shards worker processes
+        process_csv_files_sharded(glob.glob(os.path.join('*.csv')), connections, rtt_all, acksize_all, shards, pcap_filepath, graph_files_dir,
+                                  light, return_dict, rtt_sketch)
+
+        if graph_archive and not return_dict:
+            trace_name = os.path.basename(co.get_pcap_basepath(pcap_filepath))
+            co.write_graph_archive(graph_files_dir, os.path.join(graph_dir_exp, trace_name + co.GRAPH_ARCHIVE_EXT),
+                                   index=get_graph_archive_index(graph_files_dir, trace_name), compress=compress_graph_archive)
+
+        return connections, rtt_all, acksize_all
+
+
+def process_trace(pcap_filepath, graph_dir_exp, stat_dir_exp, aggl_dir_exp, rtt_dir_exp, rtt_subflow_dir_exp, failed_conns_dir_exp, acksize_dir_exp, acksize_tcp_dir_exp, plot_cwin, tcpcsm, min_bytes=0, light=False, return_dict=False, columns_dir=None, shards=1, rtt_sketch=False, scratch_dir=None, scratch_size=0, graph_archive=False, compress_graph_archive=False, mptcp_engine=MPTCP_ENGINE_MPTCPTRACE, fingerprint=None):
     """ Process a mptcp pcap file and generate graphs of its subflows
+        If rtt_sketch, the RTT samples of MPTCP connections are only saved as a co.QuantileSketch
+        Output files of mptcptrace are processed by shards worker processes, that also compute the MPTCP DSS retransmissions
+        The output files of mptcptrace are written in scratch_dir (with a budget of scratch_size bytes, see co.scratch_dir) if given
+        If graph_archive, the graph files kept are written in one archive (compressed if compress_graph_archive) in graph_dir_exp,
+        indexed by connection and direction (see get_graph_archive_index), instead of being moved one by one in its subdirectories
+        mptcp_engine tells how MPTCP connections are rebuilt (see MPTCP_ENGINES); the built-in engine reads the (possibly cached) TCP
+        columns of the trace, that are then reused by tcp.process_trace, and only writes the seq csv files of the graphs
+        fingerprint is the key of the cached columns of the trace if it is a copy of another file (see tcp.get_tcp_columns)
         Notice that we can't change dir per thread, we should use processes
     """
     # if not check_mptcp_joins(pcap_filepath):
     #     print("WARNING: no mptcp joins on " + pcap_filepath, file=sys.stderr)
-    csv_tmp_dir = tempfile.mkdtemp(dir=os.getcwd())
     connections = None
+    columns = None
     do_tcp_processing = False
     try:
-        with co.cd(csv_tmp_dir):
-            # If segmentation faults, remove the -S option
-            # cmd = ['mptcptrace', '-f', pcap_filepath, '-s', '-S', '-t', '5000', '-w', '0']
-            # if not light:
-            #     cmd += ['-G', '250', '-r', '2', '-F', '3', '-a']
-            # connections = process_mptcptrace_cmd(cmd, pcap_filepath)
-            #
-            # # Useful to count the number of reinjected bytes
-            # cmd = ['mptcptrace', '-f', pcap_filepath, '-s', '-a', '-t', '5000', '-w', '2']
-            # if not light:
-            #     cmd += ['-G', '250', '-r', '2', '-F', '3']
-            # devnull = open(os.devnull, 'w')
-            # if subprocess.call(cmd, stdout=devnull) != 0:
-            #     raise MPTCPTraceError("Error of mptcptrace with " + pcap_filepath)
-            # devnull.close()
-            #
-            # cmd = ['mptcptrace', '-f', pcap_filepath, '-r', '2', '-t', '5000', '-w', '2']
-            # if not light:
-            #     cmd += ['-G', '250', '-r', '2', '-F', '3']
-            # devnull = open(os.devnull, 'w')
-            # if subprocess.call(cmd, stdout=devnull) != 0:
-            #     raise MPTCPTraceError("Error of mptcptrace with " + pcap_filepath)
-            # devnull.close()
-
-            cmd = ['mptcptrace', '-f', pcap_filepath, '-s', '-S', '-a', '-A', '-R', '-r', '2', '-t', '5000', '-w', '2']
-            connections = process_mptcptrace_cmd(cmd, pcap_filepath)
-
-            # The mptcptrace call will generate .xpl files to cope with
-            # First see all xpl files, to detect the relative 0 of all connections
-            # Also, compute the duration and number of bytes of the MPTCP connection
-            first_pass_on_files(connections)
-            rtt_all = {co.C2S: {}, co.S2C: {}}
-            acksize_all = {co.C2S: {}, co.S2C: {}}
-
-            # Then really process xpl files
-            if return_dict:
-                for xpl_fname in glob.glob(os.path.join('*.xpl')):
-                    try:
-                        os.remove(xpl_fname)
-                    except IOError as e:
-                        print(str(e), file=sys.stderr)
-            else:
-                for xpl_fname in glob.glob(os.path.join('*.xpl')):
-                    try:
-                        directory = co.DEF_RTT_DIR if MPTCP_RTT_FNAME in xpl_fname else co.TSG_THGPT_DIR
-                        shutil.move(xpl_fname, os.path.join(
-                            graph_dir_exp, directory, os.path.basename(pcap_filepath[:-5]) + "_" + os.path.basename(xpl_fname)))
-                    except IOError as e:
-                        print(str(e), file=sys.stderr)
-
-            # And by default, save only seq csv files
-            for csv_fname in glob.glob(os.path.join('*.csv')):
-                if not light:
-                    if MPTCP_GPUT_FNAME in os.path.basename(csv_fname):
-                        process_gput_csv(csv_fname, connections)
-                try:
-                    if os.path.basename(csv_fname).startswith(MPTCP_ADDADDR_FNAME):
-                        conn_id = get_connection_id(os.path.basename(csv_fname))
-                        if conn_id not in connections:
-                            # Not a real connection; skip it
-                            continue
-
-                        process_add_addr_csv(csv_fname, connections, conn_id)
-                        os.remove(csv_fname)
-
-                    elif os.path.basename(csv_fname).startswith(MPTCP_RMADDR_FNAME):
-                        conn_id = get_connection_id(os.path.basename(csv_fname))
-                        if conn_id not in connections:
-                            # Not a real connection; skip it
-                            continue
-
-                        process_rm_addr_csv(csv_fname, connections, conn_id)
-                        os.remove(csv_fname)
-
-                    elif MPTCP_RTT_FNAME in os.path.basename(csv_fname):
-                        conn_id = get_connection_id(os.path.basename(csv_fname))
-                        if conn_id not in connections:
-                            # Not a real connection; skip it
-                            continue
-
-                        is_reversed = is_reverse_connection(os.path.basename(csv_fname))
-                        process_rtt_csv(csv_fname, rtt_all, connections, conn_id, is_reversed)
-                        os.remove(csv_fname)
-                        # co.move_file(csv_fname, os.path.join(
-                        #    graph_dir_exp, co.DEF_RTT_DIR, os.path.basename(pcap_filepath[:-5]) + "_" + csv_fname))
-                    elif MPTCP_SEQ_FNAME in os.path.basename(csv_fname):
-                        conn_id = get_connection_id(os.path.basename(csv_fname))
-                        if conn_id not in connections:
-                            # Not a real connection; skip it
-                            continue
-
-                        is_reversed = is_reverse_connection(os.path.basename(csv_fname))
-                        process_csv(csv_fname, connections, conn_id, is_reversed)
-                        if return_dict:
-                            try:
-                                os.remove(csv_fname)
-                            except Exception:
-                                pass
-                        else:
-                            co.move_file(csv_fname, os.path.join(
-                                graph_dir_exp, co.TSG_THGPT_DIR, os.path.basename(pcap_filepath[:-5]) + "_" + os.path.basename(csv_fname)))
-                    elif MPTCP_ACKSIZE_FNAME in os.path.basename(csv_fname):
-                        collect_acksize_csv(csv_fname, connections, acksize_all)
-                        os.remove(csv_fname)
-                    else:
-                        if not light and not return_dict:
-                            co.move_file(csv_fname, os.path.join(
-                                graph_dir_exp, co.TSG_THGPT_DIR, os.path.basename(pcap_filepath[:-5]) + "_" + os.path.basename(csv_fname)))
-                        else:
-                            os.remove(csv_fname)
-                except IOError as e:
-                    print(str(e), file=sys.stderr)
+        if mptcp_engine == MPTCP_ENGINE_MPTCPTRACE:
+            connections, rtt_all, acksize_all = run_mptcptrace(pcap_filepath, graph_dir_exp, light, return_dict, shards, rtt_sketch, scratch_dir,
+                                                               scratch_size, graph_archive, compress_graph_archive)
+        else:
+            print("Rebuilding MPTCP connections for", pcap_filepath)
+            columns = tcp.get_tcp_columns(pcap_filepath, columns_dir=columns_dir, fingerprint=fingerprint)
+            connections, rtt_all, acksize_all, seq_rows = reconstruct_mptcp_connections(columns, light=light, rtt_sketch=rtt_sketch)
+            if not return_dict:
+                write_seq_graph_files(seq_rows, pcap_filepath, graph_dir_exp, graph_archive=graph_archive,
+                                      compress_graph_archive=compress_graph_archive)
+            if mptcp_engine == MPTCP_ENGINE_CHECK:
+                check_with_mptcptrace(pcap_filepath, connections, acksize_all, shards=shards, scratch_dir=scratch_dir, scratch_size=scratch_size)
 
-            do_tcp_processing = True
+        do_tcp_processing = True
 
     except MPTCPTraceError as e:
         print(str(e) + "; skip mptcp process", file=sys.stderr)
 
-    shutil.rmtree(csv_tmp_dir)
-
     # This will save the mptcp connections
     if connections and do_tcp_processing:
-        dicts = tcp.process_trace(pcap_filepath, graph_dir_exp, stat_dir_exp, failed_conns_dir_exp, acksize_tcp_dir_exp, tcpcsm, mptcp_connections=connections, light=light, return_dict=return_dict)
+        dicts = tcp.process_trace(pcap_filepath, graph_dir_exp, stat_dir_exp, failed_conns_dir_exp, acksize_tcp_dir_exp, tcpcsm, mptcp_connections=connections, light=light, return_dict=return_dict,
+                                  columns_dir=columns_dir, shards=shards, columns=columns, fingerprint=fingerprint)
         if return_dict:
             tcp_connections, acksize_all_tcp = dicts
             return connections, tcp_connections, rtt_all, acksize_all, acksize_all_tcp
@@ -692,3 +1275,26 @@ def process_trace(pcap_filepath, graph_dir_exp, stat_dir_exp, aggl_dir_exp, rtt_
             co.save_data(pcap_filepath, acksize_dir_exp, acksize_all)
             co.save_data(pcap_filepath, rtt_dir_exp, rtt_all)
             co.save_data(pcap_filepath, stat_dir_exp, connections)
+
+
+def process_trace_directory(dir_exp, graph_dir_exp, stat_dir_exp, aggl_dir_exp, rtt_dir_exp, rtt_subflow_dir_exp, failed_conns_dir_exp, acksize_dir_exp, acksize_tcp_dir_exp, plot_cwin, tcpcsm, min_bytes=0, light=False, return_dict=False, columns_dir=None, shards=1, rtt_sketch=False, scratch_dir=None, scratch_size=0, graph_archive=False, compress_graph_archive=False, mptcp_engine=MPTCP_ENGINE_MPTCPTRACE):
+    """ Process all pcap files of a directory (ex. rotated traces of one session) as one trace
+        Their packets are merged in time order on the fly, without writing the merge on disk, so that
+        connections spanning several files are seen only once and entirely
+        Results are saved under the name of the directory
+    """
+    dir_exp = os.path.normpath(dir_exp)
+    if not os.path.isdir(dir_exp) or not co.get_pcap_files(dir_exp):
+        print("No pcap file in " + dir_exp + "; skip mptcp process", file=sys.stderr)
+        return None
+
+    # tstat creates a directory with the name of the trace: work elsewhere than next to the input directory
+    work_dir = tempfile.mkdtemp(dir=os.getcwd())
+    try:
+        with co.cd(work_dir):
+            return process_trace(dir_exp, graph_dir_exp, stat_dir_exp, aggl_dir_exp, rtt_dir_exp, rtt_subflow_dir_exp, failed_conns_dir_exp, acksize_dir_exp,
+                                 acksize_tcp_dir_exp, plot_cwin, tcpcsm, min_bytes=min_bytes, light=light, return_dict=return_dict,
+                                 columns_dir=columns_dir, shards=shards, rtt_sketch=rtt_sketch, scratch_dir=scratch_dir, scratch_size=scratch_size,
+                                 graph_archive=graph_archive, compress_graph_archive=compress_graph_archive, mptcp_engine=mptcp_engine)
+    finally:
+        shutil.rmtree(work_dir)
@@ -106,18 +106,18 @@ def plot(connections, multiflow_connections, sums_dir_exp):
                 if co.START not in flow.attr or flow.attr[co.SADDR] in co.IP_PROXY:
                     continue
 
-                if (flow.attr[co.START] - conn.attr[co.START]).total_seconds() < -30:
+                if co.ts_to_seconds(flow.attr[co.START] - conn.attr[co.START]) < -30:
                     continue
 
-                if flow.attr[co.START].total_seconds() < initial_sf_ts:
-                    initial_sf_ts = flow.attr[co.START].total_seconds()
+                if co.ts_to_seconds(flow.attr[co.START]) < initial_sf_ts:
+                    initial_sf_ts = co.ts_to_seconds(flow.attr[co.START])
                     initial_sf_id = flow_id
                 flow_bytes = 0
                 for direction in co.DIRECTIONS:
                     flow_bytes += flow.attr[direction].get(co.BYTES_DATA, 0)
-                if flow_bytes > 0 and co.TIME_LAST_ACK_TCP in flow.attr[co.S2C] and flow.attr[co.S2C][co.TIME_LAST_ACK_TCP].total_seconds() > 0.0 and co.TIME_LAST_ACK_TCP in flow.attr[co.C2S] and flow.attr[co.C2S][co.TIME_LAST_ACK_TCP].total_seconds() > 0.0:
-                    last_acks.append(flow.attr[co.S2C][co.TIME_LAST_ACK_TCP].total_seconds())
-                    min_time_last_ack = min(min_time_last_ack, flow.attr[co.S2C][co.TIME_LAST_ACK_TCP].total_seconds())
+                if flow_bytes > 0 and co.TIME_LAST_ACK_TCP in flow.attr[co.S2C] and co.ts_to_seconds(flow.attr[co.S2C][co.TIME_LAST_ACK_TCP]) > 0.0 and co.TIME_LAST_ACK_TCP in flow.attr[co.C2S] and co.ts_to_seconds(flow.attr[co.C2S][co.TIME_LAST_ACK_TCP]) > 0.0:
+                    last_acks.append(co.ts_to_seconds(flow.attr[co.S2C][co.TIME_LAST_ACK_TCP]))
+                    min_time_last_ack = min(min_time_last_ack, co.ts_to_seconds(flow.attr[co.S2C][co.TIME_LAST_ACK_TCP]))
 
             if initial_sf_ts == float('inf'):
                 continue
@@ -131,18 +131,18 @@ def plot(connections, multiflow_connections, sums_dir_exp):
                 if co.START not in flow.attr or flow.attr[co.SADDR] in co.IP_PROXY:
                     continue
 
-                if co.TIME_LAST_ACK_TCP not in flow.attr[co.S2C] or flow.attr[co.S2C][co.TIME_LAST_ACK_TCP].total_seconds() == 0 or co.TIME_LAST_ACK_TCP not in flow.attr[co.C2S] or flow.attr[co.C2S][co.TIME_LAST_ACK_TCP].total_seconds() == 0:
+                if co.TIME_LAST_ACK_TCP not in flow.attr[co.S2C] or co.ts_to_seconds(flow.attr[co.S2C][co.TIME_LAST_ACK_TCP]) == 0 or co.TIME_LAST_ACK_TCP not in flow.attr[co.C2S] or co.ts_to_seconds(flow.attr[co.C2S][co.TIME_LAST_ACK_TCP]) == 0:
                     # RST, don't consider as valid MP_JOIN
                     continue
 
-                if (flow.attr[co.START] - conn.attr[co.START]).total_seconds() < -30:
+                if co.ts_to_seconds(flow.attr[co.START] - conn.attr[co.START]) < -30:
                     continue
 
-                if (flow.attr[co.START] - conn.attr[co.START]).total_seconds() > conn.attr[co.DURATION]:
+                if co.ts_to_seconds(flow.attr[co.START] - conn.attr[co.START]) > conn.attr[co.DURATION]:
                     # This subflow is maybe wrongly attributed
                     continue
 
-                delta = flow.attr[co.START].total_seconds() - initial_sf_ts
+                delta = co.ts_to_seconds(flow.attr[co.START]) - initial_sf_ts
                 min_last_acks = float('inf')
                 if len(last_acks) >= 1:
                     min_last_acks = min(last_acks)
@@ -150,7 +150,7 @@ def plot(connections, multiflow_connections, sums_dir_exp):
                 max_last_payload = 0 - float('inf')
                 if flow.attr[co.C2S].get(co.BYTES, 0) > 0 or flow.attr[co.S2C].get(co.BYTES, 0) > 0:
                     max_last_payload = max([flow.attr[direction][co.TIME_LAST_PAYLD] for direction in co.DIRECTIONS])
-                handover_delta = flow.attr[co.START].total_seconds() + max_last_payload - min_last_acks
+                handover_delta = co.ts_to_seconds(flow.attr[co.START]) + max_last_payload - min_last_acks
                 if delta > 0.0:
                     min_delta = min(min_delta, delta)
                     if min_delta == delta:
@@ -183,7 +183,7 @@ def plot(connections, multiflow_connections, sums_dir_exp):
 
             if flow_id_min_delta:
                 syn_first_additional_sf.append(min_delta)
-                if conn.flows[initial_sf_id].attr[co.S2C][co.TIME_LAST_ACK_TCP].total_seconds() < conn.flows[flow_id_min_delta].attr[co.START].total_seconds():
+                if co.ts_to_seconds(conn.flows[initial_sf_id].attr[co.S2C][co.TIME_LAST_ACK_TCP]) < co.ts_to_seconds(conn.flows[flow_id_min_delta].attr[co.START]):
                     # Handover between initial and second subflow
                     second_sf_handover.append(min_delta)
                 if delta <= 0.2:
@@ -269,14 +269,14 @@ def plot(connections, multiflow_connections, sums_dir_exp):
             for flow_id, flow in conn.flows.iteritems():
                 if co.START not in flow.attr:
                     continue
-                if flow.attr[co.START].total_seconds() < initial_sf_ts:
-                    initial_sf_ts = flow.attr[co.START].total_seconds()
+                if co.ts_to_seconds(flow.attr[co.START]) < initial_sf_ts:
+                    initial_sf_ts = co.ts_to_seconds(flow.attr[co.START])
 
             min_delta = float('inf')
             for flow_id, flow in conn.flows.iteritems():
                 if co.START not in flow.attr:
                     continue
-                delta = flow.attr[co.START].total_seconds() - initial_sf_ts
+                delta = co.ts_to_seconds(flow.attr[co.START]) - initial_sf_ts
                 if delta > 0.0:
                     min_delta = min(min_delta, delta)
 
@@ -284,7 +284,7 @@ def plot(connections, multiflow_connections, sums_dir_exp):
             for flow_id, flow in conn.flows.iteritems():
                 if co.START not in flow.attr:
                     continue
-                delta = flow.attr[co.START].total_seconds() - initial_sf_ts
+                delta = co.ts_to_seconds(flow.attr[co.START]) - initial_sf_ts
                 for direction in co.DIRECTIONS:
                     bytes_total += flow.attr[direction].get(co.BYTES, 0)
                     if flow.attr[direction].get(co.BYTES, 0) >= 1000000000:
@@ -86,8 +86,8 @@ for fname, conns in multiflow_connections.iteritems():
             time_initial_sf = float('inf')
             flow_id_initial_sf = None
             for flow_id, flow in conn.flows.iteritems():
-                if co.START in flow.attr and flow.attr[co.START].total_seconds() < time_initial_sf:
-                    time_initial_sf = flow.attr[co.START].total_seconds()
+                if co.START in flow.attr and co.ts_to_seconds(flow.attr[co.START]) < time_initial_sf:
+                    time_initial_sf = co.ts_to_seconds(flow.attr[co.START])
                     flow_id_initial_sf = flow_id
 
             if not isinstance(flow_id_initial_sf, int):
@@ -97,8 +97,8 @@ for fname, conns in multiflow_connections.iteritems():
             flow_id_second_sf = None
             for flow_id, flow in conn.flows.iteritems():
                 if not flow_id == flow_id_initial_sf:
-                    if co.START in flow.attr and flow.attr[co.START].total_seconds() < time_second_sf:
-                        time_second_sf = flow.attr[co.START].total_seconds()
+                    if co.START in flow.attr and co.ts_to_seconds(flow.attr[co.START]) < time_second_sf:
+                        time_second_sf = co.ts_to_seconds(flow.attr[co.START])
                         flow_id_second_sf = flow_id
 
             if not isinstance(flow_id_second_sf, int):
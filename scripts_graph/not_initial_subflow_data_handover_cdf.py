@@ -104,13 +104,13 @@ for fname, conns in multiflow_connections.iteritems():
             for flow_id, flow in conn.flows.iteritems():
                 if co.START not in flow.attr or flow.attr[co.SADDR] in co.IP_PROXY:
                     continue
-                if flow.attr[co.START].total_seconds() < initial_sf_ts:
-                    initial_sf_ts = flow.attr[co.START].total_seconds()
+                if co.ts_to_seconds(flow.attr[co.START]) < initial_sf_ts:
+                    initial_sf_ts = co.ts_to_seconds(flow.attr[co.START])
                 flow_bytes = 0
                 for direction in co.DIRECTIONS:
                     flow_bytes += flow.attr[direction].get(co.BYTES_DATA, 0)
-                if flow_bytes > 0 and co.TIME_LAST_ACK_TCP in flow.attr[co.S2C] and co.TIME_FIN_ACK_TCP in flow.attr[co.S2C] and flow.attr[co.S2C][co.TIME_LAST_ACK_TCP].total_seconds() > 0.0 and flow.attr[co.S2C][co.TIME_FIN_ACK_TCP].total_seconds() == 0.0:
-                    min_last_ack = min(min_last_ack, flow.attr[co.S2C][co.TIME_LAST_ACK_TCP].total_seconds())
+                if flow_bytes > 0 and co.TIME_LAST_ACK_TCP in flow.attr[co.S2C] and co.TIME_FIN_ACK_TCP in flow.attr[co.S2C] and co.ts_to_seconds(flow.attr[co.S2C][co.TIME_LAST_ACK_TCP]) > 0.0 and co.ts_to_seconds(flow.attr[co.S2C][co.TIME_FIN_ACK_TCP]) == 0.0:
+                    min_last_ack = min(min_last_ack, co.ts_to_seconds(flow.attr[co.S2C][co.TIME_LAST_ACK_TCP]))
 
             if initial_sf_ts == float('inf'):
                 continue
@@ -123,8 +123,8 @@ for fname, conns in multiflow_connections.iteritems():
 
                 max_last_payload = 0 - float('inf')
                 if flow.attr[co.C2S].get(co.BYTES, 0) > 0 or flow.attr[co.S2C].get(co.BYTES, 0) > 0:
-                    if co.TIME_LAST_ACK_TCP in flow.attr[co.S2C] and flow.attr[co.S2C][co.TIME_LAST_ACK_TCP].total_seconds() > min_last_ack:
-                        max_last_payload = max([flow.attr[direction][co.TIME_LAST_PAYLD_TCP].total_seconds() for direction in co.DIRECTIONS])
+                    if co.TIME_LAST_ACK_TCP in flow.attr[co.S2C] and co.ts_to_seconds(flow.attr[co.S2C][co.TIME_LAST_ACK_TCP]) > min_last_ack:
+                        max_last_payload = max([co.ts_to_seconds(flow.attr[direction][co.TIME_LAST_PAYLD_TCP]) for direction in co.DIRECTIONS])
 
                 # handover_delta = float(flow.attr[co.START]) + max_last_payload - min_last_ack
                 handover_delta = max_last_payload - min_last_ack
@@ -138,13 +138,13 @@ for fname, conns in multiflow_connections.iteritems():
                 time_initial_sf = float('inf')
                 flow_id_initial_sf = None
                 for flow_id, flow in conn.flows.iteritems():
-                    if co.START in flow.attr and flow.attr[co.START].total_seconds() < time_initial_sf:
-                        time_initial_sf = flow.attr[co.START].total_seconds()
+                    if co.START in flow.attr and co.ts_to_seconds(flow.attr[co.START]) < time_initial_sf:
+                        time_initial_sf = co.ts_to_seconds(flow.attr[co.START])
                         flow_id_initial_sf = flow_id
 
                 count_actual_lost_subflows = 0
                 for flow_id, flow in conn.flows.iteritems():
-                    if co.START in flow.attr and flow.attr[co.START].total_seconds() > 0.0 and flow.attr.get(co.DURATION, 0.0) > 0.0 and co.TIME_FIN_ACK_TCP in flow.attr[co.S2C] and flow.attr[co.S2C][co.TIME_FIN_ACK_TCP].total_seconds() == 0.0:
+                    if co.START in flow.attr and co.ts_to_seconds(flow.attr[co.START]) > 0.0 and flow.attr.get(co.DURATION, 0.0) > 0.0 and co.TIME_FIN_ACK_TCP in flow.attr[co.S2C] and co.ts_to_seconds(flow.attr[co.S2C][co.TIME_FIN_ACK_TCP]) == 0.0:
                         # Only if flow is used
                         if flow.attr[co.C2S].get(co.BYTES, 0) > 0 or flow.attr[co.S2C].get(co.BYTES, 0) > 0:
                             count_actual_lost_subflows += 1
@@ -109,16 +109,16 @@ for fname, conns in multiflow_connections.iteritems():
                     if not flow_id == 0 and flow.attr[co.DURATION] < 1.0:
                         nb_unused_addi_rst += 1
 
-                if co.TIME_FIRST_ACK in flow.attr[co.S2D] and flow.attr[co.S2D][co.TIME_FIRST_ACK] + flow.attr[co.START].total_seconds() >= conn.attr[co.START].total_seconds() + float(conn.attr[co.DURATION]):
+                if co.TIME_FIRST_ACK in flow.attr[co.S2D] and flow.attr[co.S2D][co.TIME_FIRST_ACK] + co.ts_to_seconds(flow.attr[co.START]) >= co.ts_to_seconds(conn.attr[co.START]) + float(conn.attr[co.DURATION]):
                     nb_after_duration += 1
 
                 after_duration_burst = False
                 if not flow_id == 0 and co.TIME_FIRST_ACK in flow.attr[co.S2D] and co.BURSTS in conn.attr[co.D2S] and co.BURSTS in conn.attr[co.S2D]:
                     if len(conn.attr[co.D2S][co.BURSTS]) > 0:
-                        if flow.attr[co.S2D][co.TIME_FIRST_ACK] + flow.attr[co.START].total_seconds() >= conn.attr[co.D2S][co.BURSTS][-1][4] + conn.attr[co.D2S][co.BURSTS][-1][3]:
+                        if flow.attr[co.S2D][co.TIME_FIRST_ACK] + co.ts_to_seconds(flow.attr[co.START]) >= conn.attr[co.D2S][co.BURSTS][-1][4] + conn.attr[co.D2S][co.BURSTS][-1][3]:
                             after_duration_burst = True
                     if len(conn.attr[co.S2D][co.BURSTS]) > 0:
-                        if flow.attr[co.S2D][co.TIME_FIRST_ACK] + flow.attr[co.START].total_seconds() >= conn.attr[co.S2D][co.BURSTS][-1][4] + conn.attr[co.S2D][co.BURSTS][-1][3]:
+                        if flow.attr[co.S2D][co.TIME_FIRST_ACK] + co.ts_to_seconds(flow.attr[co.START]) >= conn.attr[co.S2D][co.BURSTS][-1][4] + conn.attr[co.S2D][co.BURSTS][-1][3]:
                             after_duration_burst = True
 
                     if len(conn.attr[co.D2S][co.BURSTS]) == 0 and len(conn.attr[co.S2D][co.BURSTS]) == 0:
@@ -133,8 +133,8 @@ for fname, conns in multiflow_connections.iteritems():
                     best = True
                     for other_flow_id, other_flow_cand in conn.flows.iteritems():
                         if not other_flow_id == flow_id and co.TIME_FIRST_ACK in flow.attr[co.S2D]:
-                            if co.START in other_flow_cand and flow.attr[co.S2D][co.TIME_FIRST_ACK] + flow.attr[co.START].total_seconds() >= other_flow_cand.attr[co.START].total_seconds():
-                                if flow.attr[co.S2D][co.TIME_FIRST_ACK] + flow.attr[co.START].total_seconds() <= other_flow_cand.attr[co.START].total_seconds() + other_flow_cand.attr.get(co.DURATION, 0):
+                            if co.START in other_flow_cand and flow.attr[co.S2D][co.TIME_FIRST_ACK] + co.ts_to_seconds(flow.attr[co.START]) >= co.ts_to_seconds(other_flow_cand.attr[co.START]):
+                                if flow.attr[co.S2D][co.TIME_FIRST_ACK] + co.ts_to_seconds(flow.attr[co.START]) <= co.ts_to_seconds(other_flow_cand.attr[co.START]) + other_flow_cand.attr.get(co.DURATION, 0):
                                     other_flows.append(other_flow_cand)
                                     if co.RTT_AVG in other_flow_cand.attr[co.D2S] and other_flow_cand.attr[co.D2S][co.RTT_AVG] < flow.attr[co.D2S][co.RTT_AVG]:
                                         best = False
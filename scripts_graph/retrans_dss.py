@@ -96,14 +96,14 @@ def has_two_opened_sfs(ts_delta, ts_delta_first_sent, idle_time, connection, dir
     for flow_id, flow in conn.flows.iteritems():
         if direction == co.C2S:
             # TODO should have one more attribute here...
-            if co.START in flow.attr and ((ts_delta_first_sent - flow.attr[co.START]).total_seconds() >= 0.0
-                                          and (ts_delta_first_sent - flow.attr[co.START]).total_seconds() <= flow.attr[co.DURATION]):
+            if co.START in flow.attr and (co.ts_to_seconds(ts_delta_first_sent - flow.attr[co.START]) >= 0.0
+                                          and co.ts_to_seconds(ts_delta_first_sent - flow.attr[co.START]) <= flow.attr[co.DURATION]):
                 count += 1
         else:
-            if co.START in flow.attr and (((ts_delta_first_sent - idle_time - flow.attr[co.START]).total_seconds() - flow.attr[co.S2C][co.TIME_FIRST_ACK] >= 0.0
-                                          and (ts_delta_first_sent - flow.attr[co.START]).total_seconds() <= flow.attr[co.DURATION])
+            if co.START in flow.attr and ((co.ts_to_seconds(ts_delta_first_sent - idle_time - flow.attr[co.START]) - flow.attr[co.S2C][co.TIME_FIRST_ACK] >= 0.0
+                                          and co.ts_to_seconds(ts_delta_first_sent - flow.attr[co.START]) <= flow.attr[co.DURATION])
                                           or (co.TIME_LAST_ACK_TCP in flow.attr
-                                          and (flow.attr[co.TIME_LAST_ACK_TCP] - ts_delta).total_seconds() > 0.0)):
+                                          and co.ts_to_seconds(flow.attr[co.TIME_LAST_ACK_TCP] - ts_delta) > 0.0)):
                 count += 1
 
     return count >= 2
@@ -118,9 +118,9 @@ for fname, conns in multiflow_connections.iteritems():
         retrans_dss = {}
         for ts_delta, flow_id, dss, idle_time, retrans_since_first, retrans_since_last, retrans_since_last_all in conn.attr[co.S2C][co.RETRANS_DSS]:
             if conn.attr[co.S2C][co.RTT_SAMPLES] > 1 and has_two_opened_sfs(ts_delta, ts_delta - retrans_since_first, idle_time, conn, co.S2C):
-                retransmissions_since_first.append(retrans_since_first.total_seconds() * 1000.0 / conn.attr[co.S2C][co.RTT_AVG])
-                retransmissions_since_last.append(retrans_since_last.total_seconds() * 1000.0 / conn.attr[co.S2C][co.RTT_AVG])
-                retransmissions_since_last_active.append(retrans_since_last_all.total_seconds() * 1000.0 / conn.attr[co.S2C][co.RTT_AVG])
+                retransmissions_since_first.append(co.ts_to_seconds(retrans_since_first) * 1000.0 / conn.attr[co.S2C][co.RTT_AVG])
+                retransmissions_since_last.append(co.ts_to_seconds(retrans_since_last) * 1000.0 / conn.attr[co.S2C][co.RTT_AVG])
+                retransmissions_since_last_active.append(co.ts_to_seconds(retrans_since_last_all) * 1000.0 / conn.attr[co.S2C][co.RTT_AVG])
                 if dss not in retrans_dss:
                     retrans_dss[dss] = 0
                 retrans_dss[dss] += 1
@@ -95,7 +95,7 @@ for fname, conns in multiflow_connections.iteritems():
             if co.START not in conn.attr:
                 continue
 
-            start_time = conn.attr[co.START].total_seconds()
+            start_time = co.ts_to_seconds(conn.attr[co.START])
             # Avoid taking into account connections that do not use at least two subflows
             nb_flows = 0
             for flow_id, flow in conn.flows.iteritems():
@@ -110,7 +110,7 @@ for fname, conns in multiflow_connections.iteritems():
             for flow_id, flow in conn.flows.iteritems():
                 if co.START not in flow.attr:
                     continue
-                flow_start_time = flow.attr[co.START].total_seconds()
+                flow_start_time = co.ts_to_seconds(flow.attr[co.START])
                 min_start_time = min(min_start_time, flow_start_time)
                 flow_start_time_int = long(flow_start_time)
                 flow_start_time_dec = float('0.' + str(flow_start_time - flow_start_time_int).split('.')[1])
@@ -166,8 +166,8 @@ for fname, conns in multiflow_connections.iteritems():
                         # time_diff = start_flow_time - start_time
                         for ts, _, _, _ in flow.attr[direction][co.TIMESTAMP_RETRANS]:
                             # Some tricks to avoid floating errors
-                            ts_int = long(ts.total_seconds())
-                            ts_dec = float('0.' + str(ts.total_seconds() - ts_int).split('.')[1])
+                            ts_int = long(co.ts_to_seconds(ts))
+                            ts_dec = float('0.' + str(co.ts_to_seconds(ts) - ts_int).split('.')[1])
                             ts_dec = ceil(ts_dec * 1000000) / 1000000.0
                             ts_dec_delta = ts_dec - start_time_dec
                             ts_fix_int = ts_int - start_time_int
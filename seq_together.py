@@ -29,6 +29,7 @@ from __future__ import print_function
 import argparse
 import bisect
 import common as co
+import fnmatch
 import glob
 import matplotlib
 # Do not use any X11 backend
@@ -56,12 +57,15 @@ parser.add_argument("-d",
                     "--dirs", help="list of directories to aggregate", nargs="+")
 parser.add_argument("-c",
                     "--csv", help="directory where csvs/xpls are located")
+parser.add_argument("-a",
+                    "--archives", help="directory where the archives of csvs/xpls of traces are located (see --graph-archive of analyze.py)")
 
 args = parser.parse_args()
 
 stat_dir_exp = os.path.abspath(os.path.expanduser(args.stat))
 sums_dir_exp = os.path.abspath(os.path.expanduser(args.sums))
-csv_dir_exp = os.path.abspath(os.path.expanduser(args.csv))
+csv_dir_exp = os.path.abspath(os.path.expanduser(args.csv)) if args.csv else None
+archives_dir_exp = os.path.abspath(os.path.expanduser(args.archives)) if args.archives else None
 
 co.check_directory_exists(sums_dir_exp)
 
@@ -89,6 +93,34 @@ def fetch_data(dir_exp):
 connections = fetch_data(stat_dir_exp)
 
 
+def read_lines(filepath):
+    """ Return the lines of the file filepath """
+    graph_file = open(filepath)
+    data = graph_file.readlines()
+    graph_file.close()
+    return data
+
+
+def iter_graph_files(fname, pattern):
+    """ Yield (filename, read) for the csvs/xpls of the traces matching fname with names matching fname + pattern (ex. '_*.xpl'),
+        found in the archives of archives_dir_exp and in csv_dir_exp; read() returns the lines of the file
+        In an archive, the files of both directions of the connections of its trace (from the stat files) are looked up in its
+        index, without listing its members; each archive is opened once, whatever the number of its files read
+    """
+    if archives_dir_exp:
+        for archive_path in sorted(glob.glob(os.path.join(archives_dir_exp, fname + co.GRAPH_ARCHIVE_EXT))):
+            trace_name = os.path.basename(archive_path)[:-len(co.GRAPH_ARCHIVE_EXT)]
+            with co.graph_archive(archive_path) as archive:
+                for conn_id in sorted(connections.get(trace_name, {})):
+                    for direction in co.DIRECTIONS:
+                        for name in archive.members((conn_id, direction)):
+                            if fnmatch.fnmatch(name, co.TSG_THGPT_DIR + '/' + fname + pattern):
+                                yield os.path.basename(name), lambda name=name: archive.readlines(name)
+    if csv_dir_exp:
+        for graph_path in glob.glob(os.path.join(csv_dir_exp, fname + pattern)):
+            yield os.path.basename(graph_path), lambda graph_path=graph_path: read_lines(graph_path)
+
+
 def is_reverse_connection(csv_fname):
     first_underscore_index = csv_fname.rindex("_")
     second_underscore_index = csv_fname[:first_underscore_index].rindex("_")
@@ -118,20 +150,18 @@ def seq_d2s_all_connections(time_loss=1.5):
             for conn_id, conn in conns.iteritems():
                 for flow_id, flow in conn.flows.iteritems():
                     if co.START in flow.attr:
-                        min_start = flow.attr[co.START].total_seconds()
+                        min_start = co.ts_to_seconds(flow.attr[co.START])
 
             offset_duration = {}
             for conn_id, conn in conns.iteritems():
                 offset_duration[conn_id] = {}
                 for flow_id, flow in conn.flows.iteritems():
                     if co.START in flow.attr:
-                        offset_duration[conn_id][flow_id] = flow.attr[co.START].total_seconds() - min_start
+                        offset_duration[conn_id][flow_id] = co.ts_to_seconds(flow.attr[co.START]) - min_start
 
-            for xpl_path in glob.glob(os.path.join(csv_dir_exp, fname + '_*.xpl')):
-                xpl_fname = os.path.basename(xpl_path)
+            for xpl_fname, read_xpl in iter_graph_files(fname, '_*.xpl'):
                 if 'tsg' not in xpl_fname:
                     continue
-                xpl_fullpath = os.path.abspath(os.path.expanduser(xpl_path))
                 # Preprocessing, avoid wasting time with not interesting files
                 flow_name, from_server_to_smartphone = tcp.get_flow_name(xpl_fname)
                 if not from_server_to_smartphone:
@@ -139,9 +169,7 @@ def seq_d2s_all_connections(time_loss=1.5):
 
                 # Opening of the file
                 try:
-                    xpl_file = open(xpl_fullpath)
-                    data = xpl_file.readlines()
-                    xpl_file.close()
+                    data = read_xpl()
                 except IOError as e:
                     print(str(e))
                     continue
@@ -164,10 +192,10 @@ def seq_d2s_all_connections(time_loss=1.5):
                     continue
 
                 # Now process the file
-                start_connections.append(conn.attr[co.START].total_seconds() - min_start)
+                start_connections.append(co.ts_to_seconds(conn.attr[co.START]) - min_start)
                 interface = conn.flows[flow_id].attr[co.IF]
-                conn_event[interface].append((conn.attr[co.START].total_seconds() - min_start, 'start'))
-                start_subflows[interface].append(conn.flows[flow_id].attr[co.START].total_seconds() - min_start)
+                conn_event[interface].append((co.ts_to_seconds(conn.attr[co.START]) - min_start, 'start'))
+                start_subflows[interface].append(co.ts_to_seconds(conn.flows[flow_id].attr[co.START]) - min_start)
 
                 if offset_duration[conn_id][flow_id] == float('inf'):
                     print('Skipped', fname, conn_id, flow_id, flow_name, conn.attr)
@@ -192,7 +220,7 @@ def seq_d2s_all_connections(time_loss=1.5):
                     conn_event[interface].append((last_time + offset_duration[conn_id][flow_id], 'end'))
                 else:
                     # Opened too shortly
-                    conn_event[interface].append((conn.attr[co.START].total_seconds() - min_start + 0.010000, 'end'))
+                    conn_event[interface].append((co.ts_to_seconds(conn.attr[co.START]) - min_start + 0.010000, 'end'))
 
                 for reinject_time, reinject_type in conn.flows[flow_id].attr[co.D2S][co.TCPCSM_RETRANS]:
                     ts_int = int(reinject_time.split('.')[0])
@@ -342,10 +370,9 @@ def seq_d2s_all_connections(time_loss=1.5):
             min_start = float('inf')
             for conn_id, conn in conns.iteritems():
                 if co.START in conn.flow.attr:
-                    min_start = min(min_start, conn.flow.attr[co.START].total_seconds())
+                    min_start = min(min_start, co.ts_to_seconds(conn.flow.attr[co.START]))
 
-            for xpl_path in glob.glob(os.path.join(csv_dir_exp, fname + '_*.xpl')):
-                xpl_fname = os.path.basename(xpl_path)
+            for xpl_fname, read_xpl in iter_graph_files(fname, '_*.xpl'):
                 # Preprocessing, avoid wasting time with not interesting files
                 conn_id, from_server_to_smartphone = tcp.get_flow_name(xpl_fname)
                 if not from_server_to_smartphone:
@@ -353,19 +380,17 @@ def seq_d2s_all_connections(time_loss=1.5):
 
                 # Opening of the file
                 try:
-                    xpl_file = open(xpl_path)
-                    data = xpl_file.readlines()
-                    xpl_file.close()
+                    data = read_xpl()
                 except IOError as e:
                     print(str(e))
                     continue
 
                 # Now process the file
                 conn = connections[fname][conn_id]
-                start_connections.append(conn.flow.attr[co.START].total_seconds() - min_start)
-                offset = conn.flow.attr[co.START].total_seconds() - min_start
+                start_connections.append(co.ts_to_seconds(conn.flow.attr[co.START]) - min_start)
+                offset = co.ts_to_seconds(conn.flow.attr[co.START]) - min_start
                 interface = conn.flow.attr[co.IF]
-                conn_event[interface].append((conn.flow.attr[co.START].total_seconds() - min_start, 'start'))
+                conn_event[interface].append((co.ts_to_seconds(conn.flow.attr[co.START]) - min_start, 'start'))
                 last_time = None
                 is_white = False
                 for line in data:
@@ -385,7 +410,7 @@ def seq_d2s_all_connections(time_loss=1.5):
                     conn_event[interface].append((last_time + offset, 'end'))
                 else:
                     # Opened too shortly
-                    conn_event[interface].append((conn.flow.attr[co.START].total_seconds() - min_start + 0.010000, 'end'))
+                    conn_event[interface].append((co.ts_to_seconds(conn.flow.attr[co.START]) - min_start + 0.010000, 'end'))
 
                 for reinject_time, reinject_type in conn.flow.attr[co.D2S].get(co.TCPCSM_RETRANS, []):
                     ts_int = int(reinject_time.split('.')[0])
@@ -521,12 +546,9 @@ seq_d2s_all_connections()
 
 def collect_seq():
     seqs = {}
-    for csv_path in glob.glob(os.path.join(csv_dir_exp, '*.csv')):
-        csv_fname = os.path.basename(csv_path)
+    for csv_fname, read_csv in iter_graph_files('*', '.csv'):
         try:
-            csv_file = open(csv_path)
-            data = csv_file.readlines()
-            csv_file.close()
+            data = read_csv()
         except IOError as e:
             print(str(e))
             continue
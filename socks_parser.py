@@ -11,13 +11,13 @@ from __future__ import print_function
 
 import argparse
 import common as co
-import dpkt
 import hashlib
 import os
 import string
 import struct
 import subprocess
 import sys
+import tcp
 
 PASSWORD = "password"
 if os.path.isfile('config.py'):
@@ -45,6 +45,8 @@ if __name__ == "__main__":
                         nargs="+", default=["_" + co.DEF_IFACE + ".", "_wlan0.", "_rmnet0."])
     parser.add_argument("-P",
                         "--ports", help="directory where the ports results will be stored", default=DEF_PORTS_DIR)
+    parser.add_argument("--columns", help="directory of the cache of the TCP packet columns of traces (empty to disable it)",
+                        default=co.DEF_COLUMNS_DIR)
 
     args = parser.parse_args()
 
@@ -52,6 +54,7 @@ if __name__ == "__main__":
     # ~/graphs -> /home/mptcp/graphs_lo ; ../graphs/ -> /home/mptcp/graphs_lo
     trace_dir_exp = co.get_dir_from_arg(args.trace, args.pcap[0])
     ports_dir_exp = co.get_dir_from_arg(args.ports, args.pcap[0])
+    columns_dir_exp = co.get_dir_from_arg(args.columns) if args.columns else None
 
     if os.path.isdir(in_dir_exp):
         # add the basename of the input dir
@@ -63,6 +66,8 @@ if __name__ == "__main__":
     print_out = sys.stdout
 
     co.check_directory_exists(ports_dir_exp)
+    if columns_dir_exp:
+        co.check_directory_exists(columns_dir_exp)
 
     class TSharkError(Exception):
         pass
@@ -212,28 +217,16 @@ def get_ip_address(cmd):
     return str(ord(cmd[1])) + '.' + str(ord(cmd[2])) + '.' + str(ord(cmd[3])) + '.' + str(ord(cmd[4]))
 
 
-def process_pcap(pcap_filepath, ports):
-    # condition = "tcp.len==7"
-    # tshark_filter(condition, pcap_filepath, pcap_filtered_filepath)
-    file = open(pcap_filepath)
-    try:
-        pcap = dpkt.pcap.Reader(file)
-        for ts, data in pcap:
-            eth = dpkt.ethernet.Ethernet(data)
-            ip = eth.data
-            tcp = ip.data
-            if len(tcp.data) == 7:
-                crypted_socks_cmd = tcp.data
-                decrypted_socks_cmd = decode(crypted_socks_cmd)
-                if decrypted_socks_cmd[0] == b'\x01': # Connect
-                    add_port(decrypted_socks_cmd, ports)
-    except Exception as e:
-        print(e)
-
-    file.close()
+def process_pcap(pcap_filepath, ports, columns_dir=None):
+    """ Count the ports of the SOCKS connect commands (payloads of 7 bytes) of the (possibly cached) columns of the trace """
+    columns = tcp.get_tcp_columns(pcap_filepath, columns_dir=columns_dir)
+    for index, crypted_socks_cmd in columns.data.items():
+        decrypted_socks_cmd = decode(crypted_socks_cmd)
+        if decrypted_socks_cmd[0] == b'\x01': # Connect
+            add_port(decrypted_socks_cmd, ports)
 
 if __name__ == "__main__":
     for pcap_filepath in pcap_list:
         ports = {}
-        process_pcap(pcap_filepath, ports)
+        process_pcap(pcap_filepath, ports, columns_dir=columns_dir_exp)
         co.save_data(pcap_filepath, ports_dir_exp, ports)
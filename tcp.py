@@ -21,24 +21,29 @@
 #  Contains code related to the processing of TCP traces
 
 from __future__ import print_function
-# from collections import deque
+from collections import deque
 
 ##################################################
 #                    IMPORTS                     #
 ##################################################
 
-from datetime import timedelta
 
+import array
 import bisect
 import common as co
 import dpkt
 import glob
+import heapq
+import multiprocessing
+import numpy as np
 import os
 import shutil
 import socket
 import socks_parser
+import struct
 import subprocess
 import sys
+import tempfile
 
 ##################################################
 #                   EXCEPTIONS                   #
@@ -59,12 +64,25 @@ dss_not_ack_warning = False
 #                 CONSTANTS                      #
 ##################################################
 
-SEQ_C2S = 'seq_c2s'
-SEQ_S2C = 'seq_s2c'
 HSEQ_C2S = 'hseq_c2s'
 HSEQ_S2C = 'hseq_s2c'
 CLIENT = 'client'
 SERVER = 'server'
+# Time (in ns) an acknowledged sequence number is still kept, to detect retransmissions when the ACK was lost after the capture point
+ACKED_SEQ_TIMEOUT = 10 * co.NS_PER_SEC
+# Time (in ns) without packets after which the state of a connection that sent a FIN or a RST is dropped
+CLOSED_CONN_TIMEOUT = 60 * co.NS_PER_SEC
+# Duration (in ns) of a slot of the timer wheel expiring the state of connections
+EXPIRY_TICK = co.NS_PER_SEC
+# Version of the format of the cached columns of traces, part of their path (see get_tcp_columns)
+COLUMNS_VERSION = 2
+# Columns of TCPColumns with one value per packet, and the ones that are RaggedColumns
+PACKET_COLUMNS = ['ts_delta', 'flow', 'seq', 'ack', 'flags', 'payload_len', 'frame_len']
+RAGGED_COLUMNS = ['opts', 'data']
+# Options are only kept in TCPColumns when they contain this byte (the kind of MPTCP options)
+MPTCP_OPTION_KIND = b'\x1e'
+# Number of packets read at once from TCPColumns
+ITER_CHUNK_SIZE = 65536
 
 ##################################################
 #            CONNECTION DATA RELATED             #
@@ -101,8 +119,8 @@ def extract_tstat_data_tcp_complete(filename, connections, conn_id):
             connection.flow.attr[co.DPORT] = info[15]
             connection.flow.detect_ipv4()
             connection.flow.indicates_wifi_or_cell()
-            # Except RTT, all time (in ms in tstat) shoud be converted into seconds
-            connection.flow.attr[co.START] = timedelta(seconds=float(info[28])/1000)
+            # Except RTT and START (a timestamp, in nanoseconds), all time (in ms in tstat) shoud be converted into seconds
+            connection.flow.attr[co.START] = int(float(info[28]) * 1000000)
             connection.flow.attr[co.DURATION] = float(info[30]) / 1000.0
             connection.flow.attr[co.C2S][co.PACKS] = int(info[2])
             connection.flow.attr[co.S2C][co.PACKS] = int(info[16])
@@ -186,17 +204,17 @@ def extract_tstat_data_tcp_complete(filename, connections, conn_id):
             connection.flow.attr[co.C2S][co.TIMESTAMP_RETRANS] = []
             connection.flow.attr[co.S2C][co.TIMESTAMP_RETRANS] = []
 
-            connection.flow.attr[co.C2S][co.TIME_FIN_ACK_TCP] = timedelta(0)
-            connection.flow.attr[co.S2C][co.TIME_FIN_ACK_TCP] = timedelta(0)
+            connection.flow.attr[co.C2S][co.TIME_FIN_ACK_TCP] = 0
+            connection.flow.attr[co.S2C][co.TIME_FIN_ACK_TCP] = 0
 
-            connection.flow.attr[co.C2S][co.TIME_LAST_ACK_TCP] = timedelta(0)
-            connection.flow.attr[co.S2C][co.TIME_LAST_ACK_TCP] = timedelta(0)
+            connection.flow.attr[co.C2S][co.TIME_LAST_ACK_TCP] = 0
+            connection.flow.attr[co.S2C][co.TIME_LAST_ACK_TCP] = 0
 
-            connection.flow.attr[co.C2S][co.TIME_LAST_PAYLD_TCP] = timedelta(0)
-            connection.flow.attr[co.S2C][co.TIME_LAST_PAYLD_TCP] = timedelta(0)
+            connection.flow.attr[co.C2S][co.TIME_LAST_PAYLD_TCP] = 0
+            connection.flow.attr[co.S2C][co.TIME_LAST_PAYLD_TCP] = 0
 
-            connection.flow.attr[co.C2S][co.TIME_LAST_PAYLD_WITH_RETRANS_TCP] = timedelta(0)
-            connection.flow.attr[co.S2C][co.TIME_LAST_PAYLD_WITH_RETRANS_TCP] = timedelta(0)
+            connection.flow.attr[co.C2S][co.TIME_LAST_PAYLD_WITH_RETRANS_TCP] = 0
+            connection.flow.attr[co.S2C][co.TIME_LAST_PAYLD_WITH_RETRANS_TCP] = 0
 
             connections[conn_id] = connection
 
@@ -224,8 +242,8 @@ def extract_tstat_data_tcp_nocomplete(filename, connections, conn_id):
 
             connection.flow.detect_ipv4()
             connection.flow.indicates_wifi_or_cell()
-            # Except RTT, all time (in ms in tstat) shoud be converted into seconds
-            connection.flow.attr[co.START] = timedelta(seconds=float(info[28])/1000)
+            # Except RTT and START (a timestamp, in nanoseconds), all time (in ms in tstat) shoud be converted into seconds
+            connection.flow.attr[co.START] = int(float(info[28]) * 1000000)
             connection.flow.attr[co.DURATION] = float(info[30]) / 1000.0
             connection.flow.attr[co.C2S][co.PACKS] = int(info[2])
             connection.flow.attr[co.S2C][co.PACKS] = int(info[16])
@@ -267,17 +285,17 @@ def extract_tstat_data_tcp_nocomplete(filename, connections, conn_id):
             connection.flow.attr[co.C2S][co.TIMESTAMP_RETRANS] = []
             connection.flow.attr[co.S2C][co.TIMESTAMP_RETRANS] = []
 
-            connection.flow.attr[co.C2S][co.TIME_FIN_ACK_TCP] = timedelta(0)
-            connection.flow.attr[co.S2C][co.TIME_FIN_ACK_TCP] = timedelta(0)
+            connection.flow.attr[co.C2S][co.TIME_FIN_ACK_TCP] = 0
+            connection.flow.attr[co.S2C][co.TIME_FIN_ACK_TCP] = 0
 
-            connection.flow.attr[co.C2S][co.TIME_LAST_ACK_TCP] = timedelta(0)
-            connection.flow.attr[co.S2C][co.TIME_LAST_ACK_TCP] = timedelta(0)
+            connection.flow.attr[co.C2S][co.TIME_LAST_ACK_TCP] = 0
+            connection.flow.attr[co.S2C][co.TIME_LAST_ACK_TCP] = 0
 
-            connection.flow.attr[co.C2S][co.TIME_LAST_PAYLD_TCP] = timedelta(0)
-            connection.flow.attr[co.S2C][co.TIME_LAST_PAYLD_TCP] = timedelta(0)
+            connection.flow.attr[co.C2S][co.TIME_LAST_PAYLD_TCP] = 0
+            connection.flow.attr[co.S2C][co.TIME_LAST_PAYLD_TCP] = 0
 
-            connection.flow.attr[co.C2S][co.TIME_LAST_PAYLD_WITH_RETRANS_TCP] = timedelta(0)
-            connection.flow.attr[co.S2C][co.TIME_LAST_PAYLD_WITH_RETRANS_TCP] = timedelta(0)
+            connection.flow.attr[co.C2S][co.TIME_LAST_PAYLD_WITH_RETRANS_TCP] = 0
+            connection.flow.attr[co.S2C][co.TIME_LAST_PAYLD_WITH_RETRANS_TCP] = 0
 
             connections[conn_id] = connection
 
@@ -285,11 +303,11 @@ def extract_tstat_data_tcp_nocomplete(filename, connections, conn_id):
     return connections, conn_id
 
 
-def extract_tstat_data(pcap_filepath):
-    """ Given the pcap filepath, return a dictionary of as many elements as there are tcp flows """
+def extract_tstat_data(stats_dir):
+    """ Given the directory of the statistics of tstat, return a dictionary of as many elements as there are tcp flows """
     connections = {}
     conn_id = 0
-    with co.cd(os.path.basename(pcap_filepath[:-5])):
+    with co.cd(stats_dir):
         with co.cd(os.listdir('.')[0]):
             # Complete TCP connections
             connections, conn_id = extract_tstat_data_tcp_complete('log_tcp_complete', connections, conn_id)
@@ -335,109 +353,32 @@ def get_flow_name(xpl_filepath):
 
 def process_tstat_cmd(cmd, pcap_filepath, keep_log=False, graph_dir_exp=None):
     """ Launch the command cmd given in argument, and return a dictionary containing information
-        about connections of the pcap file analyzed
+        about connections of the pcap file analyzed (read in the directory given to tstat with -s)
+        The output of tstat is directly written in the CSV directory of graph_dir_exp if keep_log, else discarded
         Raise a TstatError if tstat encounters problems
     """
-    pcap_flow_data_path = pcap_filepath[:-5] + '_tstat'
-    stdout_tstat = open(pcap_flow_data_path, 'w+')
-    if subprocess.call(cmd, stdout=stdout_tstat) != 0:
-        raise TstatError("Error of tcptrace with " + pcap_filepath)
-
-    connections = extract_tstat_data(pcap_filepath)
-
-    # Remove the directory of trace statistics
-    shutil.rmtree(os.path.basename(pcap_filepath[:-5]))
-
-    # Don't forget to close and remove pcap_flow_data
-    stdout_tstat.close()
+    stats_dir = cmd[cmd.index('-s') + 1]
+    stdout_tstat = None
     if keep_log:
         try:
-            shutil.move(pcap_flow_data_path, os.path.join(
-                graph_dir_exp, co.CSV_DIR, os.path.basename(pcap_flow_data_path)))
-
+            stdout_tstat = open(os.path.join(graph_dir_exp, co.CSV_DIR, os.path.basename(co.get_pcap_basepath(pcap_filepath)) + '_tstat'), 'w')
         except IOError as e:
             print(str(e), file=sys.stderr)
+    if stdout_tstat is None:
+        stdout_tstat = open(os.devnull, 'w')
+    try:
+        if subprocess.call(cmd, stdout=stdout_tstat) != 0:
+            raise TstatError("Error of tcptrace with " + pcap_filepath)
+    finally:
+        stdout_tstat.close()
 
-    else:
-        os.remove(pcap_flow_data_path)
-
-    return connections
-
-
-##################################################
-#                 RETRANSMISSION                 #
-##################################################
+    connections = extract_tstat_data(stats_dir)
 
-def get_ip_port_tshark(str_data):
-    """ Given the line of interest, return the ip and port
-        Manage cases with IPv6 addresses
-    """
-    separator = str_data.rindex(":")
-    ip = str_data[:separator]
-    port = str_data[separator + 1:]
-    return ip, port
+    # Remove the directory of trace statistics
+    shutil.rmtree(stats_dir)
 
+    return connections
 
-def get_total_and_retrans_frames(pcap_filepath, connections):
-    """ Fill information for connections based on tshark """
-    # First init values to avoid strange errors if connection is empty
-    for conn_id, conn in connections.iteritems():
-        for direction in co.DIRECTIONS:
-            connections[conn_id].flow.attr[direction][co.FRAMES_TOTAL] = 0
-            connections[conn_id].flow.attr[direction][co.BYTES_FRAMES_TOTAL] = 0
-            connections[conn_id].flow.attr[direction][co.FRAMES_RETRANS] = 0
-            connections[conn_id].flow.attr[direction][co.BYTES_FRAMES_RETRANS] = 0
-
-    stats_filename = os.path.basename(pcap_filepath)[:-5] + "_tshark_total"
-    stats_file = open(stats_filename, 'w')
-    co.tshark_stats(None, pcap_filepath, print_out=stats_file)
-    stats_file.close()
-
-    stats_file = open(stats_filename)
-    data = stats_file.readlines()
-    stats_file.close()
-    for line in data:
-        split_line = " ".join(line.split()).split(" ")
-        if len(split_line) == 11:
-            # Manage case with ipv6
-            ip_src, port_src = get_ip_port_tshark(split_line[0])
-            ip_dst, port_dst = get_ip_port_tshark(split_line[2])
-            for conn_id, conn in connections.iteritems():
-                if conn.flow.attr[co.SADDR] == ip_src and conn.flow.attr[co.SPORT] == port_src and \
-                        conn.flow.attr[co.DADDR] == ip_dst and conn.flow.attr[co.DPORT]:
-                    connections[conn_id].flow.attr[co.S2C][co.FRAMES_TOTAL] = int(split_line[3])
-                    connections[conn_id].flow.attr[co.S2C][co.BYTES_FRAMES_TOTAL] = int(split_line[4])
-                    connections[conn_id].flow.attr[co.C2S][co.FRAMES_TOTAL] = int(split_line[5])
-                    connections[conn_id].flow.attr[co.C2S][co.BYTES_FRAMES_TOTAL] = int(split_line[6])
-                    break
-
-    stats_file.close()
-    os.remove(stats_filename)
-
-    stats_filename = os.path.basename(pcap_filepath)[:-5] + "_tshark_retrans"
-    stats_file = open(stats_filename, 'w')
-    co.tshark_stats('tcp.analysis.retransmission', pcap_filepath, print_out=stats_file)
-    stats_file.close()
-
-    stats_file = open(stats_filename)
-    data = stats_file.readlines()
-    stats_file.close()
-    for line in data:
-        split_line = " ".join(line.split()).split(" ")
-        if len(split_line) == 11:
-            ip_src, port_src = get_ip_port_tshark(split_line[0])
-            ip_dst, port_dst = get_ip_port_tshark(split_line[2])
-            for conn_id, conn in connections.iteritems():
-                if conn.flow.attr[co.SADDR] == ip_src and conn.flow.attr[co.SPORT] == port_src and \
-                   conn.flow.attr[co.DADDR] == ip_dst and conn.flow.attr[co.DPORT]:
-                    connections[conn_id].flow.attr[co.S2C][co.FRAMES_RETRANS] = int(split_line[3])
-                    connections[conn_id].flow.attr[co.S2C][co.BYTES_FRAMES_RETRANS] = int(split_line[4])
-                    connections[conn_id].flow.attr[co.C2S][co.FRAMES_RETRANS] = int(split_line[5])
-                    connections[conn_id].flow.attr[co.C2S][co.BYTES_FRAMES_RETRANS] = int(split_line[6])
-                    break
-
-    stats_file.close()
-    os.remove(stats_filename)
 
 ##################################################
 #                   PROCESSING                   #
@@ -445,19 +386,20 @@ def get_total_and_retrans_frames(pcap_filepath, connections):
 
 
 def get_preprocessed_connections(connections):
-    """ Prepare a dictionary for fast association of a TCP connection with a MPTCP flow """
+    """ Prepare a dictionary for fast association of a TCP connection with a MPTCP flow
+        Keys are (saddr, daddr, sport, dport) with packed addresses and integer ports, as in the packets
+    """
     fast_dico = {}
 
     # Collect all potential subflows
     for conn_id, conn in connections.iteritems():
         if conn.attr.get(co.START, None):
             for flow_id, flow in conn.flows.iteritems():
-                if (flow.attr[co.SADDR], flow.attr[co.DADDR], flow.attr[co.SPORT], flow.attr[co.DPORT]) not in fast_dico:
-                    fast_dico[(flow.attr[co.SADDR], flow.attr[co.DADDR], flow.attr[co.SPORT], flow.attr[co.DPORT])] = []
+                key = (pack_ip_address(flow.attr[co.SADDR]), pack_ip_address(flow.attr[co.DADDR]), int(flow.attr[co.SPORT]), int(flow.attr[co.DPORT]))
+                if key not in fast_dico:
+                    fast_dico[key] = []
 
-                fast_dico[(flow.attr[co.SADDR], flow.attr[co.DADDR], flow.attr[co.SPORT], flow.attr[co.DPORT])] += [(conn.attr[co.START],
-                                                                                                                     float(conn.attr[co.DURATION]),
-                                                                                                                     conn_id, flow_id)]
+                fast_dico[key] += [(conn.attr[co.START], float(conn.attr[co.DURATION]), conn_id, flow_id)]
 
     # Sort them for faster processing
     for quadruplet in fast_dico.keys():
@@ -473,9 +415,8 @@ def get_flow_name_connection(connection, connections):
     """
     for conn_id, conn in connections.iteritems():
         # Let a little margin, but don't think it's needed
-        if conn.attr.get(co.START, None) and (abs((connection.flow.attr[co.START] - conn.attr[co.START]).total_seconds()) <= 8.0 and
-                                              connection.flow.attr[co.START].total_seconds() <=
-                                              conn.attr[co.START].total_seconds() + float(conn.attr[co.DURATION])):
+        if conn.attr.get(co.START, None) and (abs(connection.flow.attr[co.START] - conn.attr[co.START]) <= 8 * co.NS_PER_SEC and
+                                              connection.flow.attr[co.START] <= conn.attr[co.START] + float(conn.attr[co.DURATION]) * co.NS_PER_SEC):
             for flow_id, flow in conn.flows.iteritems():
                 if (connection.flow.attr[co.SADDR] == flow.attr[co.SADDR] and
                         connection.flow.attr[co.DADDR] == flow.attr[co.DADDR] and
@@ -494,9 +435,10 @@ def get_flow_name_connection_optimized(connection, connections, fast_conns=None)
     if not fast_conns:
         return get_flow_name_connection(connection, connections)
 
-    if (connection.flow.attr[co.SADDR], connection.flow.attr[co.DADDR], connection.flow.attr[co.SPORT], connection.flow.attr[co.DPORT]) in fast_conns:
-        potential_list = fast_conns[(connection.flow.attr[co.SADDR], connection.flow.attr[co.DADDR], connection.flow.attr[co.SPORT],
-                                    connection.flow.attr[co.DPORT])]
+    key = (pack_ip_address(connection.flow.attr[co.SADDR]), pack_ip_address(connection.flow.attr[co.DADDR]), int(connection.flow.attr[co.SPORT]),
+           int(connection.flow.attr[co.DPORT]))
+    if key in fast_conns:
+        potential_list = fast_conns[key]
 
         if len(potential_list) == 1:
             return potential_list[0][2], potential_list[0][3]
@@ -506,8 +448,8 @@ def get_flow_name_connection_optimized(connection, connections, fast_conns=None)
         match_indexes = []
         # Check with an error window of 8 seconds for both sides
         while (potential_match_index < len(potential_list)
-               and abs((potential_list[potential_match_index][0] - connection.flow.attr[co.START]).total_seconds()) <= 8.0):
-            if connection.flow.attr[co.START].total_seconds() <= potential_list[potential_match_index][0].total_seconds() + potential_list[potential_match_index][1]:
+               and abs(potential_list[potential_match_index][0] - connection.flow.attr[co.START]) <= 8 * co.NS_PER_SEC):
+            if connection.flow.attr[co.START] <= potential_list[potential_match_index][0] + potential_list[potential_match_index][1] * co.NS_PER_SEC:
                 match_indexes += [potential_match_index]
 
             potential_match_index += 1
@@ -524,13 +466,17 @@ def get_flow_name_connection_optimized(connection, connections, fast_conns=None)
     return None, None
 
 
-def copy_info_to_mptcp_connections(connections, mptcp_connections, failed_conns, acksize_all, acksize_all_mptcp, flow_name, fast_conns=None):
+def copy_info_to_mptcp_connections(connections, mptcp_connections, failed_conns, acksize_all, acksize_all_mptcp, flow_name, fast_conns=None, mptcp_ids=None):
     """ Given a tcp connection, copy its start and duration to the corresponding mptcp connection
         If connection is a failed subflow of a MPTCPConnection, add it in failed_conns
+        mptcp_ids are the connection and flow ids of the mptcp connection, if already known
         Return the corresponding connection and flow ids of the mptcp connection
     """
     connection = connections[flow_name]
-    conn_id, flow_id = get_flow_name_connection_optimized(connection, mptcp_connections, fast_conns=fast_conns)
+    if mptcp_ids:
+        conn_id, flow_id = mptcp_ids
+    else:
+        conn_id, flow_id = get_flow_name_connection_optimized(connection, mptcp_connections, fast_conns=fast_conns)
     if isinstance(conn_id, (int, long)):
         mptcp_connections[conn_id].flows[flow_id].subflow_id = flow_name
         mptcp_connections[conn_id].flows[flow_id].attr[co.TCP_COMPLETE] = connection.flow.attr[co.TCP_COMPLETE]
@@ -566,42 +512,57 @@ def copy_info_to_mptcp_connections(connections, mptcp_connections, failed_conns,
 
 
 def retransmissions_tcpcsm(pcap_filepath, connections):
-    cmd = ['tcpcsm', '-o', pcap_filepath[:-5] + '_tcpcsm', '-R', pcap_filepath]
+    """ Add to connections the retransmissions found by tcpcsm, whose output is parsed while it runs """
+    # Create a reversed dictionary to speed up the lookup
+    inverse_dict = create_inverse_tcp_dictionary(connections)
+    retransmissions = []
     try:
-        if subprocess.call(cmd) != 0:
-            return
+        with co.pcap_tool_path(pcap_filepath) as tool_pcap_path:
+            # The output file of tcpcsm is its standard output, a pipe
+            cmd = ['tcpcsm', '-o', '/dev/stdout', '-R', tool_pcap_path]
+            for line in co.iter_cmd_lines(cmd, Exception("Error of tcpcsm with " + pcap_filepath)):
+                split_line = line.split()
+                if len(split_line) > 7 and split_line[6] in ['RTO', 'FRETX', 'MS_FRETX', 'SACK_FRETX', 'BAD_FRETX', 'LOSS_REC', 'UNEXP_FREC', 'UNNEEDED']:
+                    key = (pack_ip_address(split_line[1]), int(split_line[0]), pack_ip_address(split_line[3]), int(split_line[2]))
+                    if len(inverse_dict.get(key, [])) == 1:
+                        direction = co.C2S if split_line[5] == '1' else co.S2C
+                        retransmissions.append((inverse_dict[key][0], direction, (split_line[7], split_line[6])))
 
     except Exception as e:
         print(str(e), file=sys.stderr)
         return
 
-    # Create a reversed dictionary to speed up the lookup
-    inverse_dict = create_inverse_tcp_dictionary(connections)
+    # Connections are only modified if tcpcsm succeeded
+    for conn_id, direction, retransmission in retransmissions:
+        if co.TCPCSM_RETRANS not in connections[conn_id].flow.attr[direction]:
+            connections[conn_id].flow.attr[direction][co.TCPCSM_RETRANS] = [retransmission]
+        else:
+            connections[conn_id].flow.attr[direction][co.TCPCSM_RETRANS] += [retransmission]
 
-    tcpcsm_file = open(pcap_filepath[:-5] + '_tcpcsm')
-    data = tcpcsm_file.readlines()
-    tcpcsm_file.close()
 
-    for line in data:
-        split_line = line.split()
-        if split_line[6] in ['RTO', 'FRETX', 'MS_FRETX', 'SACK_FRETX', 'BAD_FRETX', 'LOSS_REC', 'UNEXP_FREC', 'UNNEEDED']:
-            key = (split_line[1], split_line[0], split_line[3], split_line[2])
-            if len(inverse_dict.get(key, [])) == 1:
-                conn_id = inverse_dict[key][0]
-                direction = co.C2S if split_line[5] == '1' else co.S2C
-                if co.TCPCSM_RETRANS not in connections[conn_id].flow.attr[direction]:
-                    connections[conn_id].flow.attr[direction][co.TCPCSM_RETRANS] = [(split_line[7], split_line[6])]
-                else:
-                    connections[conn_id].flow.attr[direction][co.TCPCSM_RETRANS] += [(split_line[7], split_line[6])]
+def pack_ip_address(ip):
+    """ Return the packed form of ip, as found in packets, given its text form (IPv6 addresses can be in long format)
+        If ip cannot be parsed, it is returned as is (and will never match a packet)
+    """
+    try:
+        return socket.inet_pton(socket.AF_INET6 if ':' in ip else socket.AF_INET, ip)
+    except (socket.error, ValueError):
+        return ip
 
-    os.remove(pcap_filepath[:-5] + '_tcpcsm')
+
+def unpack_ip_address(packed_ip):
+    """ Return the text form of packed_ip, as found in packets (IPv4 on 4 bytes, IPv6 on 16) """
+    return socket.inet_ntop(socket.AF_INET6 if len(packed_ip) == 16 else socket.AF_INET, packed_ip)
 
 
 def create_inverse_tcp_dictionary(connections):
+    """ Return a dictionary with (saddr, sport, daddr, dport) as keys, with packed addresses and integer ports as in the packets,
+        and the list of the ids of the connections with this quadruplet as values
+    """
     inverse = {}
     for conn_id, conn in connections.iteritems():
         flow = conn.flow
-        key = (flow.attr[co.SADDR], flow.attr[co.SPORT], flow.attr[co.DADDR], flow.attr[co.DPORT])
+        key = (pack_ip_address(flow.attr[co.SADDR]), int(flow.attr[co.SPORT]), pack_ip_address(flow.attr[co.DADDR]), int(flow.attr[co.DPORT]))
         if key not in inverse:
             inverse[key] = [conn_id]
         else:
@@ -610,6 +571,128 @@ def create_inverse_tcp_dictionary(connections):
     return inverse
 
 
+class SeqWindow(object):
+
+    """ Sequence numbers of the payloads sent in one direction, each with a list starting with the timestamps of its first and last
+        transmissions (used to detect retransmissions)
+        Once the cumulative ACK has passed a sequence number (taking into account the wraparound), it is kept for ACKED_SEQ_TIMEOUT
+        and then dropped: memory depends on the data in flight, not on all the data sent on the connection
+        A payload sent again after that is still a retransmission, since it is behind the cumulative ACK (see is_behind_ack),
+        but its previous transmissions are not known anymore
+    """
+
+    def __init__(self):
+        self.seqs = {}
+        # Sequence numbers not acknowledged yet, in the order they were first sent
+        self.unacked = deque()
+        # (timestamp of the ACK, sequence number) of acknowledged sequence numbers still kept
+        self.acked = deque()
+        # Sequence numbers are compared on the narrowest width (as a modulo) of the ones added
+        self.modulo = 2**64
+
+    def __contains__(self, seq):
+        return seq in self.seqs
+
+    def __getitem__(self, seq):
+        return self.seqs[seq]
+
+    def __len__(self):
+        return len(self.seqs)
+
+    def add(self, seq, info, modulo=2**32):
+        """ Add seq (on modulo, 2**64 for a DSN on 8 bytes), sent for the first time, with info as [first timestamp, last timestamp,...] """
+        self.seqs[seq] = info
+        self.unacked.append(seq)
+        self.modulo = min(self.modulo, modulo)
+
+    def ack(self, ack, ts_delta, modulo=2**32):
+        """ Mark sequence numbers before ack (on modulo) as acknowledged at ts_delta and drop those acknowledged for too long
+            ack is compared on the narrowest of its width and the one of the sequence numbers (a Data ACK on 8 bytes can acknowledge
+            DSNs on 4 bytes, and conversely)
+        """
+        modulo = min(modulo, self.modulo)
+        while self.unacked and 0 < (ack - self.unacked[0]) % modulo < modulo // 2:
+            self.acked.append((ts_delta, self.unacked.popleft()))
+        while self.acked and ts_delta - self.acked[0][0] > ACKED_SEQ_TIMEOUT:
+            self.seqs.pop(self.acked.popleft()[1], None)
+
+
+class ConnectionExpiry(object):
+
+    """ Hashed timer wheel giving the keys (4-tuples) of connections without packets for timeout (in ns), or for CLOSED_CONN_TIMEOUT
+        once they sent a FIN or a RST, so that the packet passes can drop their state
+        A key is in one slot of the wheel at a time: when its slot is reached, it expires if it was not touched since, or it
+        is moved to the slot of its new deadline
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.deadlines = {}
+        # The slot where each key is
+        self.scheduled = {}
+        self.slots = {}
+        self.closed = set()
+        self.current_slot = None
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def touch(self, key, ts_delta, closing=False):
+        """ Postpone the expiry of key, that has a packet at ts_delta (closing if it is a FIN or a RST) """
+        if closing:
+            self.closed.add(key)
+        deadline = ts_delta + (CLOSED_CONN_TIMEOUT if key in self.closed else self.timeout)
+        self.deadlines[key] = deadline
+        slot = deadline // EXPIRY_TICK
+        # If the key is in a later slot (the deadline came closer), also put it in this one
+        if self.scheduled.get(key, slot + 1) > slot:
+            self.scheduled[key] = slot
+            self.slots.setdefault(slot, []).append(key)
+
+    def expire(self, ts_delta):
+        """ Return the list of keys whose deadline is passed at ts_delta, which are forgotten """
+        now_slot = ts_delta // EXPIRY_TICK
+        if self.current_slot is None:
+            self.current_slot = now_slot
+        if now_slot <= self.current_slot:
+            return []
+
+        if now_slot - self.current_slot > len(self.slots):
+            # Large gap in the trace
+            due_slots = sorted([slot for slot in self.slots if slot < now_slot])
+        else:
+            due_slots = [slot for slot in xrange(self.current_slot, now_slot) if slot in self.slots]
+        self.current_slot = now_slot
+
+        expired = []
+        for slot in due_slots:
+            for key in self.slots.pop(slot):
+                if self.scheduled.get(key) != slot:
+                    # Stale: the key was moved to another slot since
+                    continue
+                next_slot = self.deadlines[key] // EXPIRY_TICK
+                if next_slot < now_slot:
+                    del self.deadlines[key]
+                    del self.scheduled[key]
+                    self.closed.discard(key)
+                    expired.append(key)
+                else:
+                    self.scheduled[key] = next_slot
+                    self.slots.setdefault(next_slot, []).append(key)
+
+        return expired
+
+
+def touch_connection_state(expiry, packet, acks, black_list):
+    """ Postpone the expiry of the state (in acks or black_list) of the connection of packet, if any """
+    key = (packet.saddr, packet.sport, packet.daddr, packet.dport)
+    if key not in acks and key not in black_list:
+        key = (packet.daddr, packet.dport, packet.saddr, packet.sport)
+        if key not in acks:
+            return
+    expiry.touch(key, packet.ts_delta, closing=packet.fin_flag or packet.rst_flag)
+
+
 def increment_value_dict(dico, key):
     if key in dico:
         dico[key] += 1
@@ -617,60 +700,31 @@ def increment_value_dict(dico, key):
         dico[key] = 1
 
 
-def get_ts_delta(ts):
-    """ Get a timedelta object for the timestamp """
-    if isinstance(ts, tuple) and len(ts) == 2:
-        return timedelta(seconds=ts[0], microseconds=ts[1])
-    else:
-        # Kept for compatibility reasons
-        return timedelta(seconds=ts)
+def detect_backup_subflow(opts):
+    """ Return True if this subflow is established with the backup bit """
+    join = decode_mptcp_options(opts).get(MP_JOIN)
+    return join is not None and join[0]
 
 
-def get_ips_and_ports(eth, ip, tcp):
-    """ Given the Ethernet (and its conversion in IP) and TCP packet,
-        return the IPs and ports of source (client) and destination (server)
+def find_syn_connection(ts_delta, key, connections, inverse_conns, ts_syn_timeout):
+    """ Return the id of the connection with the 4-tuple key that started the closest to ts_delta (a first SYN), or False if none
+        started within ts_syn_timeout
     """
-    # For IP addresses, need to convert the packet IP address to the standard one
-    if type(eth.data) == dpkt.ip.IP:
-        daddr = socket.inet_ntop(socket.AF_INET, ip.dst)
-        saddr = socket.inet_ntop(socket.AF_INET, ip.src)
-    else:  # dpkt.ip6.IP6
-        daddr = socket.inet_ntop(socket.AF_INET6, ip.dst)
-        saddr = socket.inet_ntop(socket.AF_INET6, ip.src)
-
-    # Ports encoded as strings in connections, so let convert those integers
-    dport = str(tcp.dport)
-    sport = str(tcp.sport)
-
-    return saddr, daddr, sport, dport
-
-
-def detect_backup_subflow(tcp):
-    """ Return True if this subflow is established with the backup bit """
-    backup = False
-    opt_list = dpkt.tcp.parse_opts(tcp.opts)
-    for option_num, option_content in opt_list:
-        # Only interested in MPTCP with JOIN (len of 10 because join has len of 12 with 1 of option num and 1 of length)
-        if option_num == 30 and len(option_content):
-            # Join + backup bit
-            if ord(option_content[0]) == 17:
-                backup = True
+    conn_id = False
+    min_delta = ts_syn_timeout
+    for cid in inverse_conns.get(key, []):
+        if abs(ts_delta - connections[cid].flow.attr[co.START]) < min_delta:
+            conn_id = cid
+            min_delta = abs(ts_delta - connections[cid].flow.attr[co.START])
 
-    return backup
+    return conn_id
 
 
-def process_first_syn(ts_delta, acks, nb_acks, connections, tcp, ip, saddr, daddr, sport, dport, black_list, inverse_conns, ts_syn_timeout, ts_timeout):
+def process_first_syn(ts_delta, acks, nb_acks, connections, packet, saddr, daddr, sport, dport, black_list, inverse_conns, ts_syn_timeout, ts_timeout):
     """ Processing of the first SYNs seen on a connection """
     # The sender of the first SYN is the client
     # Check if the connection is black listed or not
-    conn_id = False
-    conn_candidates = inverse_conns.get((saddr, sport, daddr, dport), [])
-    min_delta = ts_syn_timeout
-    for cid in conn_candidates:
-        if abs((ts_delta - connections[cid].flow.attr[co.START]).total_seconds()) < min_delta:
-            conn_id = cid
-            min_delta = abs((ts_delta - connections[cid].flow.attr[co.START]).total_seconds())
-
+    conn_id = find_syn_connection(ts_delta, (saddr, sport, daddr, dport), connections, inverse_conns, ts_syn_timeout)
     if not conn_id:
         black_list.add((saddr, sport, daddr, dport))
         return
@@ -681,46 +735,51 @@ def process_first_syn(ts_delta, acks, nb_acks, connections, tcp, ip, saddr, dadd
         for direction in co.DIRECTIONS:
             nb_acks[direction][conn_id] = {}
 
-    backup = detect_backup_subflow(tcp)
+    backup = detect_backup_subflow(packet.opts)
 
-    if ((saddr, sport, daddr, dport) in acks and (ts_delta - acks[saddr, sport, daddr, dport][co.TIMESTAMP][CLIENT]).total_seconds() <= ts_syn_timeout
-            and acks[saddr, sport, daddr, dport][co.S2C] == -1 and tcp.seq in acks[saddr, sport, daddr, dport][SEQ_C2S]):
+    if ((saddr, sport, daddr, dport) in acks and ts_delta - acks[saddr, sport, daddr, dport][co.TIMESTAMP][CLIENT] <= ts_syn_timeout
+            and acks[saddr, sport, daddr, dport][co.S2C] == -1 and packet.seq in acks[saddr, sport, daddr, dport][HSEQ_C2S]):
         # SYN retransmission!
         connections[conn_id].flow.attr[co.C2S][co.TIMESTAMP_RETRANS].append((ts_delta,
-                                                                             ts_delta - acks[saddr, sport, daddr, dport][HSEQ_C2S][tcp.seq][0],
-                                                                             ts_delta - acks[saddr, sport, daddr, dport][HSEQ_C2S][tcp.seq][1],
+                                                                             ts_delta - acks[saddr, sport, daddr, dport][HSEQ_C2S][packet.seq][0],
+                                                                             ts_delta - acks[saddr, sport, daddr, dport][HSEQ_C2S][packet.seq][1],
                                                                              ts_delta - acks[saddr, sport, daddr, dport][co.TIMESTAMP][CLIENT]))
-        acks[saddr, sport, daddr, dport][HSEQ_C2S][tcp.seq][1] = ts_delta
+        acks[saddr, sport, daddr, dport][HSEQ_C2S][packet.seq][1] = ts_delta
     else:
         acks[saddr, sport, daddr, dport] = {co.C2S: -1, co.S2C: -1, co.TIMESTAMP: {CLIENT: ts_delta, SERVER: None}, co.CONN_ID: conn_id,
-                                            SEQ_C2S: set([tcp.seq]), SEQ_S2C: set([]), HSEQ_C2S: {tcp.seq: [ts_delta, ts_delta]}, HSEQ_S2C: {}}
+                                            HSEQ_C2S: SeqWindow(), HSEQ_S2C: SeqWindow()}
+        acks[saddr, sport, daddr, dport][HSEQ_C2S].add(packet.seq, [ts_delta, ts_delta])
         connections[conn_id].attr[co.BACKUP] = backup
 
 
-def process_syn_ack(ts_delta, acks, nb_acks, connections, tcp, ip, saddr, daddr, sport, dport, black_list, inverse_conns, ts_syn_timeout, ts_timeout):
+def process_syn_ack(ts_delta, acks, nb_acks, connections, packet, saddr, daddr, sport, dport, black_list, inverse_conns, ts_syn_timeout, ts_timeout):
     """ Processing of SYN/ACKs seen on the connection """
     # The sender of the SYN/ACK is the server
-    if (daddr, dport, saddr, sport) in acks and ((ts_delta - acks[daddr, dport, saddr, sport][co.TIMESTAMP][CLIENT]).total_seconds() < ts_timeout
+    if (daddr, dport, saddr, sport) in acks and (ts_delta - acks[daddr, dport, saddr, sport][co.TIMESTAMP][CLIENT] < ts_timeout
                                                  and acks[daddr, dport, saddr, sport][co.C2S] == -1):
         # Better to check, if not seen, maybe uncomplete TCP connection
-        acks[daddr, dport, saddr, sport][co.C2S] = tcp.ack
-        acks[daddr, dport, saddr, sport][SEQ_S2C].add(tcp.seq)
-        acks[daddr, dport, saddr, sport][HSEQ_S2C][tcp.seq] = [ts_delta, ts_delta]
+        acks[daddr, dport, saddr, sport][co.C2S] = packet.ack
+        acks[daddr, dport, saddr, sport][HSEQ_S2C].add(packet.seq, [ts_delta, ts_delta])
         acks[daddr, dport, saddr, sport][co.TIMESTAMP][SERVER] = ts_delta
 
-    elif (daddr, dport, saddr, sport) in acks and ((ts_delta - acks[daddr, dport, saddr, sport][co.TIMESTAMP][CLIENT]).total_seconds() < ts_timeout
-                                                   and tcp.seq in acks[daddr, dport, saddr, sport][SEQ_S2C]):
+    elif (daddr, dport, saddr, sport) in acks and (ts_delta - acks[daddr, dport, saddr, sport][co.TIMESTAMP][CLIENT] < ts_timeout
+                                                   and packet.seq in acks[daddr, dport, saddr, sport][HSEQ_S2C]):
         # SYN/ACK retransmission!
         conn_id = acks[daddr, dport, saddr, sport][co.CONN_ID]
         connections[conn_id].flow.attr[co.S2C][co.TIMESTAMP_RETRANS].append((ts_delta,
-                                                                             ts_delta - acks[daddr, dport, saddr, sport][HSEQ_S2C][tcp.seq][0],
-                                                                             ts_delta - acks[daddr, dport, saddr, sport][HSEQ_S2C][tcp.seq][1],
+                                                                             ts_delta - acks[daddr, dport, saddr, sport][HSEQ_S2C][packet.seq][0],
+                                                                             ts_delta - acks[daddr, dport, saddr, sport][HSEQ_S2C][packet.seq][1],
                                                                              ts_delta - acks[daddr, dport, saddr, sport][co.TIMESTAMP][CLIENT]))
-        acks[daddr, dport, saddr, sport][HSEQ_S2C][tcp.seq][1] = ts_delta
+        acks[daddr, dport, saddr, sport][HSEQ_S2C][packet.seq][1] = ts_delta
         acks[daddr, dport, saddr, sport][co.TIMESTAMP][SERVER] = ts_delta
 
 
-def process_pkt_from_client(ts_delta, acks, nb_acks, connections, tcp, ip, saddr, daddr, sport, dport, fin_flag):
+def is_behind_ack(seq, ack):
+    """ Return True if seq was already acknowledged by the cumulative ACK ack (-1 if none), taking into account the seq overflow """
+    return ack >= 0 and 0 < (ack - seq) % 4294967296 < 2147483648
+
+
+def process_pkt_from_client(ts_delta, acks, nb_acks, connections, packet, saddr, daddr, sport, dport, fin_flag):
     """ Process a packet with ACK set from the client """
     if acks[saddr, sport, daddr, dport][co.S2C] >= 0:
         conn_id = acks[saddr, sport, daddr, dport][co.CONN_ID]
@@ -728,17 +787,17 @@ def process_pkt_from_client(ts_delta, acks, nb_acks, connections, tcp, ip, saddr
         if fin_flag:
             connections[conn_id].flow.attr[co.S2C][co.TIME_FIN_ACK_TCP] = ts_delta
 
-        bytes_acked = (tcp.ack - acks[saddr, sport, daddr, dport][co.S2C]) % 4294967296
+        bytes_acked = (packet.ack - acks[saddr, sport, daddr, dport][co.S2C]) % 4294967296
         if bytes_acked >= 2000000000:
             # Ack of 2GB or more is just not possible here
             return
 
         increment_value_dict(nb_acks[co.S2C][conn_id], bytes_acked)
-        size_payload = ip.len - ip.hl * 4 - tcp.off * 4
+        size_payload = packet.payload_len
 
         # If SOCKS command
         if size_payload == 7 and connections[conn_id].attr.get(co.SOCKS_PORT, None) is None:
-            crypted_socks_cmd = tcp.data
+            crypted_socks_cmd = packet.data
             # This is possible because of packet stripping
             if len(crypted_socks_cmd) == 7:
                 decrypted_socks_cmd = socks_parser.decode(crypted_socks_cmd)
@@ -746,29 +805,28 @@ def process_pkt_from_client(ts_delta, acks, nb_acks, connections, tcp, ip, saddr
                     connections[conn_id].attr[co.SOCKS_DADDR] = socks_parser.get_ip_address(decrypted_socks_cmd)
                     connections[conn_id].attr[co.SOCKS_PORT] = socks_parser.get_port_number(decrypted_socks_cmd)
 
-        if size_payload > 0 and tcp.seq in acks[saddr, sport, daddr, dport][SEQ_C2S]:
+        if size_payload > 0 and packet.seq in acks[saddr, sport, daddr, dport][HSEQ_C2S]:
             # This is a retransmission! (take into account the seq overflow)
             connections[conn_id].flow.attr[co.C2S][co.TIME_LAST_PAYLD_WITH_RETRANS_TCP] = ts_delta
             connections[conn_id].flow.attr[co.C2S][co.TIMESTAMP_RETRANS].append((ts_delta,
-                                                                                 ts_delta - acks[saddr, sport, daddr, dport][HSEQ_C2S][tcp.seq][0],
-                                                                                 ts_delta - acks[saddr, sport, daddr, dport][HSEQ_C2S][tcp.seq][1],
+                                                                                 ts_delta - acks[saddr, sport, daddr, dport][HSEQ_C2S][packet.seq][0],
+                                                                                 ts_delta - acks[saddr, sport, daddr, dport][HSEQ_C2S][packet.seq][1],
                                                                                  ts_delta - acks[saddr, sport, daddr, dport][co.TIMESTAMP][CLIENT]))
-            acks[saddr, sport, daddr, dport][HSEQ_C2S][tcp.seq][1] = ts_delta
+            acks[saddr, sport, daddr, dport][HSEQ_C2S][packet.seq][1] = ts_delta
+        elif size_payload > 0 and is_behind_ack(packet.seq, acks[saddr, sport, daddr, dport][co.C2S]):
+            # Retransmission of data acknowledged for too long to be still in the SeqWindow
+            connections[conn_id].flow.attr[co.C2S][co.TIME_LAST_PAYLD_WITH_RETRANS_TCP] = ts_delta
         elif size_payload > 0:
-            acks[saddr, sport, daddr, dport][SEQ_C2S].add(tcp.seq)
             connections[conn_id].flow.attr[co.C2S][co.TIME_LAST_PAYLD_WITH_RETRANS_TCP] = ts_delta
             connections[conn_id].flow.attr[co.C2S][co.TIME_LAST_PAYLD_TCP] = ts_delta
-            acks[saddr, sport, daddr, dport][HSEQ_C2S][tcp.seq] = [ts_delta, ts_delta]
-            # Don't think will face this issue
-#                                 if len(acks[saddr, sport, daddr, dport][SEQ][co.C2S]) >= 3000000:
-#                                     for x in range(50000):
-#                                         acks[saddr, sport, daddr, dport][SEQ][co.C2S].popleft()
+            acks[saddr, sport, daddr, dport][HSEQ_C2S].add(packet.seq, [ts_delta, ts_delta])
 
-    acks[saddr, sport, daddr, dport][co.S2C] = tcp.ack
+    acks[saddr, sport, daddr, dport][co.S2C] = packet.ack
+    acks[saddr, sport, daddr, dport][HSEQ_S2C].ack(packet.ack, ts_delta)
     acks[saddr, sport, daddr, dport][co.TIMESTAMP][CLIENT] = ts_delta
 
 
-def process_pkt_from_server(ts_delta, acks, nb_acks, connections, tcp, ip, saddr, daddr, sport, dport, fin_flag):
+def process_pkt_from_server(ts_delta, acks, nb_acks, connections, packet, saddr, daddr, sport, dport, fin_flag):
     """ Process a packet with ACK set from the server """
     if acks[daddr, dport, saddr, sport][co.C2S] >= 0:
         conn_id = acks[daddr, dport, saddr, sport][co.CONN_ID]
@@ -776,147 +834,105 @@ def process_pkt_from_server(ts_delta, acks, nb_acks, connections, tcp, ip, saddr
         if fin_flag:
             connections[conn_id].flow.attr[co.C2S][co.TIME_FIN_ACK_TCP] = ts_delta
 
-        bytes_acked = (tcp.ack - acks[daddr, dport, saddr, sport][co.C2S]) % 4294967296
+        bytes_acked = (packet.ack - acks[daddr, dport, saddr, sport][co.C2S]) % 4294967296
         if bytes_acked >= 2000000000:
             # Ack of 2GB or more is just not possible here
             return
 
         increment_value_dict(nb_acks[co.C2S][conn_id], bytes_acked)
-        size_payload = ip.len - ip.hl * 4 - tcp.off * 4
+        size_payload = packet.payload_len
 
-        if size_payload > 0 and tcp.seq in acks[daddr, dport, saddr, sport][SEQ_S2C]:
+        if size_payload > 0 and packet.seq in acks[daddr, dport, saddr, sport][HSEQ_S2C]:
             # This is a retransmission!
             connections[conn_id].flow.attr[co.S2C][co.TIME_LAST_PAYLD_WITH_RETRANS_TCP] = ts_delta
             connections[conn_id].flow.attr[co.S2C][co.TIMESTAMP_RETRANS].append((ts_delta,
-                                                                                 ts_delta - acks[daddr, dport, saddr, sport][HSEQ_S2C][tcp.seq][0],
-                                                                                 ts_delta - acks[daddr, dport, saddr, sport][HSEQ_S2C][tcp.seq][1],
+                                                                                 ts_delta - acks[daddr, dport, saddr, sport][HSEQ_S2C][packet.seq][0],
+                                                                                 ts_delta - acks[daddr, dport, saddr, sport][HSEQ_S2C][packet.seq][1],
                                                                                  ts_delta - acks[daddr, dport, saddr, sport][co.TIMESTAMP][SERVER]))
-            acks[daddr, dport, saddr, sport][HSEQ_S2C][tcp.seq][1] = ts_delta
+            acks[daddr, dport, saddr, sport][HSEQ_S2C][packet.seq][1] = ts_delta
+        elif size_payload > 0 and is_behind_ack(packet.seq, acks[daddr, dport, saddr, sport][co.S2C]):
+            # Retransmission of data acknowledged for too long to be still in the SeqWindow
+            connections[conn_id].flow.attr[co.S2C][co.TIME_LAST_PAYLD_WITH_RETRANS_TCP] = ts_delta
         elif size_payload > 0:
-            acks[daddr, dport, saddr, sport][SEQ_S2C].add(tcp.seq)
             connections[conn_id].flow.attr[co.S2C][co.TIME_LAST_PAYLD_WITH_RETRANS_TCP] = ts_delta
             connections[conn_id].flow.attr[co.S2C][co.TIME_LAST_PAYLD_TCP] = ts_delta
-            acks[daddr, dport, saddr, sport][HSEQ_S2C][tcp.seq] = [ts_delta, ts_delta]
-            # Don't think will face this issue
-#                                 if len(acks[daddr, dport, saddr, sport][SEQ][co.S2C]) >= 3000000:
-#                                     for x in range(50000):
-#                                         acks[daddr, dport, saddr, sport][SEQ][co.S2C].popleft()
+            acks[daddr, dport, saddr, sport][HSEQ_S2C].add(packet.seq, [ts_delta, ts_delta])
 
-    acks[daddr, dport, saddr, sport][co.C2S] = tcp.ack
+    acks[daddr, dport, saddr, sport][co.C2S] = packet.ack
+    acks[daddr, dport, saddr, sport][HSEQ_C2S].ack(packet.ack, ts_delta)
     acks[daddr, dport, saddr, sport][co.TIMESTAMP][SERVER] = ts_delta
 
 
-def compute_tcp_acks_retrans(pcap_filepath, connections, inverse_conns, ts_syn_timeout=6.0, ts_timeout=3600.0):
-    """ Process a tcp pcap file and returns a dictionary of the number of cases an acknowledgement of x bytes is received
-        It also compute the timestamps of retransmissions and put them in the connection
-        It computes the timestamp of the last ACK, FIN and payload sent in both directions
-    """
-    print("Computing TCP ack sizes for", pcap_filepath)
-    nb_acks = {co.C2S: {}, co.S2C: {}}
-    acks = {}
-    # Avoid processing packets that do not belong to any analyzed TCP connection
-    black_list = set()
-    pcap_file = open(pcap_filepath)
-    pcap = dpkt.pcap.Reader(pcap_file)
-    count = 0
-    try:
-        for ts, buf in pcap:
-            ts_delta = get_ts_delta(ts)
-            count += 1
-            if count % 100000 == 0:
-                print(count)
-            # Check if linux cooked capture
-            if pcap.datalink() == dpkt.pcap.DLT_LINUX_SLL:
-                eth = dpkt.sll.SLL(buf)
-            else:
-                eth = dpkt.ethernet.Ethernet(buf)
-            if type(eth.data) == dpkt.ip.IP or type(eth.data) == dpkt.ip6.IP6:
-                ip = eth.data
-                if type(ip.data) == dpkt.tcp.TCP:
-                    tcp = ip.data
-                    fin_flag = (tcp.flags & dpkt.tcp.TH_FIN) != 0
-                    syn_flag = (tcp.flags & dpkt.tcp.TH_SYN) != 0
-                    rst_flag = (tcp.flags & dpkt.tcp.TH_RST) != 0
-                    ack_flag = (tcp.flags & dpkt.tcp.TH_ACK) != 0
-
-                    saddr, daddr, sport, dport = get_ips_and_ports(eth, ip, tcp)
-                    if syn_flag and not ack_flag and not fin_flag and not rst_flag:
-                        process_first_syn(ts_delta, acks, nb_acks, connections, tcp, ip, saddr, daddr, sport, dport, black_list, inverse_conns,
-                                          ts_syn_timeout, ts_timeout)
-
-                    elif (saddr, sport, daddr, dport) in black_list:
-                        continue
-
-                    elif syn_flag and ack_flag and not fin_flag and not rst_flag:
-                        process_syn_ack(ts_delta, acks, nb_acks, connections, tcp, saddr, ip, daddr, sport, dport, black_list, inverse_conns,
-                                        ts_syn_timeout, ts_timeout)
-
-                    elif not syn_flag and not rst_flag and ack_flag:
-                        if (saddr, sport, daddr, dport) in acks:
-                            process_pkt_from_client(ts_delta, acks, nb_acks, connections, tcp, ip, saddr, daddr, sport, dport, fin_flag)
-
-                        elif (daddr, dport, saddr, sport) in acks:
-                            process_pkt_from_server(ts_delta, acks, nb_acks, connections, tcp, ip, saddr, daddr, sport, dport, fin_flag)
-                        else:
-                            # Silently ignore those packets
-                            # print(saddr, sport, daddr, dport, "haven't seen beginning...")
-                            continue
-
-    except dpkt.NeedData as e:
-        print(e, ": trying to continue...", file=sys.stderr)
-    finally:
-        pcap_file.close()
-
-    return nb_acks
+class TCPAcksRetransAnalyzer(object):
 
+    """ Analyzer computing the number of cases an acknowledgement of x bytes is received (in nb_acks)
+        It also computes the timestamps of retransmissions and put them in the connection, detects SOCKS
+        commands and backup subflows, and computes the timestamp of the last ACK, FIN and payload sent in both directions
+        Results are put in connections as packets are processed, so the state of connections is dropped when they expire
+    """
 
-def get_dss_and_data_ack(tcp):
-    """ Return the DSS and Data ACK of the current packet or False if there is no DSS """
-    dss, dack, dss_is_8_bytes = False, False, False
-    opt_list = dpkt.tcp.parse_opts(tcp.opts)
-    for option_num, option_content in opt_list:
-        # Only interested in MPTCP with subtype 2
-        if option_num == 30 and len(option_content):
-            if ord(option_content[0]) == 32:
-                flags = ord(option_content[1])
-                dss_is_8_bytes = (flags & 0x08) != 0
-                dss_is_present = (flags & 0x04) != 0
-                dack_is_8_bytes = (flags & 0x02) != 0
-                dack_is_present = (flags & 0x01) != 0
-                if dack_is_present and not dss_is_present:
-                    range_max = 8 if dack_is_8_bytes else 4
-                    dack = 0
-                    for i in range(range_max):
-                        dack = dack * 256 + ord(option_content[2 + i])
-
-                elif dss_is_present and dack_is_present:
-                    range_max_dack = 8 if dack_is_8_bytes else 4
-                    dack = 0
-                    for i in range(range_max_dack):
-                        dack = dack * 256 + ord(option_content[2 + i])
-
-                    start_dss = 2 + range_max_dack
-                    range_max_dss = 8 if dss_is_8_bytes else 4
-                    dss = 0
-                    for i in range(range_max_dss):
-                        dss = dss * 256 + ord(option_content[start_dss + i])
-
-                elif dss_is_present and not dack_is_present:
-                    global dss_not_ack_warning
-                    if not dss_not_ack_warning:
-                        print("Case where dss_is_present and dack is not present (not compliant with Linux implementation): continue", file=sys.stderr)
-                        dss_not_ack_warning = True
-
-                    start_dss = 2
-                    range_max_dss = 8 if dss_is_8_bytes else 4
-                    dss = 0
-                    for i in range(range_max_dss):
-                        dss = dss * 256 + ord(option_content[start_dss + i])
-
-    return dss, dack, dss_is_8_bytes
-
-
-def process_mptcp_first_syn(ts_delta, acks, conn_acks, mptcp_connections, tcp, ip, saddr, daddr, sport, dport, black_list, fast_conns, ts_syn_timeout, ts_timeout):
+    def __init__(self, connections, inverse_conns, ts_syn_timeout=6.0, ts_timeout=3600.0):
+        self.connections = connections
+        self.inverse_conns = inverse_conns
+        # Timeouts are given in seconds, but compared with timestamps in nanoseconds
+        self.ts_syn_timeout = int(ts_syn_timeout * co.NS_PER_SEC)
+        self.ts_timeout = int(ts_timeout * co.NS_PER_SEC)
+        self.nb_acks = {co.C2S: {}, co.S2C: {}}
+        self.acks = {}
+        # Avoid processing packets that do not belong to any analyzed TCP connection
+        self.black_list = set()
+        self.expiry = ConnectionExpiry(self.ts_timeout)
+
+    def expire(self, ts_delta):
+        """ Drop the state of the connections expired at ts_delta """
+        for key in self.expiry.expire(ts_delta):
+            self.acks.pop(key, None)
+            self.black_list.discard(key)
+
+    def process_packet(self, packet):
+        self.expire(packet.ts_delta)
+
+        saddr, daddr, sport, dport = packet.saddr, packet.daddr, packet.sport, packet.dport
+        if packet.syn_flag and not packet.ack_flag and not packet.fin_flag and not packet.rst_flag:
+            process_first_syn(packet.ts_delta, self.acks, self.nb_acks, self.connections, packet, saddr, daddr, sport, dport,
+                              self.black_list, self.inverse_conns, self.ts_syn_timeout, self.ts_timeout)
+
+        elif (saddr, sport, daddr, dport) in self.black_list:
+            pass
+
+        elif packet.syn_flag and packet.ack_flag and not packet.fin_flag and not packet.rst_flag:
+            process_syn_ack(packet.ts_delta, self.acks, self.nb_acks, self.connections, packet, saddr, daddr, sport, dport,
+                            self.black_list, self.inverse_conns, self.ts_syn_timeout, self.ts_timeout)
+
+        elif not packet.syn_flag and not packet.rst_flag and packet.ack_flag:
+            if (saddr, sport, daddr, dport) in self.acks:
+                process_pkt_from_client(packet.ts_delta, self.acks, self.nb_acks, self.connections, packet, saddr, daddr, sport, dport,
+                                        packet.fin_flag)
+
+            elif (daddr, dport, saddr, sport) in self.acks:
+                process_pkt_from_server(packet.ts_delta, self.acks, self.nb_acks, self.connections, packet, saddr, daddr, sport, dport,
+                                        packet.fin_flag)
+            # Else silently ignore those packets (beginning not seen)
+
+        touch_connection_state(self.expiry, packet, self.acks, self.black_list)
+
+
+def get_dss_and_data_ack(opts):
+    """ Return the DSS and Data ACK of the current packet (or False if there is no DSS) and if each of them is on 8 bytes """
+    dss_fields = decode_mptcp_options(opts).get(DSS)
+    if dss_fields is None:
+        return False, False, False, False
+    dack, dss, _, _, _, dss_is_8_bytes, dack_is_8_bytes, _ = dss_fields
+    if dss is not None and dack is None:
+        global dss_not_ack_warning
+        if not dss_not_ack_warning:
+            print("Case where dss_is_present and dack is not present (not compliant with Linux implementation): continue", file=sys.stderr)
+            dss_not_ack_warning = True
+
+    return (False if dss is None else dss), (False if dack is None else dack), dss_is_8_bytes, dack_is_8_bytes
+
+
+def process_mptcp_first_syn(ts_delta, acks, conn_acks, mptcp_connections, packet, saddr, daddr, sport, dport, black_list, fast_conns, ts_syn_timeout, ts_timeout):
     """ Processing of the first SYNs seen on a connection for the MPTCP DSS retransmissions """
     # The sender of the first SYN is the client
     # Check if the connection is black listed or not
@@ -925,10 +941,10 @@ def process_mptcp_first_syn(ts_delta, acks, conn_acks, mptcp_connections, tcp, i
     min_delta = ts_syn_timeout
     for start, duration, cid, fid in conn_candidates:
         if (co.START in mptcp_connections[cid].flows[fid].attr
-                and abs((ts_delta - mptcp_connections[cid].flows[fid].attr[co.START]).total_seconds()) < min_delta):
+                and abs(ts_delta - mptcp_connections[cid].flows[fid].attr[co.START]) < min_delta):
             conn_id = cid
             flow_id = fid
-            min_delta = abs((ts_delta - mptcp_connections[cid].flows[fid].attr[co.START]).total_seconds())
+            min_delta = abs(ts_delta - mptcp_connections[cid].flows[fid].attr[co.START])
 
     if not conn_id:
         black_list.add((saddr, sport, daddr, dport))
@@ -936,7 +952,7 @@ def process_mptcp_first_syn(ts_delta, acks, conn_acks, mptcp_connections, tcp, i
     elif conn_id and (saddr, sport, daddr, dport) in black_list:
         black_list.remove((saddr, sport, daddr, dport))
 
-    if ((saddr, sport, daddr, dport) in acks and (ts_delta - acks[saddr, sport, daddr, dport][co.TIMESTAMP][CLIENT]).total_seconds() <= ts_syn_timeout
+    if ((saddr, sport, daddr, dport) in acks and ts_delta - acks[saddr, sport, daddr, dport][co.TIMESTAMP][CLIENT] <= ts_syn_timeout
             and acks[saddr, sport, daddr, dport][co.S2C] == -1) and conn_id in conn_acks:
         # SYN retransmission! But do nothing particular
         acks[saddr, sport, daddr, dport][co.TIMESTAMP][CLIENT] = ts_delta
@@ -944,152 +960,1170 @@ def process_mptcp_first_syn(ts_delta, acks, conn_acks, mptcp_connections, tcp, i
     else:
         acks[saddr, sport, daddr, dport] = {co.C2S: -1, co.S2C: -1, co.TIMESTAMP: {CLIENT: ts_delta, SERVER: None}, co.CONN_ID: conn_id,
                                             co.FLOW_ID: flow_id}
-        conn_acks[conn_id] = {co.C2S: -1, co.S2C: -1, co.TIMESTAMP: {CLIENT: ts_delta, SERVER: None}, SEQ_C2S: set(), SEQ_S2C: set(), HSEQ_C2S: {},
-                              HSEQ_S2C: {}}
+        conn_acks[conn_id] = {co.C2S: -1, co.S2C: -1, co.TIMESTAMP: {CLIENT: ts_delta, SERVER: None}, HSEQ_C2S: SeqWindow(),
+                              HSEQ_S2C: SeqWindow()}
 
 
-def process_mptcp_syn_ack(ts_delta, acks, conn_acks, mptcp_connections, tcp, ip, saddr, daddr, sport, dport, black_list, fast_conns, ts_syn_timeout, ts_timeout):
+def process_mptcp_syn_ack(ts_delta, acks, conn_acks, mptcp_connections, packet, saddr, daddr, sport, dport, black_list, fast_conns, ts_syn_timeout, ts_timeout):
     """ Processing of SYN/ACKs seen on the connection for the MPTCP DSS retransmissions """
     # The sender of the SYN/ACK is the server
-    if (daddr, dport, saddr, sport) in acks and ((ts_delta - acks[daddr, dport, saddr, sport][co.TIMESTAMP][CLIENT]).total_seconds() < ts_timeout
+    if (daddr, dport, saddr, sport) in acks and (ts_delta - acks[daddr, dport, saddr, sport][co.TIMESTAMP][CLIENT] < ts_timeout
                                                  and acks[daddr, dport, saddr, sport][co.C2S] == -1):
         # Better to check, if not seen, maybe uncomplete TCP connection
-        acks[daddr, dport, saddr, sport][co.C2S] = tcp.ack
+        acks[daddr, dport, saddr, sport][co.C2S] = packet.ack
         acks[daddr, dport, saddr, sport][co.TIMESTAMP][SERVER] = ts_delta
         conn_acks[acks[daddr, dport, saddr, sport][co.CONN_ID]][co.TIMESTAMP][SERVER] = ts_delta
 
-    elif (daddr, dport, saddr, sport) in acks and ((ts_delta - acks[daddr, dport, saddr, sport][co.TIMESTAMP][CLIENT]).total_seconds() < ts_timeout
-                                                   and tcp.ack == acks[daddr, dport, saddr, sport][co.C2S]):
+    elif (daddr, dport, saddr, sport) in acks and (ts_delta - acks[daddr, dport, saddr, sport][co.TIMESTAMP][CLIENT] < ts_timeout
+                                                   and packet.ack == acks[daddr, dport, saddr, sport][co.C2S]):
         # SYN/ACK retransmission! But don't do anything special
         acks[daddr, dport, saddr, sport][co.TIMESTAMP][SERVER] = ts_delta
         conn_acks[acks[daddr, dport, saddr, sport][co.CONN_ID]][co.TIMESTAMP][SERVER] = ts_delta
 
 
-def process_mptcp_pkt_from_client(ts_delta, acks, conn_acks, mptcp_connections, tcp, ip, saddr, daddr, sport, dport):
-    """ Process a packet with ACK set from the client for the MPTCP DSS retransmissions """
-    dss, dack, dss_is_8_bytes = get_dss_and_data_ack(tcp)
+def process_mptcp_pkt_from_client(ts_delta, acks, conn_acks, retrans_dss, packet, saddr, daddr, sport, dport):
+    """ Process a packet with ACK set from the client for the MPTCP DSS retransmissions
+        Potential DSS retransmissions are added in retrans_dss as (conn_id, direction, retransmission)
+    """
+    dss, dack, dss_is_8_bytes, dack_is_8_bytes = get_dss_and_data_ack(packet.opts)
     conn_id = acks[saddr, sport, daddr, dport][co.CONN_ID]
     flow_id = acks[saddr, sport, daddr, dport][co.FLOW_ID]
+    max_val = 2**64 if dss_is_8_bytes else 2**32
+    max_ack_val = 2**64 if dack_is_8_bytes else 2**32
     if conn_acks[conn_id][co.S2C] >= 0:
-        max_val = 2**64 if dss_is_8_bytes else 2**32
-        bytes_acked = (dack - conn_acks[conn_id][co.S2C]) % max_val
+        bytes_acked = (dack - conn_acks[conn_id][co.S2C]) % max_ack_val
         if bytes_acked >= 2000000000:
             # Ack of 2GB or more is just not possible here
             return
 
-        size_payload = ip.len - ip.hl * 4 - tcp.off * 4
+        size_payload = packet.payload_len
 
-        if (size_payload > 0 and dss in conn_acks[conn_id][SEQ_C2S] and (dss - conn_acks[conn_id][co.C2S]) % max_val < 2000000000
-                and (mptcp_connections[conn_id].attr[co.C2S][co.TIME_LAST_ACK_TCP] - ts_delta).total_seconds() > 0.0):
+        if (size_payload > 0 and dss in conn_acks[conn_id][HSEQ_C2S] and (dss - conn_acks[conn_id][co.C2S]) % max_val < 2000000000
+):
             # This is a DSS retransmission! (take into account the seq overflow)
-            mptcp_connections[conn_id].attr[co.C2S][co.RETRANS_DSS].append((ts_delta, flow_id, dss, conn_acks[conn_id][HSEQ_C2S][dss][2],
+            retrans_dss.append((conn_id, co.C2S, (ts_delta, flow_id, dss, conn_acks[conn_id][HSEQ_C2S][dss][2],
                                                                             ts_delta - conn_acks[conn_id][HSEQ_C2S][dss][0],
                                                                             ts_delta - conn_acks[conn_id][HSEQ_C2S][dss][1],
-                                                                            ts_delta - conn_acks[conn_id][co.TIMESTAMP][CLIENT]))
+                                                                            ts_delta - conn_acks[conn_id][co.TIMESTAMP][CLIENT])))
             conn_acks[conn_id][HSEQ_C2S][dss][1] = ts_delta
         elif size_payload > 0 and dss is not False:
-            conn_acks[conn_id][SEQ_C2S].add(dss)
-            conn_acks[conn_id][HSEQ_C2S][dss] = [ts_delta, ts_delta, ts_delta - conn_acks[conn_id][co.TIMESTAMP][CLIENT]]
+            conn_acks[conn_id][HSEQ_C2S].add(dss, [ts_delta, ts_delta, ts_delta - conn_acks[conn_id][co.TIMESTAMP][CLIENT]], modulo=max_val)
 
     conn_acks[conn_id][co.S2C] = dack
+    if dack is not False:
+        conn_acks[conn_id][HSEQ_S2C].ack(dack, ts_delta, modulo=max_ack_val)
     acks[saddr, sport, daddr, dport][co.TIMESTAMP][CLIENT] = ts_delta
     conn_acks[conn_id][co.TIMESTAMP][CLIENT] = ts_delta
 
 
-def process_mptcp_pkt_from_server(ts_delta, acks, conn_acks, mptcp_connections, tcp, ip, saddr, daddr, sport, dport):
-    """ Process a packet with ACK set from the server for the MPTCP DSS retransmissions """
-    dss, dack, dss_is_8_bytes = get_dss_and_data_ack(tcp)
+def process_mptcp_pkt_from_server(ts_delta, acks, conn_acks, retrans_dss, packet, saddr, daddr, sport, dport):
+    """ Process a packet with ACK set from the server for the MPTCP DSS retransmissions
+        Potential DSS retransmissions are added in retrans_dss as (conn_id, direction, retransmission)
+    """
+    dss, dack, dss_is_8_bytes, dack_is_8_bytes = get_dss_and_data_ack(packet.opts)
     conn_id = acks[daddr, dport, saddr, sport][co.CONN_ID]
     flow_id = acks[daddr, dport, saddr, sport][co.FLOW_ID]
+    max_val = 2**64 if dss_is_8_bytes else 2**32
+    max_ack_val = 2**64 if dack_is_8_bytes else 2**32
     if conn_acks[conn_id][co.C2S] >= 0:
-        max_val = 2**64 if dss_is_8_bytes else 2**32
-        bytes_acked = (dack - conn_acks[conn_id][co.C2S]) % max_val
+        bytes_acked = (dack - conn_acks[conn_id][co.C2S]) % max_ack_val
         if bytes_acked >= 2000000000:
             # Ack of 2GB or more is just not possible here
             return
 
-        size_payload = ip.len - ip.hl * 4 - tcp.off * 4
+        size_payload = packet.payload_len
 
-        if (size_payload > 0 and dss in conn_acks[conn_id][SEQ_S2C] and (dss - conn_acks[conn_id][co.S2C]) % max_val < 2000000000
-                and (mptcp_connections[conn_id].attr[co.S2C][co.TIME_LAST_ACK_TCP] - ts_delta).total_seconds() > 0.0):
+        if (size_payload > 0 and dss in conn_acks[conn_id][HSEQ_S2C] and (dss - conn_acks[conn_id][co.S2C]) % max_val < 2000000000
+):
             # This is a DSS retransmission!
-            mptcp_connections[conn_id].attr[co.S2C][co.RETRANS_DSS].append((ts_delta, flow_id, dss, conn_acks[conn_id][HSEQ_S2C][dss][2],
+            retrans_dss.append((conn_id, co.S2C, (ts_delta, flow_id, dss, conn_acks[conn_id][HSEQ_S2C][dss][2],
                                                                             ts_delta - conn_acks[conn_id][HSEQ_S2C][dss][0],
                                                                             ts_delta - conn_acks[conn_id][HSEQ_S2C][dss][1],
-                                                                            ts_delta - conn_acks[conn_id][co.TIMESTAMP][SERVER]))
+                                                                            ts_delta - conn_acks[conn_id][co.TIMESTAMP][SERVER])))
             conn_acks[conn_id][HSEQ_S2C][dss][1] = ts_delta
         elif size_payload > 0 and dss is not False:
-            conn_acks[conn_id][SEQ_S2C].add(dss)
-            conn_acks[conn_id][HSEQ_S2C][dss] = [ts_delta, ts_delta, ts_delta - conn_acks[conn_id][co.TIMESTAMP][SERVER]]
+            conn_acks[conn_id][HSEQ_S2C].add(dss, [ts_delta, ts_delta, ts_delta - conn_acks[conn_id][co.TIMESTAMP][SERVER]], modulo=max_val)
 
     conn_acks[conn_id][co.C2S] = dack
+    if dack is not False:
+        conn_acks[conn_id][HSEQ_C2S].ack(dack, ts_delta, modulo=max_ack_val)
     acks[daddr, dport, saddr, sport][co.TIMESTAMP][SERVER] = ts_delta
     conn_acks[conn_id][co.TIMESTAMP][SERVER] = ts_delta
 
 
-def compute_mptcp_dss_retransmissions(pcap_filepath, mptcp_connections, fast_conns, ts_syn_timeout=6.0, ts_timeout=3600.0):
-    """ Compute MPTCP DSS retransmissions (avoid taking into account spurious ones) """
-    print("Computing MPTCP DSS retransmissions for", pcap_filepath)
-    acks = {}
-    conn_acks = {}
-    # Avoid processing packets that do not belong to any analyzed TCP connection
-    black_list = set()
-    pcap_file = open(pcap_filepath)
-    pcap = dpkt.pcap.Reader(pcap_file)
-    count = 0
-    for ts, buf in pcap:
-        ts_delta = get_ts_delta(ts)
-        count += 1
-        if count % 100000 == 0:
-            print(count)
+class MPTCPDSSRetransAnalyzer(object):
+
+    """ Analyzer computing MPTCP DSS retransmissions (avoid taking into account spurious ones)
+        Only the DSS retransmissions before the last TCP ACK of the connection are kept, but this one is only known once
+        all packets are seen: finish() has to be called once TIME_LAST_ACK_TCP of MPTCP connections are computed
+        The state of subflows is dropped when they expire, and the one of a MPTCP connection with its last subflow
+    """
+
+    def __init__(self, mptcp_connections, fast_conns, ts_syn_timeout=6.0, ts_timeout=3600.0):
+        self.mptcp_connections = mptcp_connections
+        self.fast_conns = fast_conns
+        # Timeouts are given in seconds, but compared with timestamps in nanoseconds
+        self.ts_syn_timeout = int(ts_syn_timeout * co.NS_PER_SEC)
+        self.ts_timeout = int(ts_timeout * co.NS_PER_SEC)
+        self.acks = {}
+        self.conn_acks = {}
+        # Number of subflows in acks of each MPTCP connection in conn_acks
+        self.nb_subflows = {}
+        # Potential DSS retransmissions, as (conn_id, direction, retransmission)
+        self.retrans_dss = []
+        # Avoid processing packets that do not belong to any analyzed TCP connection
+        self.black_list = set()
+        self.expiry = ConnectionExpiry(self.ts_timeout)
+
+    def release_subflow(self, subflow_acks):
+        """ Drop the state of the MPTCP connection of the subflow if this was its last subflow """
+        conn_id = subflow_acks[co.CONN_ID]
+        self.nb_subflows[conn_id] -= 1
+        if self.nb_subflows[conn_id] == 0:
+            del self.nb_subflows[conn_id]
+            self.conn_acks.pop(conn_id, None)
+
+    def process_packet(self, packet):
+        for key in self.expiry.expire(packet.ts_delta):
+            self.black_list.discard(key)
+            if key in self.acks:
+                self.release_subflow(self.acks.pop(key))
+
+        saddr, daddr, sport, dport = packet.saddr, packet.daddr, packet.sport, packet.dport
+        if packet.syn_flag and not packet.ack_flag and not packet.fin_flag and not packet.rst_flag:
+            previous_acks = self.acks.get((saddr, sport, daddr, dport), None)
+            process_mptcp_first_syn(packet.ts_delta, self.acks, self.conn_acks, self.mptcp_connections, packet, saddr, daddr, sport, dport,
+                                    self.black_list, self.fast_conns, self.ts_syn_timeout, self.ts_timeout)
+            subflow_acks = self.acks.get((saddr, sport, daddr, dport), None)
+            if subflow_acks is not previous_acks:
+                self.nb_subflows[subflow_acks[co.CONN_ID]] = self.nb_subflows.get(subflow_acks[co.CONN_ID], 0) + 1
+                if previous_acks:
+                    self.release_subflow(previous_acks)
+
+        elif (saddr, sport, daddr, dport) in self.black_list:
+            pass
+
+        elif packet.syn_flag and packet.ack_flag and not packet.fin_flag and not packet.rst_flag:
+            process_mptcp_syn_ack(packet.ts_delta, self.acks, self.conn_acks, self.mptcp_connections, packet, saddr, daddr, sport, dport,
+                                  self.black_list, self.fast_conns, self.ts_syn_timeout, self.ts_timeout)
+
+        elif not packet.syn_flag and not packet.rst_flag and packet.ack_flag:
+            if (saddr, sport, daddr, dport) in self.acks:
+                process_mptcp_pkt_from_client(packet.ts_delta, self.acks, self.conn_acks, self.retrans_dss, packet, saddr, daddr, sport, dport)
+
+            elif (daddr, dport, saddr, sport) in self.acks:
+                process_mptcp_pkt_from_server(packet.ts_delta, self.acks, self.conn_acks, self.retrans_dss, packet, saddr, daddr, sport, dport)
+            # Else silently ignore those packets (beginning not seen)
+
+        touch_connection_state(self.expiry, packet, self.acks, self.black_list)
+
+    def finish(self):
+        """ Put in the MPTCP connections their DSS retransmissions sent before their last TCP ACK """
+        for conn_id, direction, retrans in self.retrans_dss:
+            if self.mptcp_connections[conn_id].attr[direction][co.TIME_LAST_ACK_TCP] > retrans[0]:
+                self.mptcp_connections[conn_id].attr[direction][co.RETRANS_DSS].append(retrans)
+
+
+def find_root(roots, item):
+    """ Return the root of item in the union-find forest roots (dictionary of parents, a root being its own parent) """
+    while roots[item] != item:
+        roots[item] = roots[roots[item]]
+        item = roots[item]
+    return item
+
+
+def shard_mptcp_flows(columns, fast_conns, nb_shards):
+    """ Return the shard of each flow of columns, or -1 if it cannot be a MPTCP subflow (such flows are only black-listed by
+        MPTCPDSSRetransAnalyzer)
+        Both directions of a 4-tuple are in the same shard, with all the MPTCP connections it may belong to (a 4-tuple can be reused
+        by several connections), so that the state of a MPTCP connection is only in one shard
+        Groups of connections are spread by decreasing number of packets on the least loaded shard
+    """
+    # Union-find of the MPTCP connections sharing a 4-tuple (in any direction)
+    roots = {}
+    pair_conns = {}
+    for (saddr, daddr, sport, dport), candidates in fast_conns.iteritems():
+        pair = min((saddr, sport, daddr, dport), (daddr, dport, saddr, sport))
+        for start, duration, conn_id, flow_id in candidates:
+            roots.setdefault(conn_id, conn_id)
+            if pair in pair_conns:
+                roots[find_root(roots, conn_id)] = find_root(roots, pair_conns[pair])
+            else:
+                pair_conns[pair] = conn_id
+
+    flow_group = np.full(len(columns.keys), -1, dtype=np.int64)
+    group_ids = {}
+    for flow, (saddr, sport, daddr, dport) in enumerate(columns.keys):
+        conn_id = pair_conns.get(min((saddr, sport, daddr, dport), (daddr, dport, saddr, sport)))
+        if conn_id is not None:
+            flow_group[flow] = group_ids.setdefault(find_root(roots, conn_id), len(group_ids))
+
+    is_subflow = flow_group >= 0
+    if not group_ids:
+        return flow_group
+    flow_packets = np.bincount(columns.flow, minlength=len(columns.keys))
+    group_packets = np.bincount(flow_group[is_subflow], weights=flow_packets[is_subflow], minlength=len(group_ids))
+    group_shard = np.zeros(len(group_ids), dtype=np.int64)
+    loads = [(0, shard) for shard in range(nb_shards)]
+    for group in np.argsort(-group_packets, kind='mergesort').tolist():
+        load, shard = heapq.heappop(loads)
+        group_shard[group] = shard
+        heapq.heappush(loads, (load + group_packets[group], shard))
+    return np.where(is_subflow, group_shard[np.maximum(flow_group, 0)], -1)
+
+
+# Inputs of the sharded computation of MPTCP DSS retransmissions, inherited by the forked worker processes (see
+# compute_mptcp_dss_retransmissions_sharded)
+dss_shard_job = None
+
+
+def process_mptcp_dss_shard(shard):
+    """ Return the potential DSS retransmissions of the packets of shard (run in a worker process) """
+    columns, packet_shard, mptcp_connections, fast_conns, ts_syn_timeout, ts_timeout = dss_shard_job
+    analyzer = MPTCPDSSRetransAnalyzer(mptcp_connections, fast_conns, ts_syn_timeout=ts_syn_timeout, ts_timeout=ts_timeout)
+    for packet in columns.iter_packets(np.flatnonzero(packet_shard == shard)):
+        analyzer.process_packet(packet)
+    return analyzer.retrans_dss
+
+
+def compute_mptcp_dss_retransmissions_sharded(columns, mptcp_connections, fast_conns, nb_shards, ts_syn_timeout=6.0, ts_timeout=3600.0):
+    """ Return a MPTCPDSSRetransAnalyzer that saw all packets of columns, its shards (see shard_mptcp_flows) being processed by
+        nb_shards worker processes sharing the columns (forked after they are loaded)
+        Its finish() gives the same result as the one of an analyzer that saw all packets in order, since the retransmissions of
+        a MPTCP connection are all found by the same worker, in order, as long as the packets of the trace are in time order (the
+        state of idle subflows expires with the timestamps of the packets of their shard only)
+    """
+    global dss_shard_job
+    analyzer = MPTCPDSSRetransAnalyzer(mptcp_connections, fast_conns, ts_syn_timeout=ts_syn_timeout, ts_timeout=ts_timeout)
+    packet_shard = shard_mptcp_flows(columns, fast_conns, nb_shards)[columns.flow].astype(np.int32)
+    dss_shard_job = (columns, packet_shard, mptcp_connections, fast_conns, ts_syn_timeout, ts_timeout)
+    try:
+        if multiprocessing.current_process().daemon:
+            # Daemonic processes (as workers of a pool) cannot have children
+            print("Shards of MPTCP DSS retransmissions processed serially in a daemonic process", file=sys.stderr)
+            shard_results = [process_mptcp_dss_shard(shard) for shard in range(nb_shards)]
+        else:
+            pool = multiprocessing.Pool(processes=nb_shards)
+            try:
+                shard_results = pool.map(process_mptcp_dss_shard, range(nb_shards))
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+    finally:
+        dss_shard_job = None
+
+    for retrans_dss in shard_results:
+        analyzer.retrans_dss.extend(retrans_dss)
+    return analyzer
+
+
+##################################################
+#                 MPTCP OPTIONS                  #
+##################################################
+
+
+# TCP option kinds: end of options, no-operation, window scale and MPTCP
+TCP_OPT_EOL, TCP_OPT_NOP, TCP_OPT_WSCALE, TCP_OPT_MPTCP = 0, 1, 3, 30
+# MPTCP option subtypes (RFC 6824)
+MP_CAPABLE, MP_JOIN, DSS, ADD_ADDR, REMOVE_ADDR, MP_PRIO, MP_FAIL, MP_FASTCLOSE = range(8)
+# Layouts of MPTCP options, after their kind and length
+# MP_CAPABLE: subtype and version, flags, key of the sender (followed by the key of the receiver in the third ACK)
+MP_CAPABLE_OPT = struct.Struct('!BBQ')
+# MP_JOIN of a SYN: subtype and backup bit, address id, token of the receiver, random number of the sender
+MP_JOIN_SYN_OPT = struct.Struct('!BBII')
+# MP_JOIN of a SYN/ACK: subtype and backup bit, address id, truncated HMAC, random number of the sender
+MP_JOIN_SYN_ACK_OPT = struct.Struct('!BB8sI')
+# MP_JOIN of the third ACK: subtype, HMAC
+MP_JOIN_ACK_OPT = struct.Struct('!Bx20s')
+# DSS: subtype, flags (followed by the data ACK, the DSN and its mapping, depending on the flags)
+DSS_OPT = struct.Struct('!BB')
+# Mapping of a DSN: subflow sequence number, data-level length (followed by an optional checksum)
+DSS_MAPPING_OPT = struct.Struct('!IH')
+# ADD_ADDR: subtype and IP version, address id (followed by the address and an optional port)
+ADD_ADDR_OPT = struct.Struct('!BB')
+# MP_FAIL and MP_FASTCLOSE: subtype, DSN or key of the receiver
+MP_FAIL_OPT = struct.Struct('!BxQ')
+UINT16_OPT = struct.Struct('!H')
+UINT32_OPT = struct.Struct('!I')
+UINT64_OPT = struct.Struct('!Q')
+# Flags of a DSS option
+DSS_DATA_FIN = 0x10
+DSS_DSN_8_BYTES = 0x08
+DSS_DSN_PRESENT = 0x04
+DSS_DACK_8_BYTES = 0x02
+DSS_DACK_PRESENT = 0x01
+
+
+def decode_mp_capable(opts, start, size):
+    if size < MP_CAPABLE_OPT.size:
+        return None
+    subtype_version, flags, sender_key = MP_CAPABLE_OPT.unpack_from(opts, start)
+    receiver_key = UINT64_OPT.unpack_from(opts, start + MP_CAPABLE_OPT.size)[0] if size >= MP_CAPABLE_OPT.size + 8 else None
+    return subtype_version & 0x0f, flags, sender_key, receiver_key
+
+
+def decode_mp_join(opts, start, size):
+    if size >= MP_JOIN_ACK_OPT.size:
+        subtype_backup, hmac = MP_JOIN_ACK_OPT.unpack_from(opts, start)
+        return (subtype_backup & 0x01) != 0, None, None, None, hmac
+    elif size >= MP_JOIN_SYN_ACK_OPT.size:
+        subtype_backup, address_id, hmac, random_number = MP_JOIN_SYN_ACK_OPT.unpack_from(opts, start)
+        return (subtype_backup & 0x01) != 0, address_id, None, random_number, hmac
+    elif size >= MP_JOIN_SYN_OPT.size:
+        subtype_backup, address_id, token, random_number = MP_JOIN_SYN_OPT.unpack_from(opts, start)
+        return (subtype_backup & 0x01) != 0, address_id, token, random_number, None
+    return None
+
+
+def decode_dss(opts, start, size):
+    if size < DSS_OPT.size:
+        return None
+    flags = DSS_OPT.unpack_from(opts, start)[1]
+    dsn_is_8_bytes = (flags & DSS_DSN_8_BYTES) != 0
+    dack_is_8_bytes = (flags & DSS_DACK_8_BYTES) != 0
+    dack, dsn, subflow_seq, data_len, checksum = None, None, None, None, None
+    offset, end = start + DSS_OPT.size, start + size
+    if flags & DSS_DACK_PRESENT:
+        uint_opt = UINT64_OPT if dack_is_8_bytes else UINT32_OPT
+        if offset + uint_opt.size > end:
+            return None
+        dack = uint_opt.unpack_from(opts, offset)[0]
+        offset += uint_opt.size
+    if flags & DSS_DSN_PRESENT:
+        uint_opt = UINT64_OPT if dsn_is_8_bytes else UINT32_OPT
+        if offset + uint_opt.size <= end:
+            dsn = uint_opt.unpack_from(opts, offset)[0]
+            offset += uint_opt.size
+            if offset + DSS_MAPPING_OPT.size <= end:
+                subflow_seq, data_len = DSS_MAPPING_OPT.unpack_from(opts, offset)
+                offset += DSS_MAPPING_OPT.size
+                if offset + UINT16_OPT.size <= end:
+                    checksum = UINT16_OPT.unpack_from(opts, offset)[0]
+    return dack, dsn, subflow_seq, data_len, checksum, dsn_is_8_bytes, dack_is_8_bytes, (flags & DSS_DATA_FIN) != 0
+
+
+def decode_add_addr(opts, start, size):
+    if size < ADD_ADDR_OPT.size:
+        return None
+    subtype_ipver, address_id = ADD_ADDR_OPT.unpack_from(opts, start)
+    address_len = {4: 4, 6: 16}.get(subtype_ipver & 0x0f)
+    if address_len is None or size < ADD_ADDR_OPT.size + address_len:
+        return None
+    offset = start + ADD_ADDR_OPT.size
+    # A port is present if 2 bytes remain, maybe followed by the truncated HMAC of the version 1 of MPTCP
+    port = UINT16_OPT.unpack_from(opts, offset + address_len)[0] if size - ADD_ADDR_OPT.size - address_len in (2, 10) else None
+    return address_id, bytes(opts[offset:offset + address_len]), port
+
+
+def decode_remove_addr(opts, start, size):
+    return list(opts[start + 1:start + size])
+
+
+def decode_mp_prio(opts, start, size):
+    return (opts[start] & 0x01) != 0, (opts[start + 1] if size >= 2 else None)
+
+
+def decode_mp_fail(opts, start, size):
+    return MP_FAIL_OPT.unpack_from(opts, start)[1] if size >= MP_FAIL_OPT.size else None
+
+
+# Decoders of the content of MPTCP options (as bytearray, start, size), by subtype; they return None for truncated options
+MPTCP_OPTION_DECODERS = {MP_CAPABLE: decode_mp_capable, MP_JOIN: decode_mp_join, DSS: decode_dss, ADD_ADDR: decode_add_addr,
+                         REMOVE_ADDR: decode_remove_addr, MP_PRIO: decode_mp_prio, MP_FAIL: decode_mp_fail,
+                         MP_FASTCLOSE: decode_mp_fail}
+
+
+def decode_mptcp_options(opts):
+    """ Return a dictionary {subtype: fields} of the MPTCP options in the TCP options opts, read in one scan (if a subtype appears
+        several times, the last option is kept); the fields of each subtype are
+        - MP_CAPABLE: (version, flags, key of the sender, key of the receiver or None)
+        - MP_JOIN: (backup, address id, token, random number, HMAC), with None for what is not in the variant (SYN, SYN/ACK or ACK)
+        - DSS: (data ACK, DSN, subflow sequence number, data-level length, checksum, DSN on 8 bytes, data ACK on 8 bytes, data FIN),
+               with None for what is absent
+        - ADD_ADDR: (address id, packed address, port or None)
+        - REMOVE_ADDR: list of address ids
+        - MP_PRIO: (backup, address id or None)
+        - MP_FAIL: DSN
+        - MP_FASTCLOSE: key of the receiver
+    """
+    mptcp_options = {}
+    opts = bytearray(opts)
+    if TCP_OPT_MPTCP not in opts:
+        return mptcp_options
+    offset, end = 0, len(opts)
+    while offset < end:
+        kind = opts[offset]
+        if kind <= TCP_OPT_NOP:
+            offset += 1
+            continue
+        if offset + 1 == end:
+            break
+        # Same handling of the length as dpkt.tcp.parse_opts
+        start, offset = offset + 2, offset + max(2, opts[offset + 1])
+        if kind == TCP_OPT_MPTCP and start < offset <= end:
+            subtype = opts[start] >> 4
+            decoder = MPTCP_OPTION_DECODERS.get(subtype)
+            fields = decoder(opts, start, offset - start) if decoder else None
+            if fields is not None:
+                mptcp_options[subtype] = fields
+
+    return mptcp_options
+
+
+def get_window_scale(opts):
+    """ Return the shift count of the window scale option in the TCP options opts, or None if there is none """
+    opts = bytearray(opts)
+    offset, end = 0, len(opts)
+    while offset < end:
+        kind = opts[offset]
+        if kind <= TCP_OPT_NOP:
+            offset += 1
+            continue
+        if offset + 1 == end:
+            break
+        if kind == TCP_OPT_WSCALE and opts[offset + 1] == 3 and offset + 3 <= end:
+            return opts[offset + 2]
+        offset += max(2, opts[offset + 1])
+    return None
+
+
+##################################################
+#                 PACKET ENGINE                  #
+##################################################
+
+
+# Link-layer headers decoded at fixed offsets, giving the offset of the network header and the format of the field with its type
+LINK_HEADERS = {dpkt.pcap.DLT_EN10MB: (14, struct.Struct('!12xH')),
+                dpkt.pcap.DLT_LINUX_SLL: (16, struct.Struct('!14xH'))}
+# Version and header length, total length, fragment offset, protocol, source and destination addresses
+IPV4_HEADER = struct.Struct('!BxH2xHxB2x4s4s')
+# Payload length, next header, source and destination addresses
+IPV6_HEADER = struct.Struct('!4xHBx16s16s')
+# Ports, sequence and acknowledgement numbers, data offset and flags (options follow the window, checksum and urgent pointer)
+TCP_HEADER = struct.Struct('!HHIIBB6x')
+# IPv4 flag "more fragments" and fragment offset mask
+IPV4_FRAGMENT_MASK = 0x3fff
+# IPv6 next headers that are extension headers (left to dpkt)
+IPV6_EXTENSION_HEADERS = frozenset([0, 43, 44, 50, 51, 60, 135, 139, 140])
+
+
+class TCPPacket(object):
+
+    """ A TCP packet, decoded once and given to all analyzers
+        Only the fields used by the analyzers are kept: addresses are packed and ports are integers (see pack_ip_address),
+        payload_len is the length of the payload announced by the IP header, data is the payload present in the capture (maybe stripped)
+        frame_len is the original length of the frame, as recorded in the pcap
+    """
+
+    __slots__ = ['ts_delta', 'saddr', 'daddr', 'sport', 'dport', 'seq', 'ack', 'opts', 'payload_len', 'data', 'flags', 'frame_len',
+                 'fin_flag', 'syn_flag', 'rst_flag', 'ack_flag']
+
+    def __init__(self, ts_delta, saddr, daddr, sport, dport, seq, ack, flags, opts, payload_len, data, frame_len=0):
+        self.ts_delta = ts_delta
+        self.saddr = saddr
+        self.daddr = daddr
+        self.sport = sport
+        self.dport = dport
+        self.seq = seq
+        self.ack = ack
+        self.opts = opts
+        self.payload_len = payload_len
+        self.data = data
+        self.flags = flags
+        self.frame_len = frame_len
+        self.fin_flag = (flags & dpkt.tcp.TH_FIN) != 0
+        self.syn_flag = (flags & dpkt.tcp.TH_SYN) != 0
+        self.rst_flag = (flags & dpkt.tcp.TH_RST) != 0
+        self.ack_flag = (flags & dpkt.tcp.TH_ACK) != 0
+
+
+def decode_tcp_packet(ts, buf, datalink):
+    """ Return the TCPPacket in buf, or None if it is not a TCP packet
+        This builds the dpkt objects of all layers, see decode_tcp_packet_fast for the common case
+    """
+    # Check if linux cooked capture
+    if datalink == dpkt.pcap.DLT_LINUX_SLL:
+        eth = dpkt.sll.SLL(buf)
+    else:
         eth = dpkt.ethernet.Ethernet(buf)
-        if type(eth.data) == dpkt.ip.IP or type(eth.data) == dpkt.ip6.IP6:
-            ip = eth.data
-            if type(ip.data) == dpkt.tcp.TCP:
-                tcp = ip.data
-                fin_flag = (tcp.flags & dpkt.tcp.TH_FIN) != 0
-                syn_flag = (tcp.flags & dpkt.tcp.TH_SYN) != 0
-                rst_flag = (tcp.flags & dpkt.tcp.TH_RST) != 0
-                ack_flag = (tcp.flags & dpkt.tcp.TH_ACK) != 0
-
-                saddr, daddr, sport, dport = get_ips_and_ports(eth, ip, tcp)
-
-                if syn_flag and not ack_flag and not fin_flag and not rst_flag:
-                    process_mptcp_first_syn(ts_delta, acks, conn_acks, mptcp_connections, tcp, ip, saddr, daddr, sport, dport, black_list, fast_conns,
-                                            ts_syn_timeout, ts_timeout)
-
-                elif (saddr, sport, daddr, dport) in black_list:
-                    continue
+    if type(eth.data) == dpkt.ip.IP or type(eth.data) == dpkt.ip6.IP6:
+        ip = eth.data
+        if type(ip.data) == dpkt.tcp.TCP:
+            tcp = ip.data
+            if type(ip) == dpkt.ip.IP:
+                payload_len = ip.len - ip.hl * 4 - tcp.off * 4
+            else:
+                # len(ip) also counts its extension headers
+                payload_len = ip.plen - (len(ip) - ip.__hdr_len__ - len(tcp)) - tcp.off * 4
+            return TCPPacket(ts, ip.src, ip.dst, tcp.sport, tcp.dport, tcp.seq, tcp.ack, tcp.flags, tcp.opts, payload_len,
+                             tcp.data)
+    return None
+
+
+def decode_tcp_packet_fast(ts, buf, link_header):
+    """ Return the TCPPacket in buf by only reading the needed fields at fixed offsets, None if it is not a TCP packet,
+        or False if the packet has to be decoded by decode_tcp_packet (VLAN tags, IP options, IPv6 extension headers,
+        fragments, truncated headers,...)
+        link_header is the value of LINK_HEADERS for the linktype of the pcap
+    """
+    ip_offset, link_struct = link_header
+    if len(buf) < ip_offset + IPV6_HEADER.size:
+        return False
+    ethertype = link_struct.unpack_from(buf)[0]
+    if ethertype == dpkt.ethernet.ETH_TYPE_IP:
+        ver_hl, ip_len, ip_off, proto, src, dst = IPV4_HEADER.unpack_from(buf, ip_offset)
+        if ver_hl != 0x45 or ip_off & IPV4_FRAGMENT_MASK:
+            return False
+        if proto != dpkt.ip.IP_PROTO_TCP:
+            return None
+        tcp_offset = ip_offset + 20
+        payload_len = ip_len - 20
+    elif ethertype == dpkt.ethernet.ETH_TYPE_IP6:
+        plen, nxt, src, dst = IPV6_HEADER.unpack_from(buf, ip_offset)
+        if nxt != dpkt.ip.IP_PROTO_TCP:
+            return False if nxt in IPV6_EXTENSION_HEADERS else None
+        tcp_offset = ip_offset + IPV6_HEADER.size
+        payload_len = plen
+    else:
+        return False
+
+    if len(buf) < tcp_offset + TCP_HEADER.size:
+        return False
+    sport, dport, seq, ack, off_x2, flags = TCP_HEADER.unpack_from(buf, tcp_offset)
+    data_offset = tcp_offset + (off_x2 >> 4) * 4
+    if len(buf) < data_offset:
+        return False
+    payload_len -= data_offset - tcp_offset
+    return TCPPacket(ts, src, dst, sport, dport, seq, ack, flags,
+                     buf[tcp_offset + TCP_HEADER.size:data_offset], payload_len, buf[data_offset:data_offset + max(payload_len, 0)])
+
+
+def process_packets(pcap_filepath, analyzers):
+    """ Read the pcap file once and give each TCP packet, decoded once, to the process_packet method of all analyzers (in order) """
+    count = 0
+    with co.pcap_reader(pcap_filepath) as pcap:
+        datalink = pcap.datalink()
+        # The link-layer type is resolved once; unknown ones are always decoded by dpkt
+        link_header = LINK_HEADERS.get(datalink)
+        try:
+            for ts, buf in pcap:
+                count += 1
+                if count % 100000 == 0:
+                    print(count)
+                packet = decode_tcp_packet_fast(ts, buf, link_header) if link_header else False
+                if packet is False:
+                    packet = decode_tcp_packet(ts, buf, datalink)
+                if packet:
+                    packet.frame_len = pcap.length
+                    for analyzer in analyzers:
+                        analyzer.process_packet(packet)
+        except dpkt.NeedData as e:
+            print(e, ": trying to continue...", file=sys.stderr)
 
-                elif syn_flag and ack_flag and not fin_flag and not rst_flag:
-                    process_mptcp_syn_ack(ts_delta, acks, conn_acks, mptcp_connections, tcp, ip, saddr, daddr, sport, dport, black_list, fast_conns,
-                                          ts_syn_timeout, ts_timeout)
 
-                elif not syn_flag and not rst_flag and ack_flag:
-                    if (saddr, sport, daddr, dport) in acks:
-                        process_mptcp_pkt_from_client(ts_delta, acks, conn_acks, mptcp_connections, tcp, ip, saddr, daddr, sport, dport)
+##################################################
+#                COLUMNAR ENGINE                 #
+##################################################
+
+
+class TCPColumns(object):
+
+    """ The TCP packets of a pcap file as NumPy arrays, with one value per packet in the order of the trace
+        flow is the index in keys of the (saddr, sport, daddr, dport) of the packet (as in TCPPacket)
+        Only the options containing an MPTCP option and the payloads of 7 bytes (SOCKS commands) are kept, as RaggedColumns
+        The arrays can be memory-mapped from a cache of columns (see get_tcp_columns)
+    """
+
+    def __init__(self, ts_delta, flow, seq, ack, flags, payload_len, frame_len, keys, opts, data):
+        self.ts_delta = ts_delta
+        self.flow = flow
+        self.seq = seq
+        self.ack = ack
+        self.flags = flags
+        self.payload_len = payload_len
+        self.frame_len = frame_len
+        self.keys = keys
+        self.opts = opts
+        self.data = data
+
+    def __len__(self):
+        return len(self.ts_delta)
+
+    def packet(self, index):
+        """ Return the TCPPacket at index, with the options and payload that were kept """
+        saddr, sport, daddr, dport = self.keys[self.flow[index]]
+        return TCPPacket(int(self.ts_delta[index]), saddr, daddr, sport, dport, int(self.seq[index]), int(self.ack[index]),
+                         int(self.flags[index]), self.opts.get(index), int(self.payload_len[index]), self.data.get(index),
+                         int(self.frame_len[index]))
+
+    def iter_packets(self, indices=None):
+        """ Yield the TCPPackets at indices (a sorted array, all packets by default), in order, reading the columns by chunks """
+        nb_packets = len(self) if indices is None else len(indices)
+        for begin in xrange(0, nb_packets, ITER_CHUNK_SIZE):
+            end = min(begin + ITER_CHUNK_SIZE, nb_packets)
+            if indices is None:
+                chunk, chunk_indices, first, last = slice(begin, end), xrange(begin, end), begin, end
+            else:
+                chunk = indices[begin:end]
+                chunk_indices, first, last = chunk.tolist(), int(chunk[0]), int(chunk[-1]) + 1
+            opts = dict(self.opts.items(first, last))
+            data = dict(self.data.items(first, last))
+            values = [getattr(self, name)[chunk].tolist() for name in PACKET_COLUMNS]
+            for index, ts_delta, flow, seq, ack, flags, payload_len, frame_len in zip(chunk_indices, *values):
+                saddr, sport, daddr, dport = self.keys[flow]
+                yield TCPPacket(ts_delta, saddr, daddr, sport, dport, seq, ack, flags, opts.get(index, b''), payload_len,
+                                data.get(index, b''), frame_len)
+
+
+class RaggedColumn(object):
+
+    """ Byte strings of some packets, concatenated in blob: the value of the packet index[i] is blob[offset[i]:offset[i + 1]]
+        index is sorted and offset has one more element than index
+    """
+
+    def __init__(self, index, offset, blob):
+        self.index = index
+        self.offset = offset
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, index, default=b''):
+        i = int(np.searchsorted(self.index, index))
+        if i == len(self.index) or self.index[i] != index:
+            return default
+        return self.blob[self.offset[i]:self.offset[i + 1]].tobytes()
+
+    def items(self, begin=0, end=None):
+        """ Return the list of (index, value) of the packets whose index is in [begin, end), in order """
+        first = int(np.searchsorted(self.index, begin))
+        last = len(self.index) if end is None else int(np.searchsorted(self.index, end))
+        offsets = self.offset[first:last + 1].tolist()
+        if len(offsets) < 2:
+            return []
+        blob = self.blob[offsets[0]:offsets[-1]].tobytes()
+        return [(index, blob[offsets[i] - offsets[0]:offsets[i + 1] - offsets[0]])
+                for i, index in enumerate(self.index[first:last].tolist())]
+
+
+class RaggedColumnBuilder(object):
+
+    """ Build a RaggedColumn by appending the values of packets in increasing order of index """
+
+    def __init__(self):
+        self.index = array.array('l')
+        self.offset = array.array('l', [0])
+        self.blob = bytearray()
+
+    def append(self, index, value):
+        self.index.append(index)
+        self.blob.extend(value)
+        self.offset.append(len(self.blob))
+
+    def column(self):
+        return RaggedColumn(column_array(self.index), column_array(self.offset), np.frombuffer(bytes(self.blob), dtype=np.uint8))
+
+
+def column_array(column):
+    """ Return the values of the array.array column as a NumPy array """
+    if not column:
+        return np.zeros(0, dtype=column.typecode)
+    return np.frombuffer(column, dtype=column.typecode)
+
+
+class TCPColumnsBuilder(object):
+
+    """ Analyzer keeping the packets it is given as columns (compact arrays), see TCPColumns """
+
+    def __init__(self):
+        self.ts_delta = array.array('l')
+        self.flow = array.array('l')
+        self.seq = array.array('l')
+        self.ack = array.array('l')
+        self.flags = array.array('B')
+        self.payload_len = array.array('l')
+        self.frame_len = array.array('l')
+        self.flow_ids = {}
+        self.keys = []
+        self.opts = RaggedColumnBuilder()
+        self.data = RaggedColumnBuilder()
+
+    def process_packet(self, packet):
+        key = (packet.saddr, packet.sport, packet.daddr, packet.dport)
+        flow = self.flow_ids.get(key)
+        if flow is None:
+            flow = self.flow_ids[key] = len(self.keys)
+            self.keys.append(key)
+        # Options and payloads may be views on the trace: they are copied
+        if packet.opts and MPTCP_OPTION_KIND in bytes(packet.opts):
+            self.opts.append(len(self.ts_delta), packet.opts)
+        if len(packet.data) == 7:
+            self.data.append(len(self.ts_delta), packet.data)
+        self.ts_delta.append(packet.ts_delta)
+        self.flow.append(flow)
+        self.seq.append(packet.seq)
+        self.ack.append(packet.ack)
+        self.flags.append(packet.flags)
+        self.payload_len.append(packet.payload_len)
+        self.frame_len.append(packet.frame_len)
+
+    def columns(self):
+        return TCPColumns(column_array(self.ts_delta), column_array(self.flow), column_array(self.seq), column_array(self.ack),
+                          column_array(self.flags), column_array(self.payload_len), column_array(self.frame_len), self.keys,
+                          self.opts.column(), self.data.column())
+
+
+def save_tcp_columns(columns, columns_path):
+    """ Save columns in the directory columns_path, as one .npy file per array
+        The files are written in a temporary directory renamed at the end, so columns_path is complete once it exists
+        Failures are only reported: the cache is an optimization
+    """
+    nb_flows = len(columns.keys)
+    arrays = dict((name, getattr(columns, name)) for name in PACKET_COLUMNS)
+    arrays['flow_saddr'] = np.zeros((nb_flows, 16), dtype=np.uint8)
+    arrays['flow_daddr'] = np.zeros((nb_flows, 16), dtype=np.uint8)
+    arrays['flow_addr_len'] = np.zeros(nb_flows, dtype=np.uint8)
+    arrays['flow_sport'] = np.zeros(nb_flows, dtype=np.int64)
+    arrays['flow_dport'] = np.zeros(nb_flows, dtype=np.int64)
+    for flow, (saddr, sport, daddr, dport) in enumerate(columns.keys):
+        arrays['flow_saddr'][flow, :len(saddr)] = bytearray(saddr)
+        arrays['flow_daddr'][flow, :len(daddr)] = bytearray(daddr)
+        arrays['flow_addr_len'][flow] = len(saddr)
+        arrays['flow_sport'][flow] = sport
+        arrays['flow_dport'][flow] = dport
+    for name in RAGGED_COLUMNS:
+        ragged = getattr(columns, name)
+        arrays[name + '_index'] = ragged.index
+        arrays[name + '_offset'] = ragged.offset
+        arrays[name + '_blob'] = ragged.blob
+
+    tmp_path = None
+    try:
+        tmp_path = tempfile.mkdtemp(prefix='.', dir=os.path.dirname(os.path.abspath(columns_path)))
+        for name, values in arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), np.asarray(values))
+        os.rename(tmp_path, columns_path)
+    except (IOError, OSError) as e:
+        if os.path.isdir(columns_path):
+            # Saved at the same time by another process
+            pass
+        else:
+            print("Columns not saved in", columns_path, ":", e, file=sys.stderr)
+        if tmp_path:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_tcp_columns(columns_path):
+    """ Return the TCPColumns saved in columns_path, memory-mapped, or None if they cannot be read """
+    try:
+        arrays = {}
+        for filename in os.listdir(columns_path):
+            if filename.endswith('.npy'):
+                arrays[filename[:-len('.npy')]] = np.load(os.path.join(columns_path, filename), mmap_mode='r')
+        saddrs, daddrs = arrays['flow_saddr'], arrays['flow_daddr']
+        keys = [(saddrs[flow, :addr_len].tobytes(), sport, daddrs[flow, :addr_len].tobytes(), dport)
+                for flow, (addr_len, sport, dport) in enumerate(zip(arrays['flow_addr_len'].tolist(), arrays['flow_sport'].tolist(),
+                                                                    arrays['flow_dport'].tolist()))]
+        ragged = [RaggedColumn(arrays[name + '_index'], arrays[name + '_offset'], arrays[name + '_blob']) for name in RAGGED_COLUMNS]
+        return TCPColumns(*([arrays[name] for name in PACKET_COLUMNS] + [keys] + ragged))
+    except (IOError, OSError, ValueError, KeyError) as e:
+        print("Columns in", columns_path, "cannot be read:", e, file=sys.stderr)
+        return None
+
+
+def get_tcp_columns(pcap_filepath, analyzers=None, columns_dir=None, fingerprint=None):
+    """ Return the TCPColumns of the trace and give its packets to the process_packet method of analyzers
+        With columns_dir, they are cached in it by fingerprint of the trace: only the first pass on a trace reads it, the next ones
+        memory-map its columns (the cache does not depend on the name of the trace, but a trace rewritten in place is read again)
+        fingerprint is the one to use instead, if the trace is a copy of another file (ex. uncompressed from an input trace, with
+        co.get_pcap_fingerprint of the input), so that its columns are found whatever the time of the copy
+    """
+    analyzers = analyzers or []
+    columns_path = None
+    if columns_dir:
+        if not fingerprint:
+            fingerprint = co.get_pcap_fingerprint(pcap_filepath, use_inode=True)
+        columns_path = os.path.join(columns_dir, fingerprint + '_v' + str(COLUMNS_VERSION))
+        if os.path.isdir(columns_path):
+            columns = load_tcp_columns(columns_path)
+            if columns is not None:
+                if analyzers:
+                    for packet in columns.iter_packets():
+                        for analyzer in analyzers:
+                            analyzer.process_packet(packet)
+                return columns
+
+    builder = TCPColumnsBuilder()
+    process_packets(pcap_filepath, [builder] + analyzers)
+    columns = builder.columns()
+    if columns_path and not os.path.isdir(columns_path):
+        save_tcp_columns(columns, columns_path)
+    return columns
+
+
+def has_mp_join(opts):
+    """ Return True if the options opts contain an MP_JOIN """
+    return MP_JOIN in decode_mptcp_options(opts)
+
+
+def last_in_group(mask, group_start):
+    """ Return for each element the index of the last element before it where mask is True, if it is in its group (that begins at
+        group_start), or -1
+    """
+    last = np.maximum.accumulate(np.where(mask, np.arange(len(mask)), -1))
+    last = np.concatenate(([-1], last[:-1]))
+    return np.where(last >= group_start, last, -1)
+
+
+def last_of_groups(groups):
+    """ Return the index of the last element of each group in groups (sorted) """
+    return np.flatnonzero(np.concatenate((groups[1:] != groups[:-1], [True]))) if len(groups) else np.zeros(0, dtype=np.int64)
 
-                    elif (daddr, dport, saddr, sport) in acks:
-                        process_mptcp_pkt_from_server(ts_delta, acks, conn_acks, mptcp_connections, tcp, ip, saddr, daddr, sport, dport)
-                    else:
-                        # Silently ignore those packets
-                        # print(saddr, sport, daddr, dport, "haven't seen beginning...")
-                        continue
 
-    pcap_file.close()
+def first_greater_in_group(groups, values, query_groups, query_values, bound=None):
+    """ Return for each query the index of the first element of its group whose value is greater than the value of the query, or the
+        index following the group if there is none (groups and values must be sorted by group, then by value within a group)
+        If all values are in [0, bound), (group, value) is searched as one integer, else values are first replaced by their rank
+    """
+    if bound is None:
+        ranks = np.unique(np.concatenate((values, query_values)), return_inverse=True)[1].reshape(-1)
+        values, query_values, bound = ranks[:len(groups)], ranks[len(groups):], len(ranks)
+    return np.searchsorted(groups * bound + values, query_groups * bound + query_values, 'right')
+
+
+def compute_tcp_acks_retrans_columnar(columns, connections, inverse_conns, ts_syn_timeout=6.0, ts_timeout=3600.0):
+    """ Return a dictionary of the number of cases an acknowledgement of x bytes is received, computed from the TCPColumns of the
+        pcap file with all connections processed at once; as TCPAcksRetransAnalyzer, it also puts in connections the timestamps
+        of retransmissions and of the last ACK, FIN and payload sent in both directions
+        The common case is computed with NumPy: connections whose first packet is a SYN, with time-ordered packets, ACKs less than
+        2GB after the first sequence number of the direction and no SYN or SYN/ACK sent again once its sequence number is dropped
+        from its SeqWindow
+        The packets of other connections are given to a TCPAcksRetransAnalyzer, so that results are the same
+    """
+    replay = TCPAcksRetransAnalyzer(connections, inverse_conns, ts_syn_timeout=ts_syn_timeout, ts_timeout=ts_timeout)
+    nb_acks = replay.nb_acks
+    if not len(columns):
+        return nb_acks
+
+    syn, ack, fin, rst = dpkt.tcp.TH_SYN, dpkt.tcp.TH_ACK, dpkt.tcp.TH_FIN, dpkt.tcp.TH_RST
+    # The maximal timestamp seen at each packet gives the time of the expiry wheel (see ConnectionExpiry)
+    max_ts = np.maximum.accumulate(columns.ts_delta)
+
+    # Group the packets of both directions of each 4-tuple, in the order of the trace
+    flow_ids = dict((key, flow) for flow, key in enumerate(columns.keys))
+    pair = np.array([min(flow, flow_ids.get((daddr, dport, saddr, sport), flow))
+                     for flow, (saddr, sport, daddr, dport) in enumerate(columns.keys)], dtype=np.int64)
+    order = np.argsort(pair[columns.flow], kind='mergesort')
+    pair = pair[columns.flow[order]]
+    group = np.cumsum(np.concatenate(([True], pair[1:] != pair[:-1]))) - 1
+    group_start = np.flatnonzero(np.concatenate(([True], pair[1:] != pair[:-1])))
+    is_first_syn = (columns.flags[order] & (syn | ack | fin | rst)) == syn
+    nb_syns = np.add.reduceat(is_first_syn.astype(np.int64), group_start)
+    simple = is_first_syn[group_start]
+    slow = (nb_syns > 0) & ~simple
+
+    conn_ids = []
+    matched = []
+    for grp in np.flatnonzero(simple).tolist():
+        index = order[group_start[grp]]
+        conn_id = find_syn_connection(int(columns.ts_delta[index]), columns.keys[columns.flow[index]], connections, inverse_conns,
+                                      replay.ts_syn_timeout)
+        if conn_id:
+            conn_ids.append(conn_id)
+            matched.append(grp)
+        elif nb_syns[grp] > 1:
+            slow[grp] = True
+        # Else the 4-tuple is black listed
+
+    # Arrays of the packets of matched connections, where grp is the number of the connection in conn_ids
+    matched = np.array(matched, dtype=np.int64)
+    conn_number = np.full(len(group_start), -1, dtype=np.int64)
+    conn_number[matched] = np.arange(len(matched))
+    positions = np.flatnonzero(conn_number[group] >= 0)
+    idx = order[positions]
+    grp = conn_number[group[positions]]
+    syn_pos = np.flatnonzero(np.concatenate(([True], grp[1:] != grp[:-1])))[:len(grp)]
+    start = syn_pos[grp]
+    nb_pkts = len(idx)
+    ts = columns.ts_delta[idx]
+    seq = columns.seq[idx]
+    acked = columns.ack[idx]
+    flags = columns.flags[idx]
+    plen = columns.payload_len[idx]
+    client = columns.flow[idx] == columns.flow[idx[start]]
+    server = ~client
+    is_syn = start == np.arange(nb_pkts)
+    is_syn_ack = (flags & (syn | ack | fin | rst)) == syn | ack
+    is_data = (flags & (syn | ack | rst)) == ack
+    is_fin = (flags & fin) != 0
+    same = grp[1:] == grp[:-1]
+    bad = np.zeros(len(matched), dtype=bool)
+
+    bad[grp[1:][same & (ts[1:] < ts[:-1])]] = True
+    # The state of the connection should never expire (a FIN or a RST closes it)
+    closing = ((flags & (fin | rst)) != 0).astype(np.int64)
+    nb_closing = np.cumsum(closing)
+    nb_closing -= (nb_closing - closing)[start]
+    deadline_slot = (ts + np.where(nb_closing > 0, CLOSED_CONN_TIMEOUT, replay.ts_timeout)) // EXPIRY_TICK
+    now_slot = max_ts[idx] // EXPIRY_TICK
+    bad[grp[deadline_slot < now_slot]] = True
+    bad[grp[1:][same & (deadline_slot[:-1] < now_slot[1:])]] = True
+
+    # Next SYNs are retransmissions of the first one, before any ACK of the client
+    syn_retrans = ((flags & (syn | ack | fin | rst)) == syn) & ~is_syn
+    client_done = is_syn | (is_data & client)
+    last_client = last_in_group(client_done, start)
+    retrans_ok = (syn_retrans & client & (seq == seq[start]) & (last_in_group(is_data & client, start) < 0)
+                  & (ts - ts[last_client] <= replay.ts_syn_timeout))
+    bad[grp[syn_retrans & ~retrans_ok]] = True
+    for pkt in np.flatnonzero(retrans_ok).tolist():
+        if find_syn_connection(int(ts[pkt]), columns.keys[columns.flow[idx[pkt]]], connections, inverse_conns,
+                               replay.ts_syn_timeout) != conn_ids[grp[pkt]]:
+            bad[grp[pkt]] = True
+
+    # The first SYN/ACK of the server is taken into account, next ones are retransmissions of it
+    server_syn_ack = is_syn_ack & server
+    bad[grp[is_syn_ack & client]] = True
+    first_syn_ack = server_syn_ack & (last_in_group(server_syn_ack, start) < 0)
+    syn_ack = first_syn_ack & (last_in_group(is_data & server, start) < 0) & (ts - ts[last_client] < replay.ts_timeout)
+    bad[grp[first_syn_ack & ~syn_ack]] = True
+    syn_ack_retrans = server_syn_ack & ~first_syn_ack
+    last_syn_ack = last_in_group(syn_ack, start)
+    bad[grp[syn_ack_retrans & ((last_syn_ack < 0) | (seq != seq[last_syn_ack]) | (ts - ts[last_client] >= replay.ts_timeout))]] = True
+    last_server = last_in_group(syn_ack | syn_ack_retrans | (is_data & server), start)
+
+    # Packets counted in nb_acks are those following an ACK (or a SYN/ACK) in the same direction
+    prev = np.where(client, last_in_group(is_data & client, start), last_in_group(syn_ack | (is_data & server), start))
+    counted = is_data & (prev >= 0)
+    bytes_acked = (acked - acked[prev]) % 4294967296
+    bad[grp[counted & (bytes_acked >= 2000000000)]] = True
+
+    # Sequence numbers sent by the client are in the window 2 * grp, those of the server in 2 * grp + 1; each ACK acknowledges
+    # the window of the other direction, relatively to its first sequence number
+    payload = counted & (plen > 0)
+    item = np.flatnonzero(payload | is_syn | syn_retrans | syn_ack | syn_ack_retrans)
+    item_win = 2 * grp[item] + server[item]
+    # Stable sorts keep the order of the packets in each window
+    item_order = np.argsort(item_win, kind='mergesort')
+    item, item_win = item[item_order], item_win[item_order]
+    item_seq = seq[item]
+    ref = item_seq[np.searchsorted(item_win, item_win)]
+    rel_seq = (item_seq - ref) % 4294967296
+    event = np.flatnonzero(is_data)
+    event_win = 2 * grp[event] + client[event]
+    event_order = np.argsort(event_win, kind='mergesort')
+    event, event_win = event[event_order], event_win[event_order]
+    ref_index = np.minimum(np.searchsorted(item_win, event_win), max(len(item) - 1, 0))
+    has_items = (item_win[ref_index] == event_win) if len(item) else np.zeros(len(event), dtype=bool)
+    event, event_win, ref_index = event[has_items], event_win[has_items], ref_index[has_items]
+    rel_ack = (acked[event] - item_seq[ref_index]) % 4294967296
+    bad[item_win[rel_seq >= 2147483648] // 2] = True
+    bad[event_win[rel_ack >= 2147483648] // 2] = True
+    # An ACK behind a previous one of its window acknowledges nothing more (see SeqWindow.ack)
+    if len(event):
+        rel_ack = np.maximum.accumulate(event_win * 4294967296 + rel_ack) - event_win * 4294967296
+
+    # A sequence number is new the first time it is sent, and then retransmitted until it is dropped from the SeqWindow
+    seq_order = np.argsort(item_win * 4294967296 + item_seq, kind='mergesort')
+    run_start = np.concatenate(([True], (item_win[seq_order][1:] != item_win[seq_order][:-1])
+                                | (item_seq[seq_order][1:] != item_seq[seq_order][:-1])))[:len(item)]
+    is_first = np.empty(len(item), dtype=bool)
+    is_first[seq_order] = run_start
+
+    # Unless its payload is first sent behind the cumulative ACK of the other direction (given by the SYN/ACK or the last ACK, since
+    # ACKs only go forward here): it is then never added to the SeqWindow (see is_behind_ack)
+    cum = np.flatnonzero(syn_ack | is_data)
+    cum_win = 2 * grp[cum] + client[cum]
+    cum_order = np.argsort(cum_win, kind='mergesort')
+    cum, cum_win = cum[cum_order], cum_win[cum_order]
+    cum_ref = np.minimum(np.searchsorted(item_win, cum_win), max(len(item) - 1, 0))
+    has_items = (item_win[cum_ref] == cum_win) if len(item) else np.zeros(len(cum), dtype=bool)
+    cum, cum_win, cum_ref = cum[has_items], cum_win[has_items], cum_ref[has_items]
+    cum_ack = (acked[cum] - item_seq[cum_ref]) % 4294967296
+    bad[cum_win[cum_ack >= 2147483648] // 2] = True
+    first = np.flatnonzero(is_first & payload[item])
+    last_cum = np.searchsorted(cum_win * nb_pkts + cum, item_win[first] * nb_pkts + item[first]) - 1
+    if len(cum):
+        first = first[(last_cum >= 0) & (cum_win[np.maximum(last_cum, 0)] == item_win[first])
+                      & (cum_ack[np.maximum(last_cum, 0)] > rel_seq[first])]
+    else:
+        first = first[:0]
+    behind = np.zeros(len(item), dtype=bool)
+    behind[first] = True
+    is_new = is_first & ~behind
+    first_sent = np.empty(len(item), dtype=np.int64)
+    first_sent[seq_order] = seq_order[np.flatnonzero(run_start)][np.cumsum(run_start) - 1]
+    last_sent = np.empty(len(item), dtype=np.int64)
+    last_sent[seq_order] = np.concatenate(([-1], seq_order[:-1]))
+
+    # New sequence numbers are acknowledged in order, by the first ACK after them that passes them
+    new = np.flatnonzero(is_new)
+    new_win = item_win[new]
+    win_end = np.searchsorted(event_win, new_win, 'right')
+    ack_index = np.maximum(first_greater_in_group(event_win, event, new_win, item[new], bound=nb_pkts),
+                           first_greater_in_group(event_win, rel_ack, new_win, rel_seq[new], bound=4294967296))
+    if len(new):
+        ack_index = np.maximum.accumulate(ack_index)
+    was_acked = ack_index < win_end
+    drop_index = first_greater_in_group(event_win, ts[event], new_win[was_acked],
+                                        ts[event[ack_index[was_acked]]] + ACKED_SEQ_TIMEOUT)
+    drop_pos = np.full(len(item), nb_pkts, dtype=np.int64)
+    drop_pos[new[was_acked]] = np.where(drop_index < win_end[was_acked], event[np.minimum(drop_index, max(len(event) - 1, 0))],
+                                        nb_pkts)
+    # Next payloads of a sequence number dropped from the SeqWindow (or never added) are behind the cumulative ACK too, and are not
+    # retransmissions in TIMESTAMP_RETRANS; connections with SYNs or SYN/ACKs in this case are processed packet per packet
+    retrans = np.flatnonzero(~is_first)
+    behind[retrans] = behind[first_sent[retrans]] | (item[retrans] > drop_pos[first_sent[retrans]])
+    bad[item_win[retrans[behind[retrans] & ~payload[item[retrans]]]] // 2] = True
+    retrans = retrans[~behind[retrans]]
+
+    good = ~bad
+    for lgrp in np.flatnonzero(good).tolist():
+        conn_id = conn_ids[lgrp]
+        if conn_id not in nb_acks[co.C2S]:
+            for direction in co.DIRECTIONS:
+                nb_acks[direction][conn_id] = {}
+        connections[conn_id].attr[co.BACKUP] = detect_backup_subflow(columns.opts.get(int(idx[syn_pos[lgrp]])))
+
+    counted_ok = np.flatnonzero(counted & good[grp])
+    # The ACKs of the client acknowledge the data sent by the server
+    values, counts = np.unique((2 * grp[counted_ok] + client[counted_ok]) * 4294967296 + bytes_acked[counted_ok], return_counts=True)
+    for value, count in zip(values.tolist(), counts.tolist()):
+        lgrp, bytes_acked_value = divmod(value, 4294967296)
+        nb_acks[co.S2C if lgrp % 2 else co.C2S][conn_ids[lgrp // 2]][bytes_acked_value] = count
+
+    new_payload = np.zeros(nb_pkts, dtype=bool)
+    new_payload[item[is_new]] = True
+    new_payload &= payload
+    for mask, direction, attr in [(counted & client, co.S2C, co.TIME_LAST_ACK_TCP), (counted & client & is_fin, co.S2C, co.TIME_FIN_ACK_TCP),
+                                  (counted & server, co.C2S, co.TIME_LAST_ACK_TCP), (counted & server & is_fin, co.C2S, co.TIME_FIN_ACK_TCP),
+                                  (payload & client, co.C2S, co.TIME_LAST_PAYLD_WITH_RETRANS_TCP),
+                                  (payload & server, co.S2C, co.TIME_LAST_PAYLD_WITH_RETRANS_TCP),
+                                  (new_payload & client, co.C2S, co.TIME_LAST_PAYLD_TCP), (new_payload & server, co.S2C, co.TIME_LAST_PAYLD_TCP)]:
+        pkts = np.flatnonzero(mask & good[grp])
+        pkts = pkts[last_of_groups(grp[pkts])]
+        for lgrp, ts_delta in zip(grp[pkts].tolist(), ts[pkts].tolist()):
+            connections[conn_ids[lgrp]].flow.attr[direction][attr] = ts_delta
+
+    # If SOCKS command
+    for pkt in np.flatnonzero(counted & client & (plen == 7) & good[grp]).tolist():
+        conn_id = conn_ids[grp[pkt]]
+        crypted_socks_cmd = columns.data.get(int(idx[pkt]))
+        # This is possible because of packet stripping
+        if connections[conn_id].attr.get(co.SOCKS_PORT, None) is None and len(crypted_socks_cmd) == 7:
+            decrypted_socks_cmd = socks_parser.decode(crypted_socks_cmd)
+            if decrypted_socks_cmd[0] == b'\x01':  # Connect
+                connections[conn_id].attr[co.SOCKS_DADDR] = socks_parser.get_ip_address(decrypted_socks_cmd)
+                connections[conn_id].attr[co.SOCKS_PORT] = socks_parser.get_port_number(decrypted_socks_cmd)
+
+    retrans = retrans[good[item_win[retrans] // 2]]
+    pkts = item[retrans]
+    ts_retrans = ts[pkts]
+    # Retransmissions of SYN/ACKs are also relative to the last packet of the client
+    last_done = np.where(client[pkts] | is_syn_ack[pkts], last_client[pkts], last_server[pkts])
+    for lwin, ts_delta, delta_first, delta_last, delta_done in zip(item_win[retrans].tolist(), ts_retrans.tolist(),
+                                                                   (ts_retrans - ts[item[first_sent[retrans]]]).tolist(),
+                                                                   (ts_retrans - ts[item[last_sent[retrans]]]).tolist(),
+                                                                   (ts_retrans - ts[last_done]).tolist()):
+        direction = co.S2C if lwin % 2 else co.C2S
+        connections[conn_ids[lwin // 2]].flow.attr[direction][co.TIMESTAMP_RETRANS].append((ts_delta, delta_first, delta_last, delta_done))
+
+    # Other connections are processed packet per packet, reading the columns by chunks
+    slow[matched[bad]] = True
+    slow_indices = np.sort(order[np.flatnonzero(slow[group])])
+    slow_max_ts = max_ts[slow_indices].tolist()
+    for i, packet in enumerate(columns.iter_packets(slow_indices)):
+        replay.expire(slow_max_ts[i])
+        replay.process_packet(packet)
 
+    return nb_acks
 
-def process_trace(pcap_filepath, graph_dir_exp, stat_dir_exp, failed_conns_dir_exp, acksize_tcp_dir_exp, tcpcsm, mptcp_connections=None, print_out=sys.stdout, light=False, return_dict=False):
-    """ Process a tcp pcap file and generate stats of its connections """
-    cmd = ['tstat', '-s', os.path.basename(pcap_filepath[:-5]), pcap_filepath]
 
+def compute_total_and_retrans_frames_columnar(columns, connections):
+    """ Set FRAMES_TOTAL, BYTES_FRAMES_TOTAL, FRAMES_RETRANS and BYTES_FRAMES_RETRANS of both directions of connections from the
+        TCPColumns of their trace, as the conversations of tshark -z conv,tcp (bytes are the original lengths of the frames)
+        A packet belongs to the connection of its 4-tuple (in any direction) that started last before it, or to the first one
+        A retransmission is a segment with payload, SYN or FIN that does not go beyond the highest sequence number sent before in its
+        direction, keep-alives excepted (as tcp.analysis.retransmission of tshark, without its heuristics for out-of-order segments)
+    """
+    conn_list = list(connections)
+    frames = np.zeros(2 * len(conn_list), dtype=np.int64)
+    frame_bytes = np.zeros(2 * len(conn_list), dtype=np.int64)
+    frames_retrans = np.zeros(2 * len(conn_list), dtype=np.int64)
+    frame_bytes_retrans = np.zeros(2 * len(conn_list), dtype=np.int64)
+
+    # Connections of each flow, as (flow, start, number in conn_list, 0 if the flow is from the client else 1)
+    inverse_conns = create_inverse_tcp_dictionary(connections)
+    conn_numbers = dict((conn_id, number) for number, conn_id in enumerate(conn_list))
+    rows = []
+    for flow, (saddr, sport, daddr, dport) in enumerate(columns.keys):
+        for key, from_server in [((saddr, sport, daddr, dport), 0), ((daddr, dport, saddr, sport), 1)]:
+            for conn_id in inverse_conns.get(key, []):
+                rows.append((flow, connections[conn_id].flow.attr.get(co.START, 0), conn_numbers[conn_id], from_server))
+
+    if rows and len(columns):
+        syn, fin, rst = dpkt.tcp.TH_SYN, dpkt.tcp.TH_FIN, dpkt.tcp.TH_RST
+        rows.sort()
+        row_flow, row_start, row_conn, row_from_server = [np.array(column, dtype=np.int64) for column in zip(*rows)]
+        # Packets of each flow, in the order of the trace
+        order = np.argsort(columns.flow, kind='mergesort')
+        flow = columns.flow[order]
+        flags = columns.flags[order]
+        frame_len = columns.frame_len[order]
+
+        first_row = np.searchsorted(row_flow, flow)
+        has_row = first_row < len(row_flow)
+        has_row[has_row] = row_flow[first_row[has_row]] == flow[has_row]
+        row = np.maximum(first_greater_in_group(row_flow, row_start, flow, columns.ts_delta[order]) - 1, first_row)[has_row]
+        slot = 2 * row_conn[row] + row_from_server[row]
+
+        # Sequence numbers relative to the first packet of the flow, and the highest one sent before each packet
+        flow_start = np.searchsorted(flow, flow)
+        seq = columns.seq[order]
+        rel_seq = (seq - seq[flow_start]) % 4294967296
+        is_ctrl = (flags & (syn | fin)) != 0
+        seg_len = np.maximum(columns.payload_len[order], 0)
+        highest = np.maximum.accumulate(flow * 8589934592 + rel_seq + seg_len + is_ctrl) - flow * 8589934592
+        has_prev = np.concatenate(([False], flow[1:] == flow[:-1]))
+        prev_highest = np.concatenate(([0], highest[:-1]))
+        keep_alive = (seg_len <= 1) & ~is_ctrl & ((flags & rst) == 0) & (rel_seq == prev_highest - 1)
+        retrans = (has_prev & ((seg_len > 0) | is_ctrl) & (rel_seq < prev_highest) & ~keep_alive)[has_row]
+
+        frames = np.bincount(slot, minlength=len(frames))
+        frame_bytes = np.bincount(slot, weights=frame_len[has_row], minlength=len(frames)).astype(np.int64)
+        frames_retrans = np.bincount(slot[retrans], minlength=len(frames))
+        frame_bytes_retrans = np.bincount(slot[retrans], weights=frame_len[has_row][retrans], minlength=len(frames)).astype(np.int64)
+
+    for number, conn_id in enumerate(conn_list):
+        for direction, slot in [(co.C2S, 2 * number), (co.S2C, 2 * number + 1)]:
+            connections[conn_id].flow.attr[direction][co.FRAMES_TOTAL] = int(frames[slot])
+            connections[conn_id].flow.attr[direction][co.BYTES_FRAMES_TOTAL] = int(frame_bytes[slot])
+            connections[conn_id].flow.attr[direction][co.FRAMES_RETRANS] = int(frames_retrans[slot])
+            connections[conn_id].flow.attr[direction][co.BYTES_FRAMES_RETRANS] = int(frame_bytes_retrans[slot])
+
+
+def process_trace(pcap_filepath, graph_dir_exp, stat_dir_exp, failed_conns_dir_exp, acksize_tcp_dir_exp, tcpcsm, mptcp_connections=None, print_out=sys.stdout, light=False, return_dict=False, columns_dir=None, shards=1, columns=None, fingerprint=None):
+    """ Process a tcp pcap file and generate stats of its connections
+        With shards > 1, MPTCP DSS retransmissions are computed by that many processes
+        columns are the TCPColumns of the trace if they were already loaded, else they are found by fingerprint (see get_tcp_columns)
+    """
     keep_tstat_log = False if return_dict else True
 
+    # Statistics of tstat are in a directory of their own, so that traces with the same name analyzed at once do not collide
+    tstat_dir = tempfile.mkdtemp(dir=os.getcwd())
     try:
-        connections = process_tstat_cmd(cmd, pcap_filepath, keep_log=keep_tstat_log, graph_dir_exp=graph_dir_exp)
+        with co.pcap_tool_path(pcap_filepath) as tool_pcap_path:
+            cmd = ['tstat', '-s', os.path.join(tstat_dir, os.path.basename(co.get_pcap_basepath(pcap_filepath))), tool_pcap_path]
+            connections = process_tstat_cmd(cmd, pcap_filepath, keep_log=keep_tstat_log, graph_dir_exp=graph_dir_exp)
     except TstatError as e:
         print(str(e) + ": skip process", file=sys.stderr)
         return
+    finally:
+        shutil.rmtree(tstat_dir, ignore_errors=True)
 
     # Directory containing all TCPConnections that tried to be MPTCP subflows, but failed to
     failed_conns = {}
@@ -1098,40 +2132,56 @@ def process_trace(pcap_filepath, graph_dir_exp, stat_dir_exp, failed_conns_dir_e
         retransmissions_tcpcsm(pcap_filepath, connections)
 
     acksize_all = {co.C2S: {}, co.S2C: {}}
-
-    if not light:
-        inverse_conns = create_inverse_tcp_dictionary(connections)
-
-        acksize_all = compute_tcp_acks_retrans(pcap_filepath, connections, inverse_conns)
-
     acksize_all_mptcp = {co.C2S: {}, co.S2C: {}}
 
     if mptcp_connections:
         fast_conns = get_preprocessed_connections(mptcp_connections)
+        # Match TCP connections with MPTCP subflows now: the DSS analyzer needs the start of subflows
+        mptcp_ids = {}
+        for flow_id in connections:
+            mptcp_ids[flow_id] = get_flow_name_connection_optimized(connections[flow_id], mptcp_connections, fast_conns=fast_conns)
+            if isinstance(mptcp_ids[flow_id][0], (int, long)):
+                mptcp_connections[mptcp_ids[flow_id][0]].flows[mptcp_ids[flow_id][1]].attr[co.START] = connections[flow_id].flow.attr[co.START]
+
+    if not light:
+        # Only one read of the trace (or of its cached columns) for all analyzers; ack sizes are computed at once on the columns
+        analyzers = []
+        if mptcp_connections and shards <= 1:
+            analyzers.append(MPTCPDSSRetransAnalyzer(mptcp_connections, fast_conns))
+        print("Computing TCP ack sizes" + (" and MPTCP DSS retransmissions" if mptcp_connections else "") + " for", pcap_filepath)
+        if columns is None:
+            columns = get_tcp_columns(pcap_filepath, analyzers=analyzers, columns_dir=columns_dir, fingerprint=fingerprint)
+        elif analyzers:
+            for packet in columns.iter_packets():
+                for analyzer in analyzers:
+                    analyzer.process_packet(packet)
+        if mptcp_connections and shards > 1:
+            analyzers.append(compute_mptcp_dss_retransmissions_sharded(columns, mptcp_connections, fast_conns, shards))
+        acksize_all = compute_tcp_acks_retrans_columnar(columns, connections, create_inverse_tcp_dictionary(connections))
+        compute_total_and_retrans_frames_columnar(columns, connections)
+
+    if mptcp_connections:
         for flow_id in connections:
             # Copy info to mptcp connections
             copy_info_to_mptcp_connections(connections, mptcp_connections, failed_conns, acksize_all, acksize_all_mptcp, flow_id,
-                                           fast_conns=fast_conns)
+                                           mptcp_ids=mptcp_ids[flow_id])
 
         if not light:
             for conn_id, conn in mptcp_connections.iteritems():
                 for direction in co.DIRECTIONS:
-                    max_ack = timedelta(0)
-                    max_payload = timedelta(0)
+                    max_ack = 0
+                    max_payload = 0
                     for flow_id, flow in conn.flows.iteritems():
-                        if co.TIME_LAST_ACK_TCP in flow.attr[direction] and (flow.attr[direction][co.TIME_LAST_ACK_TCP] - max_ack).total_seconds() > 0.0:
+                        if co.TIME_LAST_ACK_TCP in flow.attr[direction] and flow.attr[direction][co.TIME_LAST_ACK_TCP] > max_ack:
                             max_ack = flow.attr[direction][co.TIME_LAST_ACK_TCP]
 
-                        if co.TIME_LAST_PAYLD_TCP in flow.attr[direction] and (flow.attr[direction][co.TIME_LAST_PAYLD_TCP] - max_payload).total_seconds() > 0.0:
+                        if co.TIME_LAST_PAYLD_TCP in flow.attr[direction] and flow.attr[direction][co.TIME_LAST_PAYLD_TCP] > max_payload:
                             max_payload = flow.attr[direction][co.TIME_LAST_PAYLD_TCP]
 
                     mptcp_connections[conn_id].attr[direction][co.TIME_LAST_ACK_TCP] = max_ack
                     mptcp_connections[conn_id].attr[direction][co.TIME_LAST_PAYLD_TCP] = max_payload
 
-            try:
-                compute_mptcp_dss_retransmissions(pcap_filepath, mptcp_connections, fast_conns)
-            except dpkt.NeedData as e:
-                print(e, ": trying to continue...", file=sys.stderr)
+            analyzers[0].finish()
 
     if return_dict:
         if mptcp_connections:
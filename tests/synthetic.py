@@ -0,0 +1,82 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2015 Matthieu Baerts & Quentin De Coninck
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Synthetic traces for the checks of the tests directory
+
+from __future__ import print_function
+
+import fractions
+import socket
+import struct
+
+import dpkt
+
+import common as co
+import tcp
+
+SYN, RST, ACK, FIN = dpkt.tcp.TH_SYN, dpkt.tcp.TH_RST, dpkt.tcp.TH_ACK, dpkt.tcp.TH_FIN
+# MP_CAPABLE of the third ACK: subtype and version, flags, keys of the sender and of the receiver
+MP_CAPABLE_ACK_OPT = struct.Struct('!BBQQ')
+
+
+def mptcp_option(subtype_struct, *fields):
+    """ Return the bytes of a MPTCP option whose fields (the first one including the subtype) have the layout subtype_struct """
+    body = subtype_struct.pack(*fields)
+    return struct.pack('!BB', tcp.TCP_OPT_MPTCP, len(body) + 2) + body
+
+
+def mp_capable_option(sender_key, receiver_key=None):
+    """ Return the bytes of a MP_CAPABLE option (version 0, with checksums), with the key of the receiver in the third ACK """
+    if receiver_key is None:
+        return mptcp_option(tcp.MP_CAPABLE_OPT, tcp.MP_CAPABLE << 4, 0x81, sender_key)
+    return mptcp_option(MP_CAPABLE_ACK_OPT, tcp.MP_CAPABLE << 4, 0x81, sender_key, receiver_key)
+
+
+def dss_option(dack=None, dsn=None, data_len=100, subflow_seq=1, dack_is_8_bytes=False, dsn_is_8_bytes=False):
+    """ Return the bytes of a MPTCP DSS option with the Data ACK dack and the mapping of data_len bytes at dsn (if not None) """
+    flags = 0
+    body = b''
+    if dack is not None:
+        flags |= tcp.DSS_DACK_PRESENT | (tcp.DSS_DACK_8_BYTES if dack_is_8_bytes else 0)
+        body += (tcp.UINT64_OPT if dack_is_8_bytes else tcp.UINT32_OPT).pack(dack % (2**64 if dack_is_8_bytes else 2**32))
+    if dsn is not None:
+        flags |= tcp.DSS_DSN_PRESENT | (tcp.DSS_DSN_8_BYTES if dsn_is_8_bytes else 0)
+        body += (tcp.UINT64_OPT if dsn_is_8_bytes else tcp.UINT32_OPT).pack(dsn % (2**64 if dsn_is_8_bytes else 2**32))
+        body += tcp.DSS_MAPPING_OPT.pack(subflow_seq, data_len)
+    body = tcp.DSS_OPT.pack(tcp.DSS << 4, flags) + body
+    return struct.pack('!BB', tcp.TCP_OPT_MPTCP, len(body) + 2) + body
+
+
+def write_pcap(pcap_filepath, packets):
+    """ Write a pcap file (with timestamps in nanoseconds) of packets, as tuples
+        (ts in ns, saddr, daddr, sport, dport, seq, ack, flags, data, opts), with addresses in the dotted notation
+    """
+    with open(pcap_filepath, 'wb') as pcap_file:
+        writer = dpkt.pcap.Writer(pcap_file, nano=True)
+        for ts, saddr, daddr, sport, dport, seq, ack, flags, data, opts in packets:
+            # Pad the options with NOPs
+            opts += b'\x01' * (-len(opts) % 4)
+            segment = dpkt.tcp.TCP(sport=sport, dport=dport, seq=seq % 2**32, ack=ack % 2**32, flags=flags, opts=opts, data=data)
+            segment.off = (20 + len(opts)) // 4
+            ip = dpkt.ip.IP(src=socket.inet_aton(saddr), dst=socket.inet_aton(daddr), p=dpkt.ip.IP_PROTO_TCP, data=segment)
+            ip.len = len(ip)
+            frame = dpkt.ethernet.Ethernet(type=dpkt.ethernet.ETH_TYPE_IP, data=ip)
+            # A float would not have the precision of a nanosecond
+            writer.writepkt(str(frame), ts=fractions.Fraction(ts, co.NS_PER_SEC))
@@ -0,0 +1,104 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2015 Matthieu Baerts & Quentin De Coninck
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Checks of the MPTCP DSS retransmissions found by tcp.MPTCPDSSRetransAnalyzer
+#  To run from the root of the repository: python -m unittest discover tests
+
+from __future__ import print_function
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import common as co
+import mptcp
+import tcp
+
+from synthetic import ACK, SYN, dss_option
+
+CLIENT, SERVER = tcp.pack_ip_address('10.0.0.1'), tcp.pack_ip_address('8.8.8.8')
+START = 1400000000 * co.NS_PER_SEC
+MS = co.NS_PER_SEC // 1000
+
+
+def get_mptcp_connections():
+    """ Return the MPTCP connection 1 with one subflow from CLIENT:1000 to SERVER:80 """
+    connection = mptcp.MPTCPConnection(1)
+    connection.attr[co.START] = START
+    connection.attr[co.DURATION] = '60'
+    for direction in co.DIRECTIONS:
+        connection.attr[direction][co.TIME_LAST_ACK_TCP] = START + 60 * co.NS_PER_SEC
+        connection.attr[direction][co.RETRANS_DSS] = []
+    flow = mptcp.MPTCPSubFlow('a2b')
+    flow.attr.update({co.SADDR: '10.0.0.1', co.DADDR: '8.8.8.8', co.SPORT: '1000', co.DPORT: '80', co.START: START})
+    connection.flows[0] = flow
+    return {1: connection}
+
+
+class TestSeqWindowWidths(unittest.TestCase):
+
+    def test_dsn_on_4_bytes_data_ack_on_8_bytes(self):
+        window = tcp.SeqWindow()
+        window.add(0x2000, [0, 0], modulo=2**32)
+        # Only the 4 low bytes of the Data ACK tell what is acknowledged: 0x1000 is before 0x2000
+        window.ack(0x1234567800001000, 0, modulo=2**64)
+        self.assertEqual(list(window.unacked), [0x2000])
+        window.ack(0x1234567800002064, 0, modulo=2**64)
+        self.assertEqual(list(window.unacked), [])
+
+    def test_dsn_on_8_bytes_data_ack_on_4_bytes(self):
+        window = tcp.SeqWindow()
+        window.add(0x1234567800002000, [0, 0], modulo=2**64)
+        window.ack(0x1000, 0, modulo=2**32)
+        self.assertEqual(list(window.unacked), [0x1234567800002000])
+        window.ack(0x2064, 0, modulo=2**32)
+        self.assertEqual(list(window.unacked), [])
+
+
+class TestMixedWidthRetransmission(unittest.TestCase):
+
+    def test_late_retransmission_of_dsn_on_4_bytes(self):
+        """ A DSN on 4 bytes never acknowledged by Data ACKs on 8 bytes is still a DSS retransmission after ACKED_SEQ_TIMEOUT """
+        dack_server = 0x1234567800001000
+        packets = [(0, CLIENT, SERVER, 1000, 80, 1, 0, SYN, b'', 0),
+                   (10 * MS, SERVER, CLIENT, 80, 1000, 1, 2, SYN | ACK, b'', 0),
+                   (20 * MS, CLIENT, SERVER, 1000, 80, 2, 2, ACK, dss_option(dack=0x500), 0),
+                   (30 * MS, SERVER, CLIENT, 80, 1000, 2, 2, ACK, dss_option(dack=dack_server, dack_is_8_bytes=True), 0),
+                   (40 * MS, CLIENT, SERVER, 1000, 80, 2, 2, ACK, dss_option(dack=0x500, dsn=0x2000), 100),
+                   (50 * MS, SERVER, CLIENT, 80, 1000, 2, 102, ACK, dss_option(dack=dack_server, dack_is_8_bytes=True), 0),
+                   (tcp.ACKED_SEQ_TIMEOUT + 100 * MS, SERVER, CLIENT, 80, 1000, 2, 102, ACK,
+                    dss_option(dack=dack_server, dack_is_8_bytes=True), 0),
+                   (tcp.ACKED_SEQ_TIMEOUT + 200 * MS, CLIENT, SERVER, 1000, 80, 102, 2, ACK, dss_option(dack=0x500, dsn=0x2000), 100)]
+        connections = get_mptcp_connections()
+        analyzer = tcp.MPTCPDSSRetransAnalyzer(connections, tcp.get_preprocessed_connections(connections))
+        for ts_delta, saddr, daddr, sport, dport, seq, ack, flags, opts, payload_len in packets:
+            analyzer.process_packet(tcp.TCPPacket(START + ts_delta, saddr, daddr, sport, dport, seq, ack, flags, opts, payload_len, b''))
+        analyzer.finish()
+
+        retrans = connections[1].attr[co.C2S][co.RETRANS_DSS]
+        self.assertEqual(len(retrans), 1)
+        ts_delta, flow_id, dsn = retrans[0][:3]
+        self.assertEqual((ts_delta, flow_id, dsn), (START + tcp.ACKED_SEQ_TIMEOUT + 200 * MS, 0, 0x2000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2015 Matthieu Baerts & Quentin De Coninck
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Checks of the built-in engine rebuilding MPTCP connections (see mptcp.reconstruct_mptcp_connections) on a trace with two
+#  subflows and a reinjection, and of its comparison with mptcptrace (see mptcp.check_with_mptcptrace)
+#  To run from the root of the repository: python -m unittest discover tests
+
+from __future__ import print_function
+
+import copy
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import common as co
+import mptcp
+import tcp
+
+from synthetic import ACK, SYN, dss_option, mp_capable_option, mptcp_option, write_pcap
+
+START = 1400000000 * co.NS_PER_SEC
+MS = co.NS_PER_SEC // 1000
+WIFI, CELL, SERVER = '192.168.1.2', '10.1.0.2', '8.8.8.8'
+CLIENT_KEY, SERVER_KEY = 0x0102030405060708, 0x1112131415161718
+
+
+def get_packets():
+    """ Return the packets of a MPTCP connection from WIFI:1000 with a second subflow from CELL:2000 to SERVER:80
+        The client sends 3000 bytes: the second map of 1000 bytes, sent on the first subflow, is reinjected on the second one,
+        that then sends the last map
+    """
+    server_token, server_idsn = mptcp.get_token_and_idsn(SERVER_KEY)
+    client_dsn = mptcp.get_token_and_idsn(CLIENT_KEY)[1] + 1
+    server_dsn = server_idsn + 1
+
+    def data(ts, saddr, sport, seq, subflow_seq, dsn):
+        return (START + ts * MS, saddr, SERVER, sport, 80, seq, 1, ACK, b'x' * 1000,
+                dss_option(dack=server_dsn, dsn=client_dsn + dsn, data_len=1000, subflow_seq=subflow_seq))
+
+    def data_ack(ts, daddr, dport, ack, dack):
+        return (START + ts * MS, SERVER, daddr, 80, dport, 1, ack, ACK, b'', dss_option(dack=client_dsn + dack))
+
+    return [(START, WIFI, SERVER, 1000, 80, 0, 0, SYN, b'', mp_capable_option(CLIENT_KEY)),
+            (START + 10 * MS, SERVER, WIFI, 80, 1000, 0, 1, SYN | ACK, b'', mp_capable_option(SERVER_KEY)),
+            (START + 20 * MS, WIFI, SERVER, 1000, 80, 1, 1, ACK, b'', mp_capable_option(CLIENT_KEY, SERVER_KEY)),
+            (START + 30 * MS, CELL, SERVER, 2000, 80, 0, 0, SYN, b'', mptcp_option(tcp.MP_JOIN_SYN_OPT, tcp.MP_JOIN << 4, 1,
+                                                                                    server_token, 1)),
+            (START + 40 * MS, SERVER, CELL, 80, 2000, 0, 1, SYN | ACK, b'', mptcp_option(tcp.MP_JOIN_SYN_ACK_OPT, tcp.MP_JOIN << 4, 0,
+                                                                                         b'h' * 8, 2)),
+            (START + 50 * MS, CELL, SERVER, 2000, 80, 1, 1, ACK, b'', mptcp_option(tcp.MP_JOIN_ACK_OPT, tcp.MP_JOIN << 4, b'h' * 20)),
+            data(100, WIFI, 1000, 1, 1, 0),
+            data(110, WIFI, 1000, 1001, 1001, 1000),
+            data_ack(150, WIFI, 1000, 1001, 1000),
+            # The second map is lost on the first subflow: reinjection on the second one
+            data(400, CELL, 2000, 1, 1, 1000),
+            data_ack(450, CELL, 2000, 1001, 2000),
+            data(500, CELL, 2000, 1001, 1001, 2000),
+            data_ack(540, CELL, 2000, 2001, 3000)]
+
+
+class ReinjectionTraceTestCase(unittest.TestCase):
+
+    """ Tests on the connections rebuilt by the built-in engine from the trace of get_packets, as self.results """
+
+    def setUp(self):
+        # Interfaces of subflows are told by the prefixes of addresses of the configuration
+        self.prefix_ip_wifi = co.PREFIX_IP_WIFI
+        co.PREFIX_IP_WIFI = co.PREFIX_IP_WIFI or co.PREFIX_WIFI_IF
+        self.tmp_dir = tempfile.mkdtemp()
+        self.pcap_filepath = os.path.join(self.tmp_dir, 'trace.pcap')
+        write_pcap(self.pcap_filepath, get_packets())
+        self.results = mptcp.reconstruct_mptcp_connections(tcp.get_tcp_columns(self.pcap_filepath))
+
+    def tearDown(self):
+        co.PREFIX_IP_WIFI = self.prefix_ip_wifi
+        shutil.rmtree(self.tmp_dir)
+
+
+class TestReinjection(ReinjectionTraceTestCase):
+
+    def test_connection(self):
+        connections, rtt_all, acksize_all, seq_rows = self.results
+        self.assertEqual(list(connections), [1])
+        connection = connections[1]
+        self.assertEqual(len(connection.flows), 2)
+        self.assertEqual(connection.flows[0].attr[co.IF], co.WIFI)
+        self.assertEqual(connection.flows[1].attr[co.IF], co.CELL)
+        self.assertEqual(connection.attr[co.C2S][co.BYTES_MPTCPTRACE], 3000)
+        self.assertEqual(connection.attr[co.S2C][co.BYTES_MPTCPTRACE], 0)
+
+    def test_reinjection(self):
+        connections, rtt_all, acksize_all, seq_rows = self.results
+        connection = connections[1]
+        self.assertEqual(connection.attr[co.C2S][co.REINJ_BYTES], 1000)
+        # Reinjections are counted on the subflow of the original data
+        self.assertEqual(connection.flows[0].attr[co.C2S][co.REINJ_ORIG_PACKS], 1)
+        self.assertEqual(connection.flows[0].attr[co.C2S][co.REINJ_ORIG_BYTES], 1000)
+        self.assertEqual(connection.flows[1].attr[co.C2S][co.REINJ_ORIG_PACKS], 0)
+        self.assertEqual(connection.flows[1].attr[co.C2S][co.REINJ_ORIG_BYTES], 0)
+        self.assertEqual(connection.flows[1].attr[co.C2S][co.IS_REINJ], {mptcp.get_time_text(START + 400 * MS): 1000})
+        self.assertIn(mptcp.get_time_text(START + 400 * MS) + ',1000,2,1,2000,1', seq_rows[1, co.C2S])
+
+    def test_bursts_rtts_and_acksizes(self):
+        connections, rtt_all, acksize_all, seq_rows = self.results
+        attr = connections[1].attr[co.C2S]
+        self.assertEqual([burst[:3] for burst in attr[co.BURSTS]], [(0, 2000, 2), (1, 2000, 2)])
+        # The reinjected data gives no RTT sample (Karn's algorithm)
+        self.assertEqual(attr[co.RTT_SAMPLES], 2)
+        self.assertAlmostEqual(attr[co.RTT_MIN], 40.0)
+        self.assertAlmostEqual(attr[co.RTT_MAX], 50.0)
+        self.assertEqual(acksize_all[co.C2S][1], {1000: 2})
+
+
+class TestCheckWithMPTCPTrace(ReinjectionTraceTestCase):
+
+    def check(self, mptcptrace_results):
+        """ Return the number of differences found by check_with_mptcptrace if mptcptrace gives mptcptrace_results """
+        run_mptcptrace = mptcp.run_mptcptrace
+        mptcp.run_mptcptrace = lambda *args: mptcptrace_results
+        try:
+            return mptcp.check_with_mptcptrace(self.pcap_filepath, self.results[0], self.results[2])
+        finally:
+            mptcp.run_mptcptrace = run_mptcptrace
+
+    def test_same_results(self):
+        connections, rtt_all, acksize_all, seq_rows = copy.deepcopy(self.results)
+        # RTTs of mptcptrace are computed from times with a precision of a microsecond
+        connections[1].attr[co.C2S][co.RTT_MAX] += 0.001
+        self.assertEqual(self.check((connections, rtt_all, acksize_all)), 0)
+
+    def test_different_results(self):
+        connections, rtt_all, acksize_all, seq_rows = copy.deepcopy(self.results)
+        connections[1].flows[0].attr[co.C2S][co.REINJ_ORIG_PACKS] = 0
+        connections[1].attr[co.C2S][co.BURSTS].pop()
+        connections[1].attr[co.C2S][co.RTT_MIN] = 45.0
+        acksize_all[co.C2S][1] = {2000: 1}
+        self.assertEqual(self.check((connections, rtt_all, acksize_all)), 4)
+
+    def test_mptcptrace(self):
+        differences = mptcp.check_with_mptcptrace(self.pcap_filepath, self.results[0], self.results[2], scratch_dir=self.tmp_dir)
+        if differences is None:
+            self.skipTest("mptcptrace is not installed")
+        self.assertEqual(differences, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2015 Matthieu Baerts & Quentin De Coninck
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Checks that tcp.compute_tcp_acks_retrans_columnar finds the same retransmissions as tcp.TCPAcksRetransAnalyzer
+#  on random traces
+#  To run from the root of the repository: python -m unittest discover tests
+
+from __future__ import print_function
+
+import copy
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import common as co
+import tcp
+
+from synthetic import ACK, FIN, RST, SYN, write_pcap
+
+START = 1400000000 * co.NS_PER_SEC
+US = co.NS_PER_SEC // 1000000
+NB_SEEDS = 40
+
+
+def random_delay(rng, max_delay):
+    """ Return a random delay lower than max_delay, in ns but with a precision of a microsecond """
+    return rng.randrange(0, max_delay) // US * US
+
+
+class TraceGenerator(object):
+
+    """ Generate random TCP connections with retransmissions (of SYNs too), backward ACKs, RSTs, FINs and idle periods
+        longer than tcp.ACKED_SEQ_TIMEOUT; some connections are not in the connections given to the analyses
+        events counts the number of each of these cases generated
+    """
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.connections = {}
+        self.packets = []
+        self.events = {'retrans': 0, 'backward_ack': 0, 'rst': 0, 'idle': 0}
+
+    def generate(self, nb_conns):
+        for conn_id in range(1, nb_conns + 1):
+            self.generate_connection(conn_id)
+        self.packets.sort(key=lambda packet: packet[0])
+        return self.connections, self.packets
+
+    def generate_connection(self, conn_id):
+        rng = self.rng
+        client = '10.0.0.' + str(rng.randrange(1, 4))
+        server = '8.8.8.' + str(rng.randrange(1, 3))
+        sport = rng.randrange(1000, 1010)
+        self.ts = START + random_delay(rng, 200 * co.NS_PER_SEC)
+        if rng.random() < 0.9:
+            connection = tcp.TCPConnection(conn_id)
+            connection.attr = {}
+            connection.flow.attr = {co.SADDR: client, co.DADDR: server, co.SPORT: str(sport), co.DPORT: '80',
+                                    co.START: self.ts + rng.choice([0, 0, 0, US, 7 * co.NS_PER_SEC]),
+                                    co.C2S: {co.TIMESTAMP_RETRANS: []}, co.S2C: {co.TIMESTAMP_RETRANS: []}}
+            self.connections[conn_id] = connection
+
+        def emit(from_client, flags, seq, ack, payload_len, data=b''):
+            data = data or b'x' * payload_len
+            if from_client:
+                self.packets.append((self.ts, client, server, sport, 80, seq, ack, flags, data, b''))
+            else:
+                self.packets.append((self.ts, server, client, 80, sport, seq, ack, flags, data, b''))
+
+        # Initial sequence numbers, possibly close to the wraparound
+        isn_client = rng.choice([rng.randrange(0, 2**32), 2**32 - rng.randrange(1, 3000)])
+        isn_server = rng.choice([rng.randrange(0, 2**32), 2**32 - rng.randrange(1, 3000)])
+        emit(True, SYN, isn_client, 0, 0)
+        for _ in range(rng.choice([0, 0, 0, 1, 2])):
+            self.ts += random_delay(rng, 3 * co.NS_PER_SEC)
+            emit(True, SYN, isn_client if rng.random() < 0.8 else isn_client + 5, 0, 0)
+        self.ts += random_delay(rng, co.NS_PER_SEC // 10)
+        if rng.random() < 0.95:
+            for _ in range(rng.choice([1, 1, 1, 1, 2])):
+                emit(False, SYN | ACK, isn_server, isn_client + 1, 0)
+                self.ts += random_delay(rng, co.NS_PER_SEC // 5)
+
+        seq = {True: isn_client + 1, False: isn_server + 1}
+        ack = {True: isn_server + 1, False: isn_client + 1}
+        sent = {True: [], False: []}
+        for _ in range(rng.randrange(1, 40)):
+            if rng.random() < 0.9:
+                delay = random_delay(rng, rng.choice([co.NS_PER_SEC // 10, 12 * co.NS_PER_SEC]))
+            else:
+                delay = random_delay(rng, 70 * co.NS_PER_SEC)
+            if delay > tcp.ACKED_SEQ_TIMEOUT:
+                self.events['idle'] += 1
+            self.ts += delay
+            from_client = rng.random() < 0.5
+            event = rng.random()
+            if event < 0.15 and sent[from_client]:
+                self.events['retrans'] += 1
+                emit(from_client, ACK, rng.choice(sent[from_client]), ack[from_client], 100)
+            elif event < 0.2:
+                self.events['backward_ack'] += 1
+                emit(from_client, ACK, seq[from_client], ack[from_client] - rng.randrange(1, 300), 0)
+            elif event < 0.22:
+                # So far backward that it looks like a forward ACK
+                self.events['backward_ack'] += 1
+                emit(from_client, ACK, seq[from_client], ack[from_client] + 2**31 + 5, 0)
+            elif event < 0.25:
+                self.events['rst'] += 1
+                emit(from_client, RST, seq[from_client], 0, 0)
+            elif event < 0.3:
+                emit(from_client, ACK | FIN, seq[from_client], ack[from_client], 0)
+            else:
+                payload_len = rng.choice([0, 7, 100, 1400])
+                # Payloads of 7 bytes are kept in the columns, as SOCKS commands
+                emit(from_client, ACK, seq[from_client], ack[from_client], payload_len,
+                     data=b'\x01abcdef' if payload_len == 7 else b'')
+                if payload_len:
+                    sent[from_client].append(seq[from_client])
+                seq[from_client] += payload_len
+                if rng.random() < 0.8:
+                    ack[not from_client] = seq[from_client] - rng.choice([0, 0, 0, 100])
+
+
+class TestAcksRetransColumnar(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def check_trace(self, seed):
+        """ Check both analyses on the trace generated from seed and return the events it contains """
+        generator = TraceGenerator(seed)
+        connections, packets = generator.generate(generator.rng.randrange(1, 40))
+        pcap_filepath = os.path.join(self.tmp_dir, 'trace_' + str(seed) + '.pcap')
+        write_pcap(pcap_filepath, packets)
+
+        conns_analyzer, conns_columnar = copy.deepcopy(connections), copy.deepcopy(connections)
+        analyzer = tcp.TCPAcksRetransAnalyzer(conns_analyzer, tcp.create_inverse_tcp_dictionary(conns_analyzer))
+        columns = tcp.get_tcp_columns(pcap_filepath, analyzers=[analyzer])
+        nb_acks = tcp.compute_tcp_acks_retrans_columnar(columns, conns_columnar, tcp.create_inverse_tcp_dictionary(conns_columnar))
+
+        self.assertEqual(analyzer.nb_acks, nb_acks, "seed " + str(seed))
+        for conn_id in connections:
+            self.assertEqual(conns_analyzer[conn_id].attr, conns_columnar[conn_id].attr, "seed " + str(seed))
+            self.assertEqual(conns_analyzer[conn_id].flow.attr, conns_columnar[conn_id].flow.attr, "seed " + str(seed))
+
+        events = dict(generator.events)
+        events['retrans_found'] = sum(len(conn.flow.attr[direction][co.TIMESTAMP_RETRANS])
+                                      for conn in conns_analyzer.values() for direction in co.DIRECTIONS)
+        return events
+
+    def test_random_traces(self):
+        events = {}
+        for seed in range(NB_SEEDS):
+            for name, count in self.check_trace(seed).iteritems():
+                events[name] = events.get(name, 0) + count
+
+        # The traces must have covered each case
+        for name in ['retrans', 'retrans_found', 'backward_ack', 'rst', 'idle']:
+            self.assertGreater(events[name], 0, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2015 Matthieu Baerts & Quentin De Coninck
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  Checks of the cache of the TCP columns of traces (see tcp.get_tcp_columns)
+#  To run from the root of the repository: python -m unittest discover tests
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import common as co
+import tcp
+
+from synthetic import ACK, write_pcap
+
+START = 1400000000 * co.NS_PER_SEC
+
+
+def get_packets(seq):
+    """ Return two packets of 100 bytes from 10.0.0.1:1000 to 8.8.8.8:80, the first one at seq """
+    return [(START + i * co.NS_PER_SEC, '10.0.0.1', '8.8.8.8', 1000, 80, seq + i * 100, 1, ACK, b'x' * 100, b'') for i in range(2)]
+
+
+class TestColumnsCache(unittest.TestCase):
+
+    def setUp(self):
+        # Sample single bytes of the traces (not their sequence numbers), so that a rewrite is only seen by its modification time
+        self.block_size = co.FINGERPRINT_BLOCK_SIZE
+        co.FINGERPRINT_BLOCK_SIZE = 1
+        self.tmp_dir = tempfile.mkdtemp()
+        self.columns_dir = os.path.join(self.tmp_dir, 'columns')
+        os.mkdir(self.columns_dir)
+        self.pcap_filepath = os.path.join(self.tmp_dir, 'trace.pcap')
+        write_pcap(self.pcap_filepath, get_packets(1))
+
+    def tearDown(self):
+        co.FINGERPRINT_BLOCK_SIZE = self.block_size
+        shutil.rmtree(self.tmp_dir)
+
+    def rewrite_in_place(self, seq):
+        """ Rewrite the trace with packets from seq, with the same size and inode but a new modification time """
+        stat = os.stat(self.pcap_filepath)
+        new_filepath = os.path.join(self.tmp_dir, 'new.pcap')
+        write_pcap(new_filepath, get_packets(seq))
+        with open(self.pcap_filepath, 'r+b') as pcap_file, open(new_filepath, 'rb') as new_file:
+            pcap_file.write(new_file.read())
+        os.utime(self.pcap_filepath, (stat.st_atime, stat.st_mtime + 10))
+        self.assertEqual(os.stat(self.pcap_filepath).st_size, stat.st_size)
+
+    def test_rewritten_in_place(self):
+        columns = tcp.get_tcp_columns(self.pcap_filepath, columns_dir=self.columns_dir)
+        self.assertEqual(list(columns.seq), [1, 101])
+        self.rewrite_in_place(5001)
+        columns = tcp.get_tcp_columns(self.pcap_filepath, columns_dir=self.columns_dir)
+        self.assertEqual(list(columns.seq), [5001, 5101])
+
+    def test_copy_with_fingerprint(self):
+        fingerprint = co.get_pcap_fingerprint(self.pcap_filepath)
+        tcp.get_tcp_columns(self.pcap_filepath, columns_dir=self.columns_dir, fingerprint=fingerprint)
+        # A new copy of the input has other modification time and inode, but the same columns
+        copy_filepath = os.path.join(self.tmp_dir, 'copy.pcap')
+        shutil.copy(self.pcap_filepath, copy_filepath)
+        os.utime(copy_filepath, None)
+        nb_columns = len(os.listdir(self.columns_dir))
+        columns = tcp.get_tcp_columns(copy_filepath, columns_dir=self.columns_dir, fingerprint=fingerprint)
+        self.assertEqual(list(columns.seq), [1, 101])
+        self.assertEqual(len(os.listdir(self.columns_dir)), nb_columns)
+
+
+if __name__ == '__main__':
+    unittest.main()